@@ -2,6 +2,8 @@ import os
 from datetime import timedelta
 
 from celery import Celery
+from celery.signals import worker_process_shutdown
+from prometheus_client import multiprocess
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
 
@@ -13,5 +15,17 @@ app.conf.beat_schedule = {
     "check_habits_by_interval": {
         "task": "habits.tasks.check_habits",
         "schedule": timedelta(minutes=1),
-    }
+    },
+    "dispatch_outbox_by_interval": {
+        "task": "habits.tasks.dispatch_outbox",
+        "schedule": timedelta(minutes=1),
+    },
 }
+
+
+@worker_process_shutdown.connect
+def mark_metrics_process_dead(pid, **kwargs) -> None:
+    """Drops live metrics of a finished worker process."""
+
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.mark_process_dead(pid)
@@ -0,0 +1,96 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+from datetime import UTC, datetime
+
+# attributes every record has, the others were passed in `extra`
+RECORD_ATTRS = {*vars(logging.makeLogRecord({})), "message", "asctime"}
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """
+    Only puts records to a queue, its listener thread hands them over to
+    the actual handlers, so logging doesn't wait for writes.
+    The listener is started by the first record of every process, as forked
+    processes (gunicorn and celery workers) don't inherit the thread.
+    """
+
+    def __init__(self, queue) -> None:
+        super().__init__(queue)
+        self._pid = None
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        # called under the handler's lock, so the listener is started once
+        if self._pid != os.getpid():
+            self._start_listener()
+        super().enqueue(record)
+
+    def _start_listener(self) -> None:
+        # a queue inherited from the parent might have been locked at fork
+        self.queue = self.listener.queue = queue.Queue()
+        self.listener._thread = None
+        self.listener.start()
+        self._pid = os.getpid()
+        atexit.register(self.listener.stop)
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as JSON objects, including fields passed in `extra`."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": datetime.fromtimestamp(record.created, UTC).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        data.update(
+            (name, value)
+            for name, value in vars(record).items()
+            if name not in RECORD_ATTRS
+        )
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Lets through `rate` share of DEBUG records and all records of other levels."""
+
+    def __init__(self, rate: float = 1) -> None:
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno > logging.DEBUG or random.random() < self.rate
+
+
+class RotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    Size rotated log file written by several processes. A process whose
+    file was already rotated by another one reopens the new file instead
+    of rotating it again.
+    """
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if not super().shouldRollover(record):
+            return False
+        if self.stream is None or not self._rotated_elsewhere():
+            return True
+
+        self.stream.close()
+        self.stream = self._open()
+        return super().shouldRollover(record)
+
+    def _rotated_elsewhere(self) -> bool:
+        try:
+            return (
+                os.stat(self.baseFilename).st_ino
+                != os.fstat(self.stream.fileno()).st_ino
+            )
+        except FileNotFoundError:
+            return True
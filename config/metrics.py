@@ -0,0 +1,101 @@
+import glob
+import os
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+http_request_duration = Histogram(
+    "http_request_duration_seconds",
+    "Latency of api requests by route name",
+    ["route", "method", "status"],
+)
+http_request_queries = Histogram(
+    "http_request_db_queries",
+    "Database queries made by api requests by route name",
+    ["route", "method"],
+    buckets=(1, 2, 3, 5, 8, 13, 21, 34, 55, 100),
+)
+
+
+class MetricsMiddleware:
+    """Records latency and count of database queries of every request."""
+
+    def __init__(self, get_response) -> None:
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = 0
+
+        def count_query(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        started_at = time.perf_counter()
+        with connection.execute_wrapper(count_query):
+            response = self.get_response(request)
+        duration = time.perf_counter() - started_at
+
+        # unresolved paths share a label, so random urls don't add series
+        match = request.resolver_match
+        route = match.view_name if match else "unmatched"
+        http_request_duration.labels(
+            route, request.method, response.status_code
+        ).observe(duration)
+        http_request_queries.labels(route, request.method).observe(queries)
+        return response
+
+
+class DirectoriesCollector:
+    """
+    Collects metrics written in multiprocess mode to any of given directories,
+    e.g. a directory per container, since file names of processes with
+    the same pid in different containers clash.
+    """
+
+    def __init__(self, paths: list[str]) -> None:
+        self.paths = paths
+
+    def collect(self):
+        files = [
+            file
+            for path in self.paths
+            for file in glob.glob(os.path.join(path, "*.db"))
+        ]
+        return multiprocess.MultiProcessCollector.merge(files, accumulate=True)
+
+
+def get_registry() -> CollectorRegistry:
+    """
+    Returns registry with metrics of this process, or of all processes
+    (gunicorn and celery workers) when PROMETHEUS_MULTIPROC_DIR is set,
+    from METRICS_DIRS if it's set as well.
+    """
+
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return REGISTRY
+    registry = CollectorRegistry()
+    registry.register(
+        DirectoriesCollector(
+            settings.METRICS_DIRS or [os.environ["PROMETHEUS_MULTIPROC_DIR"]]
+        )
+    )
+    return registry
+
+
+def metrics_view(request) -> HttpResponse:
+    """Exposes metrics in prometheus text format."""
+
+    return HttpResponse(
+        generate_latest(get_registry()), content_type=CONTENT_TYPE_LATEST
+    )
@@ -0,0 +1,75 @@
+from contextlib import contextmanager
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+# Max amount of SQL queries of each view method and celery task, including
+# authentication. Tests using QueryBudgetMixin fail when one is exceeded,
+# lower a budget when a change makes it possible.
+QUERY_BUDGETS = {
+    # habits.views
+    "habits.views.PublicHabitListAPIView.get": 3,
+    "habits.views.HabitListCreateAPIView.get": 3,
+    "habits.views.HabitListCreateAPIView.post": 3,
+    "habits.views.HabitRetrieveUpdateDestroyAPIView.get": 2,
+    "habits.views.HabitRetrieveUpdateDestroyAPIView.put": 5,
+    "habits.views.HabitRetrieveUpdateDestroyAPIView.patch": 4,
+    "habits.views.HabitRetrieveUpdateDestroyAPIView.delete": 6,
+    "habits.views.HabitBatchAPIView.post": 12,
+    # users.views
+    "users.views.RegisterView.post": 2,
+    "users.views.MeView.get": 1,
+    "users.views.MeView.put": 4,
+    "users.views.MeView.patch": 2,
+    "users.views.MeView.delete": 10,
+    # habits.tasks, per run of the task, check_habits runs the whole tick
+    # with queue_reminders and dispatch_outbox executed eagerly
+    "habits.tasks.check_habits": 19,
+    "habits.tasks.queue_reminders": 8,
+    "habits.tasks.dispatch_outbox": 10,
+}
+
+
+def format_queries(queries: list[dict]) -> str:
+    return "\n".join(
+        f"{number}. {query['sql']}" for number, query in enumerate(queries, 1)
+    )
+
+
+class QueryBudgetMixin:
+    """
+    Test case mixin checking amounts of queries against QUERY_BUDGETS.
+    Failures list the SQL of offending queries.
+    """
+
+    @contextmanager
+    def assertQueryBudget(self, name: str):
+        """Fails if the block runs more queries than the budget of `name`."""
+
+        budget = QUERY_BUDGETS[name]
+        with CaptureQueriesContext(connection) as queries:
+            yield queries
+
+        if len(queries) > budget:
+            self.fail(
+                f"{name} ran {len(queries)} queries, its budget is {budget}:\n"
+                f"{format_queries(queries.captured_queries)}"
+            )
+
+    def assertQueriesDoNotGrow(self, name: str, func, add_rows) -> None:
+        """
+        Fails if `func` runs more queries than the budget of `name`
+        or if it runs more queries after `add_rows` was called.
+        """
+
+        with self.assertQueryBudget(name) as before:
+            func()
+        add_rows()
+        with self.assertQueryBudget(name) as after:
+            func()
+
+        if len(after) > len(before):
+            self.fail(
+                f"{name} queries grow with rows: {len(before)} before, "
+                f"{len(after)} after:\n{format_queries(after.captured_queries)}"
+            )
@@ -0,0 +1,34 @@
+import orjson
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    Renders the same bytes as JSONRenderer through orjson, several times
+    faster. Types orjson doesn't handle the same way, like datetimes or lazy
+    strings, are encoded by JSONEncoder of DRF. Indented responses and data
+    orjson can't encode at all are left to JSONRenderer.
+    Only floats differ: exponents are written as `1e20`, not `1e+20`, and
+    NaN as null instead of failing, the api has no float fields though.
+    """
+
+    options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        if indent is not None or self.ensure_ascii or not self.compact:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(data, default=JSONEncoder().default, option=self.options)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # escaped by JSONRenderer, as they break javascript strings
+        return ret.replace("\u2028".encode(), b"\\u2028").replace(
+            "\u2029".encode(), b"\\u2029"
+        )
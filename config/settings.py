@@ -1,7 +1,9 @@
+import sys
+import tempfile
 from datetime import timedelta
 from pathlib import Path
 
-from decouple import config
+from decouple import Csv, config
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -13,6 +15,17 @@ DEBUG = config("DEBUG", default=False, cast=bool)
 ALLOWED_HOSTS = ["*"]
 
 
+LOG_LEVEL = config("LOG_LEVEL", default="INFO")
+LOG_FILE = config("LOG_FILE", default="quick-habit.log")
+# test runs don't write their records to the log of the app
+if sys.argv[1:2] == ["test"]:
+    LOG_FILE = str(Path(tempfile.mkdtemp(prefix="quick-habit-test-")) / "test.log")
+# log file is rotated after this size, keeping LOG_BACKUP_COUNT old files
+LOG_MAX_BYTES = config("LOG_MAX_BYTES", default=10 * 1024 * 1024, cast=int)
+LOG_BACKUP_COUNT = config("LOG_BACKUP_COUNT", default=5, cast=int)
+# share of DEBUG records logged, e.g. per habit lines of reminders
+LOG_DEBUG_SAMPLE_RATE = config("LOG_DEBUG_SAMPLE_RATE", default=1, cast=float)
+
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
@@ -20,6 +33,15 @@ LOGGING = {
         "simple": {
             "format": "%(levelname)s %(asctime)s %(module)s %(message)s",
         },
+        "json": {
+            "()": "config.logs.JsonFormatter",
+        },
+    },
+    "filters": {
+        "sample_debug": {
+            "()": "config.logs.SamplingFilter",
+            "rate": LOG_DEBUG_SAMPLE_RATE,
+        },
     },
     "handlers": {
         "console": {
@@ -28,16 +50,24 @@ LOGGING = {
             "formatter": "simple",
         },
         "file": {
-            "level": "INFO",
-            "class": "logging.FileHandler",
-            "filename": "quick-habit.log",
-            "formatter": "simple",
+            "class": "config.logs.RotatingFileHandler",
+            "filename": LOG_FILE,
+            "maxBytes": LOG_MAX_BYTES,
+            "backupCount": LOG_BACKUP_COUNT,
+            "formatter": "json",
+        },
+        # the others are written from a listener thread
+        "queue": {
+            "class": "config.logs.QueueHandler",
+            "handlers": ["console", "file"],
+            "filters": ["sample_debug"],
+            "respect_handler_level": True,
         },
     },
     "loggers": {
         "habits": {
-            "handlers": ["console", "file"],
-            "level": "INFO",
+            "handlers": ["queue"],
+            "level": LOG_LEVEL,
             "propagate": True,
         },
     },
@@ -58,6 +88,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "config.metrics.MetricsMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -143,6 +174,10 @@ REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
         "rest_framework_simplejwt.authentication.JWTAuthentication",
     ],
+    "DEFAULT_RENDERER_CLASSES": [
+        "config.renderers.ORJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
     "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
 }
 
@@ -161,12 +196,75 @@ CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
 ]
 
+# pagination of habit lists by default, `page` numbers or keyset `cursor`,
+# can be chosen per request by the `pagination` query parameter
+HABIT_PAGINATION = config("HABIT_PAGINATION", default="page")
+# for how long pages of the public habit feed are cached, seconds, 0 disables
+# the cache. Pages are invalidated as soon as a public habit changes anyway
+PUBLIC_FEED_CACHE_TTL = config("PUBLIC_FEED_CACHE_TTL", default=300, cast=int)
+
+# queue and amount of habits for a single reminders delivery task
+REMINDER_QUEUE = config("REMINDER_QUEUE", default="reminders")
+REMINDER_CHUNK_SIZE = config("REMINDER_CHUNK_SIZE", default=100, cast=int)
+# amount of chunks dispatched at once in a single celery group
+REMINDER_GROUP_SIZE = config("REMINDER_GROUP_SIZE", default=10, cast=int)
+# amount of outbox messages sent by a dispatcher at once
+OUTBOX_BATCH_SIZE = config("OUTBOX_BATCH_SIZE", default=100, cast=int)
+# for how long a dispatcher has a batch of outbox messages to send them,
+# afterwards other dispatchers take them over, seconds
+OUTBOX_LEASE_TTL = config("OUTBOX_LEASE_TTL", default=300, cast=int)
+# failed reminders are retried with exponential backoff, seconds
+REMINDER_MAX_RETRIES = config("REMINDER_MAX_RETRIES", default=5, cast=int)
+REMINDER_RETRY_BACKOFF = config("REMINDER_RETRY_BACKOFF", default=60, cast=int)
+REMINDER_RETRY_BACKOFF_MAX = config(
+    "REMINDER_RETRY_BACKOFF_MAX", default=3600, cast=int
+)
+
 CELERY_BROKER_URL = config("CELERY_BROKER_URL")
 CELERY_RESULT_BACKEND = config("CELERY_RESULT_BACKEND")
 CELERY_ACCEPT_CONTENT = ["json"]
 CELERY_TASK_SERIALIZER = "json"
 CELERY_TIMEZONE = TIME_ZONE
 CELERY_ENABLE_UTC = False
+CELERY_TASK_ROUTES = {
+    "habits.tasks.queue_reminders": {"queue": REMINDER_QUEUE},
+    "habits.tasks.dispatch_outbox": {"queue": REMINDER_QUEUE},
+}
+
+# redis for locks and counters shared between workers, broker's one by default
+REDIS_URL = config("REDIS_URL", default=CELERY_BROKER_URL)
+# for how long a check_habits run holds its lease without extending it, seconds
+CHECK_HABITS_LEASE_TTL = config("CHECK_HABITS_LEASE_TTL", default=60, cast=int)
 
 
 TELEGRAM_BOT_TOKEN = config("TELEGRAM_BOT_TOKEN")
+# bot api to send messages through, e.g. url of `manage.py run_fake_telegram`
+TELEGRAM_API_URL = config("TELEGRAM_API_URL", default="https://api.telegram.org")
+# tokens of all bots sending messages, comma separated, the only bot is
+# TELEGRAM_BOT_TOKEN if it's empty. Run rebalance_bot_shards after adding a bot
+TELEGRAM_BOT_TOKENS = config("TELEGRAM_BOT_TOKENS", default="", cast=Csv())
+# usernames of the same bots in the same order, shown to users to start
+# the bot sending them reminders
+TELEGRAM_BOT_USERNAMES = config("TELEGRAM_BOT_USERNAMES", default="", cast=Csv())
+# max amount of simultaneous requests to telegram api per batch of messages
+TELEGRAM_CONCURRENCY = config("TELEGRAM_CONCURRENCY", default=20, cast=int)
+TELEGRAM_CONNECT_TIMEOUT = config("TELEGRAM_CONNECT_TIMEOUT", default=3.05, cast=float)
+TELEGRAM_READ_TIMEOUT = config("TELEGRAM_READ_TIMEOUT", default=10, cast=float)
+TELEGRAM_MAX_RETRIES = config("TELEGRAM_MAX_RETRIES", default=3, cast=int)
+# failed requests in a row to a bot's api before requests to it are paused
+# for TELEGRAM_RECOVERY_TIME seconds
+TELEGRAM_FAILURE_THRESHOLD = config("TELEGRAM_FAILURE_THRESHOLD", default=5, cast=int)
+TELEGRAM_RECOVERY_TIME = config("TELEGRAM_RECOVERY_TIME", default=30, cast=float)
+# messages in a row refused with a permanent error before a chat is considered
+# undeliverable and skipped until its owner sets the chat id again
+TELEGRAM_UNDELIVERABLE_AFTER = config(
+    "TELEGRAM_UNDELIVERABLE_AFTER", default=3, cast=int
+)
+# messages per second to telegram api from all workers together, 0 disables limits
+TELEGRAM_RATE_LIMIT = config("TELEGRAM_RATE_LIMIT", default=30, cast=float)
+# messages per second to a single chat
+TELEGRAM_CHAT_RATE_LIMIT = config("TELEGRAM_CHAT_RATE_LIMIT", default=1, cast=float)
+
+# multiprocess metrics directories of all containers, comma separated, which
+# /metrics aggregates, only PROMETHEUS_MULTIPROC_DIR of this one if it's empty
+METRICS_DIRS = config("METRICS_DIRS", default="", cast=Csv())
@@ -6,6 +6,8 @@ from drf_spectacular.views import (
     SpectacularSwaggerView,
 )
 
+from .metrics import metrics_view
+
 urlpatterns = [
     # admin
     path("admin/", admin.site.urls),
@@ -13,6 +15,8 @@ urlpatterns = [
     path("api/schema/", SpectacularAPIView.as_view(), name="schema"),
     path("api/docs/", SpectacularSwaggerView.as_view(), name="swagger-ui"),
     path("api/redoc/", SpectacularRedocView.as_view(), name="redoc"),
+    # monitoring
+    path("metrics", metrics_view, name="metrics"),
     # apps
     path("api/habits/", include("habits.urls", namespace="habits")),
     path("api/users/", include("users.urls", namespace="users")),
@@ -0,0 +1,11 @@
+#!/bin/sh
+set -e
+
+# prometheus_client requires the multiprocess directory to be empty on start,
+# otherwise metrics of processes of the previous run are carried over
+if [ -n "$PROMETHEUS_MULTIPROC_DIR" ]; then
+    rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+    mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+fi
+
+exec "$@"
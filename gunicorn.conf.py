@@ -0,0 +1,10 @@
+import os
+
+from prometheus_client import multiprocess
+
+
+def child_exit(server, worker) -> None:
+    """Drops live metrics of a finished worker process."""
+
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.mark_process_dead(worker.pid)
@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import Habit
+from .models import DeadLetter, Habit, NotificationOutbox
 
 
 @admin.register(Habit)
@@ -16,3 +16,13 @@ class HabitAdmin(admin.ModelAdmin):
     )
     list_filter = ("owner", "is_pleasant", "is_public")
     search_fields = ("place", "time", "action")
+
+
+@admin.register(NotificationOutbox)
+class NotificationOutboxAdmin(admin.ModelAdmin):
+    list_display = ("chat_id", "habit_ids", "leased_until", "created_at")
+
+
+@admin.register(DeadLetter)
+class DeadLetterAdmin(admin.ModelAdmin):
+    list_display = ("chat_id", "habit_ids", "attempts", "error", "created_at")
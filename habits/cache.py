@@ -0,0 +1,169 @@
+import hashlib
+import json
+import logging
+import uuid
+
+import redis
+from django.conf import settings
+from rest_framework import status
+from rest_framework.response import Response
+
+from .locks import get_redis
+
+logger = logging.getLogger(__name__)
+
+PUBLIC_FEED_PREFIX = "cache:public-feed"
+PUBLIC_FEED_VERSION_KEY = f"{PUBLIC_FEED_PREFIX}:version"
+HABITS_VERSION_PREFIX = "cache:habits-version"
+# versions of users' habits not changed for this long are forgotten, seconds
+HABITS_VERSION_TTL = 7 * 24 * 60 * 60
+
+
+def get_version(key: str, ttl: int | None = None) -> str | None:
+    """
+    Returns the version stored in redis under `key`, creating it if it's
+    not there. Returns None if redis is unavailable.
+    """
+
+    try:
+        client = get_redis()
+        version = client.get(key)
+        if version is None:
+            # random, so versions don't repeat after redis lost them
+            client.set(key, uuid.uuid4().hex, ex=ttl, nx=True)
+            version = client.get(key)
+    except redis.RedisError as e:
+        logger.warning("Can't reach cache versions: %s", e)
+        return None
+
+    return version.decode()
+
+
+def bump_versions(keys: list[str], ttl: int | None = None) -> None:
+    """Replaces versions under given keys, making what they tag stale."""
+
+    try:
+        with get_redis().pipeline(transaction=False) as pipeline:
+            for key in keys:
+                pipeline.set(key, uuid.uuid4().hex, ex=ttl)
+            pipeline.execute()
+    except redis.RedisError as e:
+        logger.warning("Can't replace cache versions: %s", e)
+
+
+def get_public_feed_version() -> str | None:
+    """
+    Returns the current version of the public feed, pages cached under
+    other versions are stale.
+    """
+
+    return get_version(PUBLIC_FEED_VERSION_KEY)
+
+
+def bump_public_feed_version() -> None:
+    """Makes all cached pages of the public feed stale."""
+
+    bump_versions([PUBLIC_FEED_VERSION_KEY])
+
+
+def get_habits_version(user_id: int) -> str | None:
+    """Returns the current version of all habits of given user."""
+
+    return get_version(f"{HABITS_VERSION_PREFIX}:{user_id}", HABITS_VERSION_TTL)
+
+
+def bump_habits_versions(user_ids) -> None:
+    """Makes ETags of habits of given users stale."""
+
+    bump_versions(
+        [f"{HABITS_VERSION_PREFIX}:{user_id}" for user_id in user_ids],
+        HABITS_VERSION_TTL,
+    )
+
+
+def get_url_hash(request) -> str:
+    return hashlib.sha1(request.build_absolute_uri().encode()).hexdigest()
+
+
+def get_etag_headers(version: str, request) -> dict[str, str]:
+    """Returns caching headers of the response to `request` at `version`."""
+
+    return {
+        "ETag": f'W/"{version}-{get_url_hash(request)}"',
+        # may be kept by clients, but must be revalidated with the etag
+        "Cache-Control": "private, no-cache",
+    }
+
+
+def is_not_modified(request, headers: dict[str, str]) -> bool:
+    """Whether the request already has the response with given headers."""
+
+    return headers["ETag"] in request.headers.get("If-None-Match", "")
+
+
+def cached_public_feed(request, get_response) -> Response:
+    """
+    Returns the page of the public feed requested by `request` from cache,
+    or the response of `get_response()`, caching its data.
+    Pages are cached by their full url for PUBLIC_FEED_CACHE_TTL seconds
+    under the current feed version. Responses have an ETag of the version
+    and url, so clients sending it in If-None-Match get 304 while the feed
+    doesn't change.
+    """
+
+    version = get_public_feed_version()
+    if version is None or not settings.PUBLIC_FEED_CACHE_TTL:
+        return get_response()
+
+    headers = get_etag_headers(version, request)
+    if is_not_modified(request, headers):
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    key = f"{PUBLIC_FEED_PREFIX}:{version}:{get_url_hash(request)}"
+    client = get_redis()
+    try:
+        data = client.get(key)
+    except redis.RedisError as e:
+        logger.warning("Can't reach public feed cache: %s", e)
+        return get_response()
+    if data is not None:
+        return Response(json.loads(data), headers=headers)
+
+    response = get_response()
+    if response.status_code == status.HTTP_200_OK:
+        try:
+            client.set(
+                key,
+                json.dumps(response.data, default=str),
+                ex=settings.PUBLIC_FEED_CACHE_TTL,
+            )
+        except redis.RedisError as e:
+            logger.warning("Can't reach public feed cache: %s", e)
+        for header, value in headers.items():
+            response[header] = value
+    return response
+
+
+def conditional_habits_response(request, get_response, has_permission=None) -> Response:
+    """
+    Returns the response of `get_response()` with an ETag of the version
+    of the user's habits and url, or 304 without calling it if the request
+    has the current ETag in If-None-Match and `has_permission()`, if given,
+    allows the user to see the response.
+    """
+
+    version = get_habits_version(request.user.id)
+    if version is None:
+        return get_response()
+
+    headers = get_etag_headers(version, request)
+    if is_not_modified(request, headers) and (
+        has_permission is None or has_permission()
+    ):
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    response = get_response()
+    if response.status_code == status.HTTP_200_OK:
+        for header, value in headers.items():
+            response[header] = value
+    return response
@@ -0,0 +1,226 @@
+import json
+import math
+import random
+import socket
+import struct
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+# chats answered the same way on every request, whatever server's settings
+THROTTLED_CHAT_ID = 429
+NOT_FOUND_CHAT_ID = 400
+BLOCKED_CHAT_ID = 403
+
+
+class TokenBucket:
+    """In-process token bucket holding up to a second worth of tokens."""
+
+    def __init__(self, rate: float) -> None:
+        self.rate = rate
+        self.capacity = max(1, rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def take(self) -> float:
+        """Takes a token, returns 0 or seconds until there's one to take."""
+
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+        if self.tokens < 1:
+            return (1 - self.tokens) / self.rate
+        self.tokens -= 1
+        return 0
+
+
+class FakeTelegramHandler(BaseHTTPRequestHandler):
+    """
+    Answers sendMessage requests like telegram bot api does, with latency,
+    failures and rate limits configured on the server.
+    """
+
+    protocol_version = "HTTP/1.1"  # keep-alive like the real api
+    server: "FakeTelegramServer"
+
+    def do_POST(self) -> None:
+        bot, _, method = self.path.strip("/").partition("/")
+        length = int(self.headers.get("Content-Length", 0))
+        payload = self.rfile.read(length).decode()
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            form = json.loads(payload or "{}")
+        else:
+            form = {key: values[0] for key, values in parse_qs(payload).items()}
+
+        with self.server.lock:
+            self.server.in_flight += 1
+            self.server.max_in_flight = max(
+                self.server.max_in_flight, self.server.in_flight
+            )
+        try:
+            time.sleep(self.server.latency)
+            answer = self.server.answer(bot, method, form)
+        finally:
+            with self.server.lock:
+                self.server.in_flight -= 1
+
+        if answer is None:
+            self.reset_connection()
+            return
+
+        status_code, body = answer
+        data = json.dumps(body).encode()
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def reset_connection(self) -> None:
+        # closing with zero linger time sends RST instead of FIN
+        self.connection.setsockopt(
+            socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0)
+        )
+        self.close_connection = True
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+class FakeTelegramServer(ThreadingHTTPServer):
+    """
+    Stand-in for telegram bot api to test and benchmark delivery offline.
+    Point TELEGRAM_API_URL at its `url`.
+
+    Every request is answered after `latency` seconds. A share of requests
+    given by `error_rate` fails with 502 and `reset_rate` with a reset
+    connection. Each bot may send `rate_limit` messages per second and
+    `chat_rate_limit` per chat, the rest gets 429 with retry_after
+    (0 disables limits). Chats THROTTLED_CHAT_ID, NOT_FOUND_CHAT_ID and
+    BLOCKED_CHAT_ID always get 429, 400 and 403.
+    """
+
+    daemon_threads = True
+    request_queue_size = 1024  # accepts bursts of concurrent connections
+
+    def __init__(
+        self,
+        address: tuple[str, int] = ("127.0.0.1", 0),
+        latency: float = 0,
+        error_rate: float = 0,
+        reset_rate: float = 0,
+        rate_limit: float = 0,
+        chat_rate_limit: float = 0,
+        seed: int | None = None,
+    ) -> None:
+        super().__init__(address, FakeTelegramHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.reset_rate = reset_rate
+        self.rate_limit = rate_limit
+        self.chat_rate_limit = chat_rate_limit
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.reset_stats()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def reset_stats(self) -> None:
+        """Forgets requests answered so far and rate limits spent."""
+
+        with self.lock:
+            self.in_flight = 0
+            self.max_in_flight = 0
+            self.statuses = Counter()
+            self.messages = []
+            self.buckets = {}
+
+    def start(self) -> threading.Thread:
+        """Serves requests from a background thread."""
+
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def answer(self, bot: str, method: str, form: dict) -> tuple[int, dict] | None:
+        """Returns status code and body to answer with, None to reset connection."""
+
+        with self.lock:
+            answer = self._answer(bot, method, form)
+            self.statuses[answer[0] if answer else "reset"] += 1
+            return answer
+
+    def _answer(self, bot: str, method: str, form: dict) -> tuple[int, dict] | None:
+        if method != "sendMessage":
+            return error(404, "Not Found")
+        try:
+            chat_id = int(form["chat_id"])
+        except (KeyError, ValueError):
+            return error(400, "Bad Request: chat_id is empty")
+        if not form.get("text"):
+            return error(400, "Bad Request: message text is empty")
+
+        if chat_id == THROTTLED_CHAT_ID:
+            return throttled(5)
+        if chat_id == NOT_FOUND_CHAT_ID:
+            return error(400, "Bad Request: chat not found")
+        if chat_id == BLOCKED_CHAT_ID:
+            return error(403, "Forbidden: bot was blocked by the user")
+
+        chance = self.random.random()
+        if chance < self.reset_rate:
+            return None
+        if chance < self.reset_rate + self.error_rate:
+            return error(502, "Bad Gateway")
+
+        retry_after = max(
+            self._take(bot, self.rate_limit),
+            self._take((bot, chat_id), self.chat_rate_limit),
+        )
+        if retry_after:
+            return throttled(retry_after)
+
+        self.messages.append((bot, chat_id, form["text"]))
+        return 200, {
+            "ok": True,
+            "result": {
+                "message_id": len(self.messages),
+                "date": int(time.time()),
+                "chat": {"id": chat_id},
+                "text": form["text"],
+            },
+        }
+
+    def _take(self, key, rate: float) -> float:
+        if not rate:
+            return 0
+        if key not in self.buckets:
+            self.buckets[key] = TokenBucket(rate)
+        return self.buckets[key].take()
+
+
+def error(status_code: int, description: str) -> tuple[int, dict]:
+    return status_code, {
+        "ok": False,
+        "error_code": status_code,
+        "description": description,
+    }
+
+
+def throttled(retry_after: float) -> tuple[int, dict]:
+    # telegram rounds retry_after up to whole seconds
+    retry_after = max(1, math.ceil(retry_after))
+    status_code, body = error(429, f"Too Many Requests: retry after {retry_after}")
+    body["parameters"] = {"retry_after": retry_after}
+    return status_code, body
@@ -0,0 +1,66 @@
+import logging
+import threading
+from functools import cache, wraps
+
+import redis
+from django.conf import settings
+from redis.exceptions import LockError
+
+logger = logging.getLogger(__name__)
+
+
+@cache
+def get_redis() -> redis.Redis:
+    """Returns a shared client for the redis set in settings."""
+
+    return redis.Redis.from_url(settings.REDIS_URL)
+
+
+def single_flight(name: str, ttl: int):
+    """
+    Decorator that lets only one call of the function run at a time
+    across all processes, using a redis lease with given ttl in seconds.
+    The lease is extended every ttl/3 seconds while the function runs,
+    calls made while it's held by another run are skipped and return None.
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            # token is shared with the heartbeat thread, so it can't be thread local
+            lease = get_redis().lock(
+                f"lease:{name}", timeout=ttl, blocking=False, thread_local=False
+            )
+            if not lease.acquire():
+                logger.warning("Skipping %s: previous run still holds the lease", name)
+                return None
+
+            stopped = threading.Event()
+            heartbeat = threading.Thread(
+                target=extend_lease, args=(lease, ttl / 3, stopped), daemon=True
+            )
+            heartbeat.start()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stopped.set()
+                heartbeat.join()
+                try:
+                    lease.release()
+                except LockError:
+                    logger.warning("Lease %s expired before the run finished", name)
+
+        return wrapper
+
+    return decorator
+
+
+def extend_lease(lease, interval: float, stopped: threading.Event) -> None:
+    """Resets lease's ttl every `interval` seconds until `stopped` is set."""
+
+    while not stopped.wait(interval):
+        try:
+            lease.reacquire()
+        except LockError:
+            logger.warning("Lost lease %s, can't extend it", lease.name)
+            return
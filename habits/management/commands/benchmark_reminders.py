@@ -0,0 +1,176 @@
+import json
+import logging
+import subprocess
+import time
+import tracemalloc
+from datetime import UTC, datetime
+from unittest.mock import patch
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from config import celery_app
+from habits.fake_telegram import FakeTelegramServer
+from habits.models import Habit
+from habits.ratelimit import get_rate_limiter
+from habits.services import get_circuit_breaker
+from habits.tasks import check_habits, get_due_habits
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs a full check_habits tick in process against a fake telegram api "
+        "and reports wall time, queries and peak memory (traced python "
+        "allocations, in a second run) as JSON. Changes made by the ticks "
+        "are rolled back"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--at",
+            help="Time of the tick as HH:MM today or ISO datetime, "
+            "end of today by default",
+        )
+        parser.add_argument(
+            "--latency", type=float, default=0, help="Fake api latency, seconds"
+        )
+        parser.add_argument(
+            "--error-rate", type=float, default=0, help="Share of fake api 502s"
+        )
+        parser.add_argument(
+            "--rate-limit",
+            type=float,
+            default=0,
+            help="TELEGRAM_RATE_LIMIT for the tick, not limited by default",
+        )
+        parser.add_argument("--label", default="", help="Stored with the results")
+        parser.add_argument("--output", help="File to write JSON to, stdout if unset")
+
+    def handle(self, *args, **options):
+        at = parse_tick_time(options["at"])
+        server = FakeTelegramServer(
+            latency=options["latency"], error_rate=options["error_rate"], seed=1
+        )
+        server.start()
+
+        try:
+            with override_settings(
+                TELEGRAM_API_URL=server.url,
+                TELEGRAM_BOT_TOKEN="benchmark",
+                TELEGRAM_BOT_TOKENS=[],
+                TELEGRAM_RATE_LIMIT=options["rate_limit"],
+            ):
+                get_rate_limiter.cache_clear()
+                get_circuit_breaker.cache_clear()
+                results = self.run_tick(at)
+                sent, api_answers = len(server.messages), dict(server.statuses)
+                # tracing allocations slows the tick down a lot, so memory
+                # is measured by a separate run
+                server.reset_stats()
+                results["peak_memory"] = self.run_tick(at, trace_memory=True)[
+                    "peak_memory"
+                ]
+        finally:
+            server.stop()
+            get_rate_limiter.cache_clear()
+            get_circuit_breaker.cache_clear()
+
+        results.update(
+            label=options["label"],
+            commit=get_commit(),
+            created_at=timezone.now().isoformat(),
+            tick_at=at.isoformat(),
+            sent=sent,
+            api_answers=api_answers,
+            settings={
+                name: getattr(settings, name)
+                for name in (
+                    "REMINDER_CHUNK_SIZE",
+                    "REMINDER_GROUP_SIZE",
+                    "OUTBOX_BATCH_SIZE",
+                    "TELEGRAM_CONCURRENCY",
+                )
+            },
+        )
+
+        data = json.dumps(results, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                file.write(data + "\n")
+        else:
+            self.stdout.write(data)
+
+    def run_tick(self, at: datetime, trace_memory: bool = False) -> dict:
+        queries = 0
+
+        def count_query(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        eager = celery_app.conf.task_always_eager
+        celery_app.conf.update(task_always_eager=True)
+        # a log line per message would be benchmarked too
+        logging.disable(logging.INFO)
+        try:
+            with (
+                transaction.atomic(),
+                patch("habits.tasks.timezone.now", return_value=at),
+            ):
+                habits = Habit.objects.count()
+                due = get_due_habits(at).count()
+
+                if trace_memory:
+                    tracemalloc.start()
+                started_at = time.perf_counter()
+                with connection.execute_wrapper(count_query):
+                    check_habits()
+                wall_time = time.perf_counter() - started_at
+                peak_memory = None
+                if trace_memory:
+                    _, peak_memory = tracemalloc.get_traced_memory()
+                    tracemalloc.stop()
+
+                transaction.set_rollback(True)
+        finally:
+            logging.disable(logging.NOTSET)
+            celery_app.conf.update(task_always_eager=eager)
+
+        return {
+            "habits": habits,
+            "due": due,
+            "wall_time": round(wall_time, 3),
+            "queries": queries,
+            "peak_memory": peak_memory,
+        }
+
+
+def parse_tick_time(value: str | None) -> datetime:
+    today = timezone.now().date()
+    if not value:
+        return datetime.combine(today, datetime.max.time(), tzinfo=UTC)
+
+    try:
+        if len(value) <= 5:
+            return datetime.combine(
+                today, datetime.strptime(value, "%H:%M").time(), tzinfo=UTC
+            )
+        at = datetime.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f"Invalid tick time: {value}")
+    return at if at.tzinfo else at.replace(tzinfo=UTC)
+
+
+def get_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
@@ -0,0 +1,198 @@
+import random
+from datetime import UTC, datetime, time, timedelta
+from itertools import batched
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from habits.models import Habit, HabitNotification
+from users.models import User
+
+EMAIL_DOMAIN = "synthetic.invalid"
+# chat ids of synthetic users start here to stay clear of real ones
+CHAT_ID_OFFSET = 10**12
+
+# most reminders are set in the morning, at lunch and in the evening:
+# (mean minute of day, deviation in minutes, share of habits)
+TIME_CLUSTERS = ((7 * 60 + 30, 40, 0.45), (12 * 60 + 30, 30, 0.15), (20 * 60, 60, 0.4))
+FREQUENCY_WEIGHTS = {1: 50, 2: 15, 3: 10, 4: 5, 5: 5, 6: 5, 7: 10}
+ACTIONS = ("Drink water", "Stretch", "Read 10 pages", "Meditate", "Walk", "Floss")
+PLACES = ("Home", "Office", "Kitchen", "Park", "Gym")
+
+
+class Command(BaseCommand):
+    help = (
+        "Loads synthetic users, habits and notification history "
+        "to benchmark reminders with"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("habits", type=int, help="Amount of habits to load")
+        parser.add_argument(
+            "--max-habits-per-user",
+            type=int,
+            default=5,
+            help="Users get from 1 to this many habits",
+        )
+        parser.add_argument(
+            "--history-days",
+            type=int,
+            default=14,
+            help="Days of notification history before today",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=10000, help="Rows inserted per query"
+        )
+        parser.add_argument("--seed", type=int, help="Seed for reproducible data")
+        parser.add_argument(
+            "--clear",
+            action="store_true",
+            help="Remove previously loaded synthetic data first",
+        )
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        self.today = timezone.now().date()
+        self.batch_size = options["batch_size"]
+
+        if options["clear"]:
+            deleted, _ = User.objects.filter(
+                email__endswith=f"@{EMAIL_DOMAIN}"
+            ).delete()
+            self.stdout.write(f"Removed {deleted} synthetic objects")
+
+        first_user = User.objects.filter(email__endswith=f"@{EMAIL_DOMAIN}").count()
+        # users are created on the go, as many as their habits need
+        users_count = habits_count = notifications_count = 0
+        password = make_password(None)
+
+        habits_left = options["habits"]
+        while habits_left > 0:
+            with transaction.atomic():
+                users = []
+                user_habits_counts = []
+                while habits_left > 0 and len(users) < self.batch_size:
+                    index = first_user + users_count + len(users)
+                    users.append(
+                        User(
+                            email=f"user{index}@{EMAIL_DOMAIN}",
+                            password=password,
+                            # some users never connect telegram
+                            telegram_chat_id=(
+                                CHAT_ID_OFFSET + index if rng.random() < 0.9 else None
+                            ),
+                            bot_shard=0,
+                            reminder_digest=rng.random() < 0.2,
+                        )
+                    )
+                    user_habits_count = min(
+                        habits_left, rng.randint(1, options["max_habits_per_user"])
+                    )
+                    user_habits_counts.append(user_habits_count)
+                    habits_left -= user_habits_count
+
+                User.objects.bulk_create(users)
+                habits = Habit.objects.bulk_create(
+                    (
+                        self.make_habit(rng, user)
+                        for user, count in zip(users, user_habits_counts)
+                        for _ in range(count)
+                    ),
+                    batch_size=self.batch_size,
+                )
+                notifications_count += self.insert_notifications(
+                    rng, habits, options["history_days"]
+                )
+                users_count += len(users)
+                habits_count += len(habits)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Loaded {users_count} users, {habits_count} habits "
+                f"and {notifications_count} notifications"
+            )
+        )
+
+    def make_habit(self, rng: random.Random, user: User) -> Habit:
+        frequency = rng.choices(
+            list(FREQUENCY_WEIGHTS), weights=FREQUENCY_WEIGHTS.values()
+        )[0]
+        habit_time = get_random_time(rng)
+        # steady state: the last reminder was sent within the last `frequency`
+        # days, so about 1/frequency of habits are due today
+        last_notification_date = self.today - timedelta(days=rng.randint(1, frequency))
+
+        habit = Habit(
+            owner=user,
+            place=rng.choice(PLACES),
+            time=habit_time,
+            action=rng.choice(ACTIONS),
+            frequency=frequency,
+            execution_time=rng.randint(10, 120),
+            is_public=rng.random() < 0.1,
+            next_reminder_at=datetime.combine(
+                last_notification_date + timedelta(days=frequency),
+                habit_time,
+                tzinfo=UTC,
+            ),
+        )
+        habit.last_notification_date = last_notification_date
+        return habit
+
+    def insert_notifications(
+        self, rng: random.Random, habits: list[Habit], history_days: int
+    ) -> int:
+        """Inserts notifications of habits every `frequency` days of history."""
+
+        first_date = self.today - timedelta(days=history_days)
+        rows = (
+            (habit.id, date)
+            for habit in habits
+            for date in get_dates(
+                habit.last_notification_date, first_date, habit.frequency
+            )
+        )
+
+        if connection.vendor == "postgresql":
+            return self.copy_notifications(rows)
+
+        inserted = 0
+        for batch in batched(rows, self.batch_size):
+            HabitNotification.objects.bulk_create(
+                HabitNotification(habit_id=habit_id, date=date)
+                for habit_id, date in batch
+            )
+            inserted += len(batch)
+        return inserted
+
+    def copy_notifications(self, rows) -> int:
+        # COPY is several times faster than INSERT for history's many rows
+        inserted = 0
+        table = HabitNotification._meta.db_table
+        with connection.cursor() as cursor:
+            with cursor.copy(f"COPY {table} (habit_id, date) FROM STDIN") as copy:
+                for row in rows:
+                    copy.write_row(row)
+                    inserted += 1
+        return inserted
+
+
+def get_random_time(rng: random.Random) -> time:
+    """Returns random time of day from TIME_CLUSTERS, rounded to 5 minutes."""
+
+    mean, deviation, _ = rng.choices(
+        TIME_CLUSTERS, weights=[share for _, _, share in TIME_CLUSTERS]
+    )[0]
+    minute = round(rng.gauss(mean, deviation) / 5) * 5 % (24 * 60)
+    return time(minute // 60, minute % 60)
+
+
+def get_dates(last_date, first_date, frequency: int):
+    """Yields dates every `frequency` days back from last_date to first_date."""
+
+    date = last_date
+    while date >= first_date:
+        yield date
+        date -= timedelta(days=frequency)
@@ -0,0 +1,294 @@
+import asyncio
+import json
+import random
+import statistics
+import time
+from collections import defaultdict
+
+import httpx
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from habits.models import Habit
+from users.models import User
+
+EMAIL_DOMAIN = "loadtest.invalid"
+PASSWORD = "loadtest"
+DEFAULT_MIX = "list=35,public=20,detail=20,create=5,update=10,delete=5,token=5"
+PERCENTILES = (50, 95, 99)
+
+
+class LoadTestUser:
+    """User driving traffic, with an access token and ids of own habits."""
+
+    def __init__(self, user: User, habit_ids: list[int]) -> None:
+        self.email = user.email
+        self.headers = {
+            "Authorization": f"Bearer {RefreshToken.for_user(user).access_token}"
+        }
+        self.habit_ids = habit_ids
+
+
+class Command(BaseCommand):
+    help = (
+        "Drives mixed traffic against a running instance of the api "
+        "(e.g. gunicorn) and reports throughput and p50/p95/p99 latency "
+        "per endpoint. Users and habits it needs are created in the database "
+        "the instance uses and removed afterwards"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", default="http://localhost:8000")
+        parser.add_argument(
+            "--duration", type=float, default=30, help="Seconds to drive traffic"
+        )
+        parser.add_argument(
+            "--concurrency", type=int, default=10, help="Requests in flight at once"
+        )
+        parser.add_argument(
+            "--users",
+            type=int,
+            default=20,
+            help="Split between workers, at least one per worker is created",
+        )
+        parser.add_argument("--habits-per-user", type=int, default=10)
+        parser.add_argument(
+            "--mix",
+            default=DEFAULT_MIX,
+            help="Weights of requests as endpoint=weight pairs, "
+            f"endpoints: {', '.join(REQUESTS)}",
+        )
+        parser.add_argument("--seed", type=int)
+        parser.add_argument("--output", help="File to write JSON report to")
+        parser.add_argument(
+            "--keep", action="store_true", help="Don't remove created users"
+        )
+
+    def handle(self, *args, **options):
+        mix = parse_mix(options["mix"])
+        User.objects.filter(email__endswith=f"@{EMAIL_DOMAIN}").delete()
+        # a user per worker at least, so writes of a user don't race
+        users = create_users(
+            max(options["users"], options["concurrency"]), options["habits_per_user"]
+        )
+
+        try:
+            results, elapsed = asyncio.run(
+                run_load(
+                    options["url"],
+                    users,
+                    mix,
+                    options["duration"],
+                    options["concurrency"],
+                    random.Random(options["seed"]),
+                )
+            )
+        finally:
+            if not options["keep"]:
+                User.objects.filter(email__endswith=f"@{EMAIL_DOMAIN}").delete()
+
+        report = get_report(results, elapsed)
+        report["options"] = {
+            name: options[name]
+            for name in ("url", "duration", "concurrency", "users", "mix")
+        }
+        self.stdout.write(format_report(report))
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                json.dump(report, file, indent=2)
+                file.write("\n")
+
+
+def parse_mix(value: str) -> dict[str, float]:
+    """Parses `endpoint=weight` pairs separated by commas."""
+
+    mix = {}
+    for pair in value.split(","):
+        name, _, weight = pair.strip().partition("=")
+        if name not in REQUESTS:
+            raise CommandError(f"Unknown endpoint in mix: {name}")
+        try:
+            mix[name] = float(weight)
+        except ValueError:
+            raise CommandError(f"Invalid weight of {name}: {weight}")
+
+    if not any(mix.values()):
+        raise CommandError("Mix has no requests")
+    return mix
+
+
+def create_users(users_count: int, habits_per_user: int) -> list[LoadTestUser]:
+    password = make_password(PASSWORD)
+    users = User.objects.bulk_create(
+        User(email=f"user{i}@{EMAIL_DOMAIN}", password=password)
+        for i in range(users_count)
+    )
+    habits = []
+    for user in users:
+        for i in range(habits_per_user):
+            habit = Habit(
+                owner=user,
+                place="Home",
+                time=f"{8 + i % 12:02}:00",
+                action=f"Load test habit {i}",
+                execution_time=60,
+                is_public=i % 2 == 0,
+            )
+            habit.next_reminder_at = habit.get_next_reminder_at()
+            habits.append(habit)
+    Habit.objects.bulk_create(habits)
+
+    habit_ids = defaultdict(list)
+    for habit in habits:
+        habit_ids[habit.owner_id].append(habit.id)
+    return [LoadTestUser(user, habit_ids[user.id]) for user in users]
+
+
+async def list_habits(client, user, rng) -> httpx.Response:
+    return await client.get("/api/habits/", headers=user.headers)
+
+
+async def list_public_habits(client, user, rng) -> httpx.Response:
+    return await client.get("/api/habits/public/", headers=user.headers)
+
+
+async def retrieve_habit(client, user, rng) -> httpx.Response:
+    pk = rng.choice(user.habit_ids)
+    return await client.get(f"/api/habits/{pk}/", headers=user.headers)
+
+
+async def create_habit(client, user, rng) -> httpx.Response:
+    response = await client.post(
+        "/api/habits/",
+        json={
+            "place": "Office",
+            "time": f"{rng.randint(6, 22):02}:{rng.choice((0, 30)):02}",
+            "action": "Load test habit",
+            "frequency": rng.randint(1, 7),
+            "execution_time": rng.randint(10, 120),
+        },
+        headers=user.headers,
+    )
+    if response.status_code == 201:
+        user.habit_ids.append(response.json()["id"])
+    return response
+
+
+async def update_habit(client, user, rng) -> httpx.Response:
+    pk = rng.choice(user.habit_ids)
+    return await client.patch(
+        f"/api/habits/{pk}/",
+        json={"place": rng.choice(("Home", "Office", "Park"))},
+        headers=user.headers,
+    )
+
+
+async def delete_habit(client, user, rng) -> httpx.Response:
+    # keeps at least one habit for reads and updates
+    if len(user.habit_ids) < 2:
+        return await create_habit(client, user, rng)
+    pk = user.habit_ids.pop(rng.randrange(len(user.habit_ids)))
+    return await client.delete(f"/api/habits/{pk}/", headers=user.headers)
+
+
+async def obtain_token(client, user, rng) -> httpx.Response:
+    return await client.post(
+        "/api/users/token/", json={"email": user.email, "password": PASSWORD}
+    )
+
+
+REQUESTS = {
+    "list": list_habits,
+    "public": list_public_habits,
+    "detail": retrieve_habit,
+    "create": create_habit,
+    "update": update_habit,
+    "delete": delete_habit,
+    "token": obtain_token,
+}
+
+
+async def run_load(
+    url: str,
+    users: list[LoadTestUser],
+    mix: dict[str, float],
+    duration: float,
+    concurrency: int,
+    rng: random.Random,
+) -> tuple[dict[str, list[tuple[float, bool]]], float]:
+    """
+    Sends requests picked by weights of `mix` from `concurrency` workers
+    for `duration` seconds. Users are split between workers, each request
+    is sent as a random user of the worker, so writes of a user don't race.
+    Returns (latency, succeeded) of requests by endpoint and seconds it took.
+    """
+
+    names, weights = list(mix), list(mix.values())
+    results = defaultdict(list)
+
+    async with httpx.AsyncClient(
+        base_url=url,
+        limits=httpx.Limits(max_connections=concurrency),
+        timeout=30,
+    ) as client:
+
+        async def worker(worker_users: list[LoadTestUser]) -> None:
+            while time.monotonic() < deadline:
+                user = rng.choice(worker_users)
+                name = rng.choices(names, weights)[0]
+                started_at = time.perf_counter()
+                try:
+                    response = await REQUESTS[name](client, user, rng)
+                    succeeded = not response.is_error
+                except httpx.HTTPError:
+                    succeeded = False
+                results[name].append((time.perf_counter() - started_at, succeeded))
+
+        started_at = time.monotonic()
+        deadline = started_at + duration
+        await asyncio.gather(
+            *(worker(users[i::concurrency]) for i in range(concurrency))
+        )
+
+    return results, time.monotonic() - started_at
+
+
+def get_report(results: dict[str, list[tuple[float, bool]]], elapsed: float) -> dict:
+    endpoints = {
+        name: get_stats(endpoint_results, elapsed)
+        for name, endpoint_results in sorted(results.items())
+    }
+    total = get_stats(
+        [result for endpoint in results.values() for result in endpoint], elapsed
+    )
+    return {"elapsed": round(elapsed, 3), "endpoints": endpoints, "total": total}
+
+
+def get_stats(results: list[tuple[float, bool]], elapsed: float) -> dict:
+    latencies = sorted(latency * 1000 for latency, _ in results)
+    stats = {
+        "requests": len(results),
+        "errors": sum(not succeeded for _, succeeded in results),
+        "rps": round(len(results) / elapsed, 1) if elapsed else 0,
+    }
+    if len(latencies) > 1:
+        quantiles = statistics.quantiles(latencies, n=100, method="inclusive")
+        for percentile in PERCENTILES:
+            stats[f"p{percentile}_ms"] = round(quantiles[percentile - 1], 1)
+    else:
+        for percentile in PERCENTILES:
+            stats[f"p{percentile}_ms"] = round(latencies[0], 1) if latencies else None
+    return stats
+
+
+def format_report(report: dict) -> str:
+    header = ("endpoint", "requests", "errors", "rps", "p50_ms", "p95_ms", "p99_ms")
+    rows = [header]
+    for name, stats in [*report["endpoints"].items(), ("total", report["total"])]:
+        rows.append((name, *(str(stats[column]) for column in header[1:])))
+
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    return "\n".join(
+        "  ".join(cell.ljust(width) for cell, width in zip(row, widths)) for row in rows
+    )
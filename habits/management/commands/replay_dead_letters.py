@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from habits.models import DeadLetter, NotificationOutbox
+from habits.tasks import dispatch_outbox
+
+
+class Command(BaseCommand):
+    help = "Moves failed reminders from dead letters back to the outbox"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "ids", nargs="*", type=int, help="Dead letters to replay, all by default"
+        )
+
+    def handle(self, *args, **options):
+        dead_letters = DeadLetter.objects.all()
+        if options["ids"]:
+            dead_letters = dead_letters.filter(id__in=options["ids"])
+
+        with transaction.atomic():
+            dead_letters = list(dead_letters.select_for_update())
+            NotificationOutbox.objects.bulk_create(
+                NotificationOutbox(
+                    chat_id=dead_letter.chat_id,
+                    bot_shard=dead_letter.bot_shard,
+                    text=dead_letter.text,
+                    habit_ids=dead_letter.habit_ids,
+                    claim_id=dead_letter.claim_id,
+                )
+                for dead_letter in dead_letters
+            )
+            DeadLetter.objects.filter(
+                id__in=[dead_letter.id for dead_letter in dead_letters]
+            ).delete()
+
+        if dead_letters:
+            dispatch_outbox.delay()
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Replayed {len(dead_letters)} dead letters")
+        )
@@ -0,0 +1,65 @@
+from django.core.management.base import BaseCommand
+
+from habits.fake_telegram import FakeTelegramServer
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs a stand-in for telegram bot api, "
+        "set TELEGRAM_API_URL to its url to send messages there"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8081)
+        parser.add_argument(
+            "--latency", type=float, default=0, help="Seconds to answer each request"
+        )
+        parser.add_argument(
+            "--error-rate", type=float, default=0, help="Share of 502 answers"
+        )
+        parser.add_argument(
+            "--reset-rate", type=float, default=0, help="Share of reset connections"
+        )
+        parser.add_argument(
+            "--rate-limit",
+            type=float,
+            default=30,
+            help="Messages per second from each bot, 0 disables",
+        )
+        parser.add_argument(
+            "--chat-rate-limit",
+            type=float,
+            default=1,
+            help="Messages per second to each chat, 0 disables",
+        )
+        parser.add_argument("--seed", type=int, help="Seed for random failures")
+
+    def handle(self, *args, **options):
+        server = FakeTelegramServer(
+            (options["host"], options["port"]),
+            latency=options["latency"],
+            error_rate=options["error_rate"],
+            reset_rate=options["reset_rate"],
+            rate_limit=options["rate_limit"],
+            chat_rate_limit=options["chat_rate_limit"],
+            seed=options["seed"],
+        )
+        self.stdout.write(f"Fake telegram bot api is listening on {server.url}")
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+        statuses = ", ".join(
+            f"{status}: {count}" for status, count in server.statuses.most_common()
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Delivered {len(server.messages)} messages, "
+                f"answers: {statuses or 'none'}"
+            )
+        )
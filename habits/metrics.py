@@ -0,0 +1,43 @@
+import time
+
+from prometheus_client import Counter, Gauge, Histogram
+
+# seconds, telegram answers within tens of milliseconds when healthy
+SEND_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+reminder_tick_due_habits = Gauge(
+    "reminder_tick_due_habits",
+    "Due habits dispatched by the last check_habits tick",
+    multiprocess_mode="mostrecent",
+)
+reminder_tick_duration = Histogram(
+    "reminder_tick_duration_seconds",
+    "Duration of check_habits ticks",
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+telegram_send_duration = Histogram(
+    "telegram_send_duration_seconds",
+    "Latency of telegram sendMessage requests",
+    buckets=SEND_BUCKETS,
+)
+telegram_sends = Counter(
+    "telegram_sends",
+    "Telegram sendMessage requests by result: sent, throttled (429) or failed",
+    ["result"],
+)
+
+
+def observe_send(started_at: float, status_code: int | None) -> None:
+    """
+    Records a sendMessage request started at `started_at` (perf_counter)
+    which got a response with given status, None if it got no response.
+    """
+
+    telegram_send_duration.observe(time.perf_counter() - started_at)
+    if status_code == 429:
+        result = "throttled"
+    elif status_code is not None and status_code < 400:
+        result = "sent"
+    else:
+        result = "failed"
+    telegram_sends.labels(result).inc()
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.3 on 2025-07-02 10:12
+
+from datetime import UTC, datetime, timedelta
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_next_reminder_at(apps, schema_editor):
+    Habit = apps.get_model("habits", "Habit")
+    today = timezone.now().date()
+
+    habits = Habit.objects.annotate(
+        last_notification_date=models.Max("notifications__date")
+    ).only("id", "time", "frequency")
+
+    batch = []
+    for habit in habits.iterator(chunk_size=1000):
+        if habit.last_notification_date is None:
+            date = today
+        else:
+            date = habit.last_notification_date + timedelta(days=habit.frequency)
+        habit.next_reminder_at = datetime.combine(date, habit.time, tzinfo=UTC)
+        batch.append(habit)
+
+        if len(batch) >= 1000:
+            Habit.objects.bulk_update(batch, ["next_reminder_at"])
+            batch = []
+
+    Habit.objects.bulk_update(batch, ["next_reminder_at"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("habits", "0007_alter_habit_options_alter_habit_execution_time_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="habit",
+            name="next_reminder_at",
+            field=models.DateTimeField(
+                blank=True,
+                editable=False,
+                help_text="When the next reminder for the habit is due",
+                null=True,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="habit",
+            index=models.Index(
+                fields=["next_reminder_at"], name="habits_habi_next_re_33adbb_idx"
+            ),
+        ),
+        migrations.RunPython(
+            backfill_next_reminder_at, reverse_code=migrations.RunPython.noop
+        ),
+    ]
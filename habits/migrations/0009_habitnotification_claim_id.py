@@ -0,0 +1,23 @@
+# Generated by Django 5.2.3 on 2026-10-18 11:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("habits", "0008_habit_next_reminder_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="habitnotification",
+            name="claim_id",
+            field=models.UUIDField(
+                blank=True,
+                editable=False,
+                help_text="Batch of reminders which claimed the notification for sending",
+                null=True,
+            ),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.3 on 2026-10-18 11:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("habits", "0009_habitnotification_claim_id"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="NotificationOutbox",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("chat_id", models.BigIntegerField()),
+                ("text", models.TextField()),
+                (
+                    "habit_ids",
+                    models.JSONField(
+                        default=list, help_text="Habits the message reminds of"
+                    ),
+                ),
+                (
+                    "claim_id",
+                    models.UUIDField(
+                        help_text="Batch of reminders which claimed notifications of the habits"
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "verbose_name_plural": "notification outbox",
+                "ordering": ("id",),
+            },
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.3 on 2026-10-18 11:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("habits", "0010_notificationoutbox"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DeadLetter",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("chat_id", models.BigIntegerField()),
+                ("text", models.TextField()),
+                (
+                    "habit_ids",
+                    models.JSONField(
+                        default=list, help_text="Habits the message reminds of"
+                    ),
+                ),
+                (
+                    "claim_id",
+                    models.UUIDField(
+                        help_text="Batch of reminders which claimed notifications of the habits"
+                    ),
+                ),
+                (
+                    "attempts",
+                    models.PositiveSmallIntegerField(
+                        help_text="How many times sending was attempted"
+                    ),
+                ),
+                ("error", models.TextField(help_text="Error of the last attempt")),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "ordering": ("id",),
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.3 on 2026-10-18 11:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("habits", "0011_deadletter"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="deadletter",
+            name="bot_shard",
+            field=models.PositiveSmallIntegerField(
+                default=0, help_text="Bot sending the message"
+            ),
+        ),
+        migrations.AddField(
+            model_name="notificationoutbox",
+            name="bot_shard",
+            field=models.PositiveSmallIntegerField(
+                default=0, help_text="Bot sending the message"
+            ),
+        ),
+    ]
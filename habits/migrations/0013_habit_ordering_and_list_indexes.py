@@ -0,0 +1,32 @@
+# Generated by Django 5.2.3 on 2026-10-18 12:09
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("habits", "0012_deadletter_bot_shard_notificationoutbox_bot_shard"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name="habit",
+            options={"ordering": ("time", "id")},
+        ),
+        migrations.AddIndex(
+            model_name="habit",
+            index=models.Index(
+                fields=["owner", "time", "id"], name="habits_habi_owner_i_c1ac60_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="habit",
+            index=models.Index(
+                fields=["is_public", "time", "id"],
+                name="habits_habi_is_publ_30e9bf_idx",
+            ),
+        ),
+    ]
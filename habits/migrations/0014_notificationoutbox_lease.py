@@ -0,0 +1,33 @@
+# Generated by Django 5.2.3 on 2026-10-18 12:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("habits", "0013_habit_ordering_and_list_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="notificationoutbox",
+            name="lease_id",
+            field=models.UUIDField(
+                blank=True,
+                editable=False,
+                help_text="Dispatcher sending the message",
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="notificationoutbox",
+            name="leased_until",
+            field=models.DateTimeField(
+                blank=True,
+                editable=False,
+                help_text="Other dispatchers skip the message until then",
+                null=True,
+            ),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.3 on 2026-10-18 13:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("habits", "0014_notificationoutbox_lease"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="notificationoutbox",
+            name="attempts",
+            field=models.PositiveSmallIntegerField(
+                default=0,
+                editable=False,
+                help_text="Failed attempts to send the message",
+            ),
+        ),
+    ]
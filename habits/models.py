@@ -1,5 +1,8 @@
+from datetime import UTC, datetime, timedelta
+
 from django.contrib.auth import get_user_model
 from django.db import models
+from django.utils import timezone
 
 User = get_user_model()
 
@@ -32,24 +35,75 @@ class Habit(models.Model):
     is_public = models.BooleanField(
         default=False, help_text="Public habits can be seen by all users"
     )
+    next_reminder_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        editable=False,
+        help_text="When the next reminder for the habit is due",
+    )
 
     class Meta:
-        ordering = ("time",)
+        ordering = ("time", "id")
         indexes = (
             models.Index(fields=["owner"]),
             models.Index(fields=["is_pleasant"]),
             models.Index(fields=["is_public"]),
+            models.Index(fields=["next_reminder_at"]),
+            # pages of habit lists, see HabitCursorPaginator
+            models.Index(fields=["owner", "time", "id"]),
+            models.Index(fields=["is_public", "time", "id"]),
         )
 
+    # whether the habit was public when loaded, see habits.signals
+    loaded_is_public = False
+
     def __str__(self) -> str:
         return f"{self.action} at {self.time} in {self.place}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        habit = super().from_db(db, field_names, values)
+        # a deferred field might have been public as well
+        habit.loaded_is_public = habit.__dict__.get("is_public", True)
+        return habit
+
+    def save(self, *args, **kwargs) -> None:
+        if self.next_reminder_at is None:
+            last_notification_date = None
+            if self.pk:
+                last_notification_date = self.notifications.aggregate(
+                    date=models.Max("date")
+                )["date"]
+            self.next_reminder_at = self.get_next_reminder_at(last_notification_date)
+        super().save(*args, **kwargs)
+
+    def get_next_reminder_at(self, last_notification_date=None) -> datetime:
+        """
+        Returns the datetime of the next reminder.
+        If habit was never notified, reminder is due today at habit's time,
+        otherwise in `frequency` days after the last notification.
+        """
+
+        if last_notification_date is None:
+            date = timezone.now().date()
+        else:
+            date = last_notification_date + timedelta(days=self.frequency)
+
+        time = self._meta.get_field("time").to_python(self.time)
+        return datetime.combine(date, time, tzinfo=UTC)
+
 
 class HabitNotification(models.Model):
     habit = models.ForeignKey(
         Habit, on_delete=models.CASCADE, related_name="notifications"
     )
     date = models.DateField()
+    claim_id = models.UUIDField(
+        blank=True,
+        null=True,
+        editable=False,
+        help_text="Batch of reminders which claimed the notification for sending",
+    )
 
     class Meta:
         constraints = (
@@ -57,3 +111,65 @@ class HabitNotification(models.Model):
                 fields=("habit", "date"), name="unique_notification_for_date"
             ),
         )
+
+
+class NotificationOutbox(models.Model):
+    chat_id = models.BigIntegerField()
+    bot_shard = models.PositiveSmallIntegerField(
+        default=0, help_text="Bot sending the message"
+    )
+    text = models.TextField()
+    habit_ids = models.JSONField(
+        default=list, help_text="Habits the message reminds of"
+    )
+    claim_id = models.UUIDField(
+        help_text="Batch of reminders which claimed notifications of the habits"
+    )
+    lease_id = models.UUIDField(
+        blank=True,
+        null=True,
+        editable=False,
+        help_text="Dispatcher sending the message",
+    )
+    leased_until = models.DateTimeField(
+        blank=True,
+        null=True,
+        editable=False,
+        help_text="Other dispatchers skip the message until then",
+    )
+    attempts = models.PositiveSmallIntegerField(
+        default=0, editable=False, help_text="Failed attempts to send the message"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ("id",)
+        verbose_name_plural = "notification outbox"
+
+    def __str__(self) -> str:
+        return f"Reminder to chat {self.chat_id} queued at {self.created_at}"
+
+
+class DeadLetter(models.Model):
+    chat_id = models.BigIntegerField()
+    bot_shard = models.PositiveSmallIntegerField(
+        default=0, help_text="Bot sending the message"
+    )
+    text = models.TextField()
+    habit_ids = models.JSONField(
+        default=list, help_text="Habits the message reminds of"
+    )
+    claim_id = models.UUIDField(
+        help_text="Batch of reminders which claimed notifications of the habits"
+    )
+    attempts = models.PositiveSmallIntegerField(
+        help_text="How many times sending was attempted"
+    )
+    error = models.TextField(help_text="Error of the last attempt")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ("id",)
+
+    def __str__(self) -> str:
+        return f"Failed reminder to chat {self.chat_id}: {self.error}"
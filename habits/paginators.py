@@ -1,7 +1,174 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import time
+
+from django.conf import settings
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class HabitCursorPaginator(BasePagination):
+    """
+    Keyset pagination by `(time, id)`. Cursors hold the position of the first
+    or the last habit of a page, so a page is a single indexed query without
+    COUNT or OFFSET, whatever the depth, and habits inserted meanwhile don't
+    shift the following pages.
+    """
+
+    page_size = 5
+    page_size_query_param = "page_size"
+    max_page_size = 10
+    cursor_query_param = "cursor"
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.position, self.reverse = self.decode_cursor(request)
+
+        if self.position is None:
+            queryset = queryset.order_by("time", "id")
+        else:
+            habit_time, habit_id = self.position
+            if self.reverse:
+                queryset = queryset.filter(
+                    Q(time__lt=habit_time) | Q(time=habit_time, id__lt=habit_id)
+                ).order_by("-time", "-id")
+            else:
+                queryset = queryset.filter(
+                    Q(time__gt=habit_time) | Q(time=habit_time, id__gt=habit_id)
+                ).order_by("time", "id")
+
+        # one extra habit tells whether there is a page after this one
+        results = list(queryset[: self.page_size + 1])
+        has_more = len(results) > self.page_size
+        page = results[: self.page_size]
+
+        if self.reverse:
+            page.reverse()
+            self.has_previous, self.has_next = has_more, True
+        else:
+            self.has_previous, self.has_next = self.position is not None, has_more
+        self.page = page
+        return page
+
+    def get_paginated_response(self, data):
+        return Response(
+            {
+                "next": self.get_next_link(),
+                "previous": self.get_previous_link(),
+                "results": data,
+            }
+        )
+
+    def get_page_size(self, request) -> int:
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_next_link(self) -> str | None:
+        if not self.has_next:
+            return None
+        position = self.get_position(self.page[-1]) if self.page else self.position
+        return self.encode_cursor(position, reverse=False)
+
+    def get_previous_link(self) -> str | None:
+        if not self.has_previous:
+            return None
+        position = self.get_position(self.page[0]) if self.page else self.position
+        return self.encode_cursor(position, reverse=True)
+
+    def get_position(self, habit) -> tuple[time, int]:
+        if isinstance(habit, dict):  # a row of `.values()`
+            return habit["time"], habit["id"]
+        return habit.time, habit.id
+
+    def encode_cursor(self, position: tuple[time, int], reverse: bool) -> str:
+        habit_time, habit_id = position
+        data = json.dumps([habit_time.isoformat(), habit_id, int(reverse)])
+        cursor = urlsafe_b64encode(data.encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request) -> tuple[tuple[time, int] | None, bool]:
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None, False
+
+        try:
+            habit_time, habit_id, reverse = json.loads(urlsafe_b64decode(cursor))
+            return (time.fromisoformat(habit_time), int(habit_id)), bool(reverse)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                "name": self.cursor_query_param,
+                "required": False,
+                "in": "query",
+                "description": "The pagination cursor value.",
+                "schema": {"type": "string"},
+            },
+            {
+                "name": self.page_size_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Number of results to return per page.",
+                "schema": {"type": "integer"},
+            },
+        ]
 
 
 class HabitPaginator(PageNumberPagination):
+    """
+    Page number pagination, switched to HabitCursorPaginator by
+    `?pagination=cursor` (or a `cursor` parameter of its links) or for all
+    requests by the HABIT_PAGINATION setting.
+    """
+
     page_size = 5
     page_size_query_param = "page_size"
     max_page_size = 10
+    pagination_query_param = "pagination"
+
+    cursor_paginator = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.use_cursor(request):
+            self.cursor_paginator = HabitCursorPaginator()
+            return self.cursor_paginator.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def use_cursor(self, request) -> bool:
+        pagination = request.query_params.get(
+            self.pagination_query_param, settings.HABIT_PAGINATION
+        )
+        return (
+            pagination == "cursor"
+            or HabitCursorPaginator.cursor_query_param in request.query_params
+        )
+
+    def get_schema_operation_parameters(self, view):
+        return super().get_schema_operation_parameters(view) + [
+            {
+                "name": self.pagination_query_param,
+                "required": False,
+                "in": "query",
+                "description": "`cursor` for keyset pagination by time.",
+                "schema": {"type": "string", "enum": ["page", "cursor"]},
+            },
+            HabitCursorPaginator().get_schema_operation_parameters(view)[0],
+        ]
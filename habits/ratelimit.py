@@ -0,0 +1,144 @@
+import logging
+from functools import cache
+
+import redis
+from django.conf import settings
+
+from .locks import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Takes a token for each chat bucket in KEYS[2:] from the global bucket in
+# KEYS[1] and the chat's bucket. Tokens that aren't there yet are taken in advance,
+# leaving the bucket in debt, unless the wait for them would be longer than
+# ARGV[5] seconds (if it isn't negative), then none are taken. The reply
+# holds how many seconds to wait for each of them, -1 for refused ones,
+# as strings since redis truncates lua numbers.
+TAKE_TOKENS = """
+local now = redis.call("TIME")
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+
+local function refill(key, rate, capacity)
+    local bucket = redis.call("HMGET", key, "tokens", "updated_at")
+    if not bucket[1] then
+        return capacity
+    end
+    return math.min(
+        capacity, tonumber(bucket[1]) + (now - tonumber(bucket[2])) * rate
+    )
+end
+
+local function take(key, tokens, rate, capacity)
+    redis.call("HSET", key, "tokens", tokens - 1, "updated_at", now)
+    redis.call("PEXPIRE", key, math.ceil((capacity - tokens + 1) / rate * 1000))
+end
+
+local rate, capacity = tonumber(ARGV[1]), tonumber(ARGV[2])
+local chat_rate, chat_capacity = tonumber(ARGV[3]), tonumber(ARGV[4])
+local max_wait = tonumber(ARGV[5])
+local waits = {}
+
+for i = 2, #KEYS do
+    local chat_key = KEYS[i]
+    local tokens = refill(KEYS[1], rate, capacity)
+    local chat_tokens = refill(chat_key, chat_rate, chat_capacity)
+    local wait = math.max(0, (1 - tokens) / rate, (1 - chat_tokens) / chat_rate)
+    if max_wait >= 0 and wait > max_wait then
+        waits[#waits + 1] = "-1"
+    else
+        take(KEYS[1], tokens, rate, capacity)
+        take(chat_key, chat_tokens, chat_rate, chat_capacity)
+        waits[#waits + 1] = tostring(wait)
+    end
+end
+
+return waits
+"""
+
+
+class RateLimiter:
+    """
+    Token bucket rate limiter shared by all processes through redis.
+    Keeps for each bot a global bucket refilled by `rate` tokens per second
+    and a bucket per chat refilled by `chat_rate` tokens per second, each
+    holds up to a second worth of tokens (at least one).
+    When buckets are empty, the token is reserved in advance and caller is
+    told how long to wait before sending, unless the wait is longer than
+    caller can wait, then the message is refused.
+    """
+
+    def __init__(
+        self,
+        client: redis.Redis,
+        rate: float,
+        chat_rate: float,
+        prefix: str = "ratelimit:telegram",
+    ) -> None:
+        self.rate = rate
+        self.chat_rate = chat_rate
+        self.prefix = prefix
+        self.client = client
+        self.take_tokens = client.register_script(TAKE_TOKENS)
+
+    def reserve(
+        self, chat_ids: list[int], bot_shard: int = 0, max_wait: float | None = None
+    ) -> list[float | None]:
+        """
+        Takes a token for a message from given bot to each of given chats,
+        in order.
+        Returns amount of seconds to wait before sending each message,
+        None for messages which would wait longer than `max_wait` seconds,
+        no tokens are taken for them.
+        If redis is unavailable messages aren't limited.
+        """
+
+        if not chat_ids:
+            return []
+
+        try:
+            waits = self.take_tokens(
+                # redis cluster requires all keys to be passed and to be
+                # in the same slot, so keys of a bot share a hash tag
+                keys=[
+                    f"{{{self.prefix}:{bot_shard}}}:global",
+                    *(
+                        f"{{{self.prefix}:{bot_shard}}}:chat:{chat_id}"
+                        for chat_id in chat_ids
+                    ),
+                ],
+                args=[
+                    self.rate,
+                    max(1, self.rate),
+                    self.chat_rate,
+                    max(1, self.chat_rate),
+                    -1 if max_wait is None else max_wait,
+                ],
+            )
+        except redis.RedisError as e:
+            logger.warning("Can't reach rate limiter, sending without limits: %s", e)
+            return [0.0] * len(chat_ids)
+
+        waits = [float(wait) for wait in waits]
+        return [None if wait < 0 else wait for wait in waits]
+
+    def reset(self) -> None:
+        """Removes all buckets, making them full again."""
+
+        keys = list(self.client.scan_iter(f"{{{self.prefix}:*"))
+        if keys:
+            self.client.delete(*keys)
+
+
+@cache
+def get_rate_limiter() -> RateLimiter | None:
+    """
+    Returns a shared limiter for telegram api configured from settings,
+    or None if TELEGRAM_RATE_LIMIT is 0.
+    """
+
+    if not settings.TELEGRAM_RATE_LIMIT:
+        return None
+
+    return RateLimiter(
+        get_redis(), settings.TELEGRAM_RATE_LIMIT, settings.TELEGRAM_CHAT_RATE_LIMIT
+    )
@@ -1,12 +1,20 @@
+from collections import defaultdict
+from copy import copy
+from functools import cached_property
+
+from django.db import transaction
+from django.db.models import Max
 from rest_framework import serializers
 
-from .models import Habit
+from .cache import bump_habits_versions, bump_public_feed_version
+from .models import Habit, HabitNotification
 
 
 class HabitSerializer(serializers.ModelSerializer):
     class Meta:
         model = Habit
-        exclude = ("owner",)
+        # next_reminder_at is the scheduler's state
+        exclude = ("owner", "next_reminder_at")
         read_only_fields = ("id",)
 
     def validate_frequency(self, value):
@@ -42,3 +50,254 @@ class HabitSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Related habit must be a pleasant habit.")
 
         return data
+
+    def update(self, instance, validated_data):
+        if "time" in validated_data or "frequency" in validated_data:
+            # recalculated from the last notification on save
+            instance.next_reminder_at = None
+        return super().update(instance, validated_data)
+
+
+class ValuesSerializer:
+    """
+    Read-only counterpart of a model serializer for lists, turning rows of
+    `.values(*sources)` into the same data without model instances and
+    serializer fields per object. Converters of fields are picked once,
+    values of fields representing them as is are copied.
+    """
+
+    # fields representing any value that isn't None as the value itself
+    plain_fields = (
+        serializers.BooleanField,
+        serializers.CharField,
+        serializers.IntegerField,
+        serializers.PrimaryKeyRelatedField,
+    )
+
+    def __init__(self, serializer_class) -> None:
+        self.serializer_class = serializer_class
+
+    @cached_property
+    def fields(self) -> list[tuple]:
+        fields = []
+        for name, field in self.serializer_class().fields.items():
+            if field.write_only:
+                continue
+            if "." in field.source or field.source == "*":
+                raise ValueError(f"Field {name} isn't a column of the model")
+            convert = (
+                None if type(field) in self.plain_fields else field.to_representation
+            )
+            fields.append((name, field.source, convert))
+        return fields
+
+    @property
+    def sources(self) -> list[str]:
+        return [source for _, source, _ in self.fields]
+
+    def to_representation(self, rows) -> list[dict]:
+        data = []
+        for row in rows:
+            item = {}
+            for name, source, convert in self.fields:
+                value = row[source]
+                if convert is not None and value is not None:
+                    value = convert(value)
+                item[name] = value
+            data.append(item)
+        return data
+
+
+class PrefetchedHabitField(serializers.PrimaryKeyRelatedField):
+    """
+    Related habit field resolving ids from `habits` of serializer context,
+    which HabitBatchSerializer loads for all operations at once.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail("incorrect_type", data_type=type(data).__name__)
+        try:
+            habit = self.context["habits"].get(int(data))
+        except (TypeError, ValueError):
+            self.fail("incorrect_type", data_type=type(data).__name__)
+        if habit is None:
+            self.fail("does_not_exist", pk_value=data)
+        return habit
+
+
+class HabitBatchItemSerializer(HabitSerializer):
+    related_habit = PrefetchedHabitField(
+        queryset=Habit.objects.all(),
+        allow_null=True,
+        required=False,
+        help_text=Habit._meta.get_field("related_habit").help_text,
+    )
+
+
+class HabitOperationSerializer(serializers.Serializer):
+    op = serializers.ChoiceField(choices=("create", "update", "delete"))
+    id = serializers.IntegerField(required=False, help_text="Habit to update or delete")
+    data = serializers.DictField(
+        required=False, help_text="Habit fields to create or update"
+    )
+
+    def validate(self, data):
+        if data["op"] != "create" and "id" not in data:
+            raise serializers.ValidationError({"id": "This field is required."})
+        if data["op"] != "delete" and "data" not in data:
+            raise serializers.ValidationError({"data": "This field is required."})
+        return data
+
+
+class HabitBatchSerializer(serializers.Serializer):
+    """
+    Creates, updates and deletes habits of the user in `owner` of context
+    all at once. Habits of all operations and their related habits are
+    loaded by a single query, changes are applied by a query per kind of
+    operation in one transaction, either all of them or none.
+    """
+
+    operations = HabitOperationSerializer(many=True, allow_empty=False, max_length=100)
+
+    def validate_operations(self, operations):
+        ids = {operation["id"] for operation in operations if "id" in operation}
+        for operation in operations:
+            try:
+                ids.add(int(operation.get("data", {}).get("related_habit")))
+            except (TypeError, ValueError):
+                pass  # reported by validation of the operation
+        habits = Habit.objects.in_bulk(ids)
+        owner = self.context["owner"]
+        related_habits = self.get_related_habits(operations, habits)
+        deleted_ids = {
+            operation["id"] for operation in operations if operation["op"] == "delete"
+        }
+
+        # errors by index of operation, as for fields of the operations
+        changed_ids, errors = set(), {}
+        for index, operation in enumerate(operations):
+            error = {}
+            habit = habits.get(operation.get("id"))
+            if "id" in operation:
+                if habit is None or habit.owner_id != owner.pk:
+                    error["id"] = ["Habit not found."]
+                elif habit.id in changed_ids:
+                    error["id"] = ["Habit is changed by another operation."]
+                changed_ids.add(operation["id"])
+
+            if operation["op"] != "delete" and not error:
+                serializer = HabitBatchItemSerializer(
+                    habit,
+                    data=operation["data"],
+                    partial=operation["op"] == "update",
+                    context={"habits": related_habits},
+                )
+                if serializer.is_valid():
+                    related_habit = serializer.validated_data.get("related_habit")
+                    if related_habit is not None and related_habit.id in deleted_ids:
+                        error["data"] = {
+                            "related_habit": ["Related habit is deleted by the batch."]
+                        }
+                    operation["habit"] = habit
+                    operation["validated_data"] = serializer.validated_data
+                else:
+                    error["data"] = serializer.errors
+            if error:
+                errors[index] = error
+
+        if errors:
+            raise serializers.ValidationError(errors)
+        return operations
+
+    def get_related_habits(self, operations, habits):
+        """
+        Returns given habits by id as related habits see them after the batch,
+        with `is_pleasant` changed by updates, so e.g. a habit made unpleasant
+        by the batch can't be linked as related by it.
+        """
+
+        related_habits = dict(habits)
+        for operation in operations:
+            habit = habits.get(operation.get("id"))
+            data = operation.get("data", {})
+            if (
+                operation["op"] != "update"
+                or habit is None
+                or "is_pleasant" not in data
+            ):
+                continue
+            try:
+                is_pleasant = serializers.BooleanField().to_internal_value(
+                    data["is_pleasant"]
+                )
+            except serializers.ValidationError:
+                continue  # reported by validation of the operation
+            related_habits[habit.id] = copy(habit)
+            related_habits[habit.id].is_pleasant = is_pleasant
+        return related_habits
+
+    def create(self, validated_data):
+        operations = validated_data["operations"]
+        owner = self.context["owner"]
+
+        created, updated, deleted_ids = [], [], []
+        # fields changed by each updated habit's operation
+        update_fields = {}
+        rescheduled_ids = set()
+        for operation in operations:
+            if operation["op"] == "delete":
+                deleted_ids.append(operation["id"])
+                continue
+
+            changes = operation["validated_data"]
+            if operation["op"] == "create":
+                habit = Habit(owner=owner, **changes)
+                habit.next_reminder_at = habit.get_next_reminder_at()
+                created.append(habit)
+            else:
+                habit = operation["habit"]
+                for field, value in changes.items():
+                    setattr(habit, field, value)
+                update_fields[habit.id] = set(changes)
+                if "time" in changes or "frequency" in changes:
+                    rescheduled_ids.add(habit.id)
+                    update_fields[habit.id].add("next_reminder_at")
+                updated.append(habit)
+            operation["habit"] = habit
+
+        public_changed = any(
+            habit.is_public or habit.loaded_is_public for habit in created + updated
+        )
+        with transaction.atomic():
+            if deleted_ids:
+                # deletes send signals, so habits are fetched anyway
+                Habit.objects.filter(id__in=deleted_ids).delete()
+            if rescheduled_ids:
+                last_notification_dates = dict(
+                    HabitNotification.objects.filter(habit__in=rescheduled_ids)
+                    .values("habit")
+                    .annotate(date=Max("date"))
+                    .values_list("habit", "date")
+                )
+                for habit in updated:
+                    if habit.id in rescheduled_ids:
+                        habit.next_reminder_at = habit.get_next_reminder_at(
+                            last_notification_dates.get(habit.id)
+                        )
+            Habit.objects.bulk_create(created)
+            # habits are written only with their own changes, e.g.
+            # next_reminder_at of other habits may be advanced by the scheduler
+            habits_by_fields = defaultdict(list)
+            for habit in updated:
+                if update_fields[habit.id]:
+                    habits_by_fields[frozenset(update_fields[habit.id])].append(habit)
+            for fields, habits in habits_by_fields.items():
+                Habit.objects.bulk_update(habits, sorted(fields))
+
+            # bulk_create and bulk_update send no signals
+            transaction.on_commit(lambda: bump_habits_versions([owner.pk]))
+            if public_changed:
+                transaction.on_commit(bump_public_feed_version)
+
+        return operations
@@ -1,25 +1,376 @@
+import asyncio
 import logging
+import threading
+import time
+import weakref
+from collections import defaultdict
+from dataclasses import dataclass
+from functools import cache
 
+import httpx
 import requests
 from django.conf import settings
 
+from users.services import get_bot_tokens
+
+from .metrics import observe_send
+from .ratelimit import get_rate_limiter
+
 logger = logging.getLogger(__name__)
 
+# descriptions of errors telegram responds with when the chat is gone or
+# the bot can't write there, retrying won't help unlike e.g. a 400 for
+# a too long message
+PERMANENT_ERRORS = (
+    "chat not found",
+    "bot was blocked by the user",
+    "bot was kicked",
+    "bot can't initiate conversation",
+    "user is deactivated",
+)
+PERMANENT_ERROR_STATUSES = (400, 403)
+
+
+def is_permanent_description(status_code: int | None, description: str) -> bool:
+    """Whether telegram refused a message with given error for good."""
+
+    description = description.lower()
+    return status_code in PERMANENT_ERROR_STATUSES and any(
+        error in description for error in PERMANENT_ERRORS
+    )
+
+
+@dataclass(frozen=True)
+class SendResult:
+    """Result of sending a single telegram message."""
+
+    chat_id: int
+    ok: bool
+    status_code: int | None = None
+    retry_after: int | None = None
+    error: str = ""
+    # not sent, it would have to wait past the deadline
+    deferred: bool = False
+
+    @property
+    def is_permanent_error(self) -> bool:
+        """Whether the message can't be delivered to the chat at all."""
+
+        return is_permanent_description(self.status_code, self.error)
+
+
+class MissingBotTokenError(requests.exceptions.RequestException):
+    """Raised when the token of the bot to send a message from isn't set."""
+
+
+class CircuitBreaker:
+    """
+    Stops requests to telegram api after `failure_threshold` failed requests
+    in a row for `recovery_time` seconds, then lets a single trial request
+    through. Shared by all threads and event loops of the process.
+    """
+
+    def __init__(self, failure_threshold: int = 5, recovery_time: float = 30) -> None:
+        self.failure_threshold = failure_threshold
+        self.recovery_time = recovery_time
+
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+
+    def allow(self) -> bool:
+        """Whether a request may be sent now."""
+
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.recovery_time:
+                return False
+            # let a trial request through, others wait for its outcome or
+            # for another recovery time if it never reports one
+            self._opened_at = time.monotonic()
+            return True
 
-def send_telegram_message(chat_id: int, text: str) -> None:
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._opened_at is None and self._failures < self.failure_threshold:
+                return
+            self._opened_at = time.monotonic()
+            logger.error(
+                "Telegram api failed %s times in a row, pausing requests for %ss",
+                self._failures,
+                self.recovery_time,
+            )
+
+
+class TelegramClient:
+    """
+    Async client for telegram bot api of a single bot.
+    Keeps a pool of keep-alive connections, so it's meant to live as long
+    as the event loop it's used in. Retries throttled (429), server (5xx)
+    and connection errors with exponential backoff, honouring `retry_after`
+    of 429 responses, as long as a retry starts by the deadline.
+    Skips requests while `circuit_breaker` considers the api down.
+    """
+
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(
+        self,
+        token: str,
+        api_url: str = "https://api.telegram.org",
+        connect_timeout: float = 3.05,
+        read_timeout: float = 10,
+        max_retries: int = 3,
+        backoff_factor: float = 0.5,
+        pool_size: int = 10,
+        circuit_breaker: CircuitBreaker | None = None,
+    ) -> None:
+        self.url = f"{api_url}/bot{token}/sendMessage"
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=pool_size, max_keepalive_connections=pool_size
+            ),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+        )
+
+    async def send_message(
+        self, chat_id: int, text: str, deadline: float | None = None
+    ) -> SendResult:
+        """
+        Sends a message to a telegram chat by given chat_id.
+        `deadline` is the event loop time by which a retry has to start.
+        Returns the result of the last attempt, never raises for status.
+        """
+
+        if not self.circuit_breaker.allow():
+            return SendResult(
+                chat_id, ok=False, error="Telegram api is unavailable, request skipped"
+            )
+
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.max_retries + 1):
+            result = await _post_message(self.client, self.url, chat_id, text)
+            if result.ok or result.status_code not in (None, *self.RETRY_STATUSES):
+                self.circuit_breaker.record_success()
+                return result
+
+            delay = max(self.backoff_factor * 2**attempt, result.retry_after or 0)
+            if attempt == self.max_retries or (
+                deadline is not None and loop.time() + delay > deadline
+            ):
+                break
+            logger.warning(
+                "Telegram api failed to send message to chat %s: %s, retrying in %ss",
+                chat_id,
+                result.error,
+                delay,
+            )
+            await asyncio.sleep(delay)
+
+        self.circuit_breaker.record_failure()
+        return result
+
+
+def get_bot_token(bot_shard: int) -> str | None:
+    """Returns token of the bot with given shard, None if there is no such bot."""
+
+    tokens = get_bot_tokens()
+    return tokens[bot_shard] if bot_shard < len(tokens) else None
+
+
+@cache
+def get_circuit_breaker(token: str) -> CircuitBreaker:
     """
-    Sends a message to a telegram chat by given chat_id.
-    Requires the token to be set in settings.
-    Raises exception for status.
+    Returns the circuit breaker shared by clients of the bot with given token,
+    configured from settings.
     """
 
-    token = settings.TELEGRAM_BOT_TOKEN
+    return CircuitBreaker(
+        settings.TELEGRAM_FAILURE_THRESHOLD, settings.TELEGRAM_RECOVERY_TIME
+    )
+
+
+# clients keep connections bound to the event loop they were opened in
+_telegram_clients = weakref.WeakKeyDictionary()
+
+
+def get_telegram_client(token: str, api_url: str) -> TelegramClient:
+    """
+    Returns a shared TelegramClient for given bot in the running event loop,
+    configured from settings.
+    """
+
+    clients = _telegram_clients.setdefault(asyncio.get_running_loop(), {})
+    if (token, api_url) not in clients:
+        clients[token, api_url] = TelegramClient(
+            token,
+            api_url,
+            connect_timeout=settings.TELEGRAM_CONNECT_TIMEOUT,
+            read_timeout=settings.TELEGRAM_READ_TIMEOUT,
+            max_retries=settings.TELEGRAM_MAX_RETRIES,
+            pool_size=settings.TELEGRAM_CONCURRENCY,
+            circuit_breaker=get_circuit_breaker(token),
+        )
+    return clients[token, api_url]
+
+
+_local = threading.local()
+
+
+def run_async(coroutine):
+    """
+    Runs given coroutine in the event loop of the current thread and returns
+    its result. The loop is kept between runs, so telegram clients keep
+    their connections alive from one batch or tick to the next.
+    """
+
+    if not hasattr(_local, "runner"):
+        _local.runner = asyncio.Runner()
+    return _local.runner.run(coroutine)
+
+
+def send_telegram_message(chat_id: int, text: str, bot_shard: int = 0) -> None:
+    """
+    Sends a message to a telegram chat by given chat_id
+    from the bot with given shard, through the shared client of the bot.
+    Raises MissingBotTokenError if the bot's token isn't set in settings,
+    HTTPError if the message wasn't sent.
+    """
+
+    token = get_bot_token(bot_shard)
     if not token:
-        logger.error("TELEGRAM_BOT_TOKEN isn't set, can't send the message")
-        return
+        raise MissingBotTokenError(f"Token of bot {bot_shard} isn't set")
+
+    async def send() -> SendResult:
+        client = get_telegram_client(token, settings.TELEGRAM_API_URL)
+        return await client.send_message(chat_id, text)
+
+    result = run_async(send())
+    if not result.ok:
+        raise requests.HTTPError(
+            f"Failed to send Telegram message to chat {chat_id}: {result.error}"
+        )
+
+
+async def send_telegram_messages(
+    messages: list[tuple[int, str, int]],
+    concurrency: int | None = None,
+    max_wait: float | None = None,
+) -> list[SendResult]:
+    """
+    Sends messages by given (chat_id, text, bot_shard) triples to telegram
+    chats from the bots with given shards.
+    Messages are sent concurrently over shared clients of the bots, at most
+    `concurrency` (TELEGRAM_CONCURRENCY by default) requests at once.
+    Sends are spread over time to keep within the shared rate limits.
+    Messages whose turn doesn't come within `max_wait` seconds aren't sent
+    and are returned deferred, failed sends are retried if the retry starts
+    within `max_wait` seconds.
+    Returns results in the same order as messages, never raises for status.
+    """
+
+    concurrency = concurrency or settings.TELEGRAM_CONCURRENCY
+    semaphore = asyncio.Semaphore(concurrency)
+    tokens = get_bot_tokens()
+    api_url = settings.TELEGRAM_API_URL
+    delays = reserve_turns(messages, max_wait)
+    loop = asyncio.get_running_loop()
+    deadline = None if max_wait is None else loop.time() + max_wait
+
+    async def send(
+        chat_id: int, text: str, bot_shard: int, delay: float | None
+    ) -> SendResult:
+        if delay is None:
+            return SendResult(
+                chat_id, ok=False, error="Rate limited past deadline", deferred=True
+            )
+        if bot_shard >= len(tokens):
+            logger.error("Token of bot %s isn't set, can't send message", bot_shard)
+            return SendResult(
+                chat_id, ok=False, error=f"Token of bot {bot_shard} isn't set"
+            )
+
+        client = get_telegram_client(tokens[bot_shard], api_url)
+        await asyncio.sleep(delay)
+        async with semaphore:
+            # waiting for other requests may take too long as well
+            if deadline is not None and loop.time() > deadline:
+                return SendResult(
+                    chat_id, ok=False, error="Waited past deadline", deferred=True
+                )
+            return await client.send_message(chat_id, text, deadline)
+
+    return await asyncio.gather(
+        *(send(*message, delay) for message, delay in zip(messages, delays))
+    )
+
+
+def reserve_turns(
+    messages: list[tuple[int, str, int]], max_wait: float | None = None
+) -> list[float | None]:
+    """
+    Reserves turns from the rate limiter of each message's bot.
+    Returns amount of seconds to wait before sending each message,
+    None for messages whose turn doesn't come within `max_wait` seconds.
+    """
+
+    delays = [0.0] * len(messages)
+    rate_limiter = get_rate_limiter()
+    if rate_limiter is None:
+        return delays
+
+    bot_messages = defaultdict(list)
+    for index, (_, _, bot_shard) in enumerate(messages):
+        bot_messages[bot_shard].append(index)
+
+    for bot_shard, indexes in bot_messages.items():
+        chat_ids = [messages[index][0] for index in indexes]
+        waits = rate_limiter.reserve(chat_ids, bot_shard, max_wait)
+        for index, delay in zip(indexes, waits):
+            delays[index] = delay
+
+    return delays
+
+
+async def _post_message(
+    client: httpx.AsyncClient, url: str, chat_id: int, text: str
+) -> SendResult:
+    started_at = time.perf_counter()
+    try:
+        response = await client.post(url, data={"chat_id": chat_id, "text": text})
+    except httpx.HTTPError as e:
+        observe_send(started_at, None)
+        return SendResult(chat_id, ok=False, error=str(e) or type(e).__name__)
+
+    observe_send(started_at, response.status_code)
+
+    if not response.is_error:
+        return SendResult(chat_id, ok=True, status_code=response.status_code)
+
+    try:
+        data = response.json()
+    except ValueError:
+        data = {}
 
-    url = f"https://api.telegram.org/bot{token}/sendMessage"
-    payload = {"chat_id": chat_id, "text": text}
+    retry_after = None
+    if response.status_code == 429:
+        retry_after = data.get("parameters", {}).get("retry_after")
+        retry_after = int(retry_after or response.headers.get("Retry-After", 1))
 
-    response = requests.post(url, payload)
-    response.raise_for_status()
+    return SendResult(
+        chat_id,
+        ok=False,
+        status_code=response.status_code,
+        retry_after=retry_after,
+        error=data.get("description") or response.reason_phrase,
+    )
@@ -0,0 +1,76 @@
+from django.db import transaction
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from users.models import User
+
+from .cache import bump_habits_versions, bump_public_feed_version
+from .models import Habit
+
+
+@receiver(post_save, sender=Habit)
+@receiver(post_delete, sender=Habit)
+def invalidate_owner_habits(sender, instance, **kwargs) -> None:
+    """Makes ETags of habits of the habit's owner stale."""
+
+    # after commit, so a response with old data doesn't get the new etag
+    transaction.on_commit(lambda: bump_habits_versions([instance.owner_id]))
+
+
+@receiver(post_save, sender=Habit)
+def invalidate_public_feed_on_save(sender, instance, **kwargs) -> None:
+    """Invalidates public feed cache if the habit is or was public."""
+
+    if instance.is_public or instance.loaded_is_public:
+        # after commit, so the feed isn't cached again with old data meanwhile
+        transaction.on_commit(bump_public_feed_version)
+    instance.loaded_is_public = instance.is_public
+
+
+@receiver(post_delete, sender=Habit)
+def invalidate_public_feed_on_delete(sender, instance, **kwargs) -> None:
+    """Invalidates public feed cache if the deleted habit was public."""
+
+    if instance.is_public or instance.loaded_is_public:
+        transaction.on_commit(bump_public_feed_version)
+
+
+def get_habits_related_to_deleted(instance: Habit, origin) -> QuerySet:
+    """Returns habits related to the habits deleted along with `instance`."""
+
+    if isinstance(origin, QuerySet) and origin.model is Habit:
+        return Habit.objects.filter(related_habit__in=origin)
+    # habits deleted along with their owners
+    if isinstance(origin, User):
+        return Habit.objects.filter(related_habit__owner=origin)
+    if isinstance(origin, QuerySet) and origin.model is User:
+        return Habit.objects.filter(related_habit__owner__in=origin)
+    return Habit.objects.filter(related_habit=instance)
+
+
+@receiver(pre_delete, sender=Habit)
+def invalidate_related_habits(sender, instance, origin=None, **kwargs) -> None:
+    """
+    Makes ETags of habits related to deleted habits stale and invalidates
+    public feed cache if any of them is public, their related habit is set
+    to null by an update without signals.
+    """
+
+    # the signal is sent for every deleted habit, so related habits of all of
+    # them are checked once per deletion
+    if getattr(origin, "related_habits_invalidated", False):
+        return
+    if origin is not None:
+        origin.related_habits_invalidated = True
+
+    related = set(
+        get_habits_related_to_deleted(instance, origin)
+        .values_list("owner_id", "is_public")
+        .distinct()
+    )
+    owner_ids = {owner_id for owner_id, _ in related}
+    if owner_ids:
+        transaction.on_commit(lambda: bump_habits_versions(owner_ids))
+    if any(is_public for _, is_public in related):
+        transaction.on_commit(bump_public_feed_version)
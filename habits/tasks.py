@@ -1,65 +1,439 @@
 import logging
+import uuid
+from datetime import timedelta
+from itertools import batched, groupby
+from operator import attrgetter, itemgetter
 
-from celery import shared_task
+from celery import group, shared_task
+from celery.utils.time import get_exponential_backoff_interval
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Case, F, Q, Value, When
 from django.utils import timezone
-from requests.exceptions import HTTPError
 
-from .models import Habit, HabitNotification
-from .services import send_telegram_message
+from .locks import single_flight
+from .metrics import reminder_tick_due_habits, reminder_tick_duration
+from .models import DeadLetter, Habit, HabitNotification, NotificationOutbox
+from .services import get_bot_token, run_async, send_telegram_messages
 
 logger = logging.getLogger(__name__)
 
+User = get_user_model()
+
+# the longest text of a telegram message
+MESSAGE_MAX_LENGTH = 4096
+DIGEST_HEADER = "🔔 Habit Reminder!\nHey, it’s time to:"
+
+
+def get_reminder_text(habit: Habit) -> str:
+    """Returns the text of reminder message for given habit."""
+
+    return (
+        "🔔 Habit Reminder!\n"
+        f"Hey, it’s time to: {habit.action} at {habit.time} in {habit.place}.\n"
+        f"⏳ You have {habit.execution_time} seconds to make it."
+    )
+
+
+def get_digests(habits: list[Habit]) -> list[tuple[str, list[Habit]]]:
+    """
+    Returns texts of reminder messages for several habits, each with
+    the habits it reminds of. Habits are split between as many messages
+    as needed to keep texts within MESSAGE_MAX_LENGTH.
+    """
+
+    digests = []
+    text, digest_habits = DIGEST_HEADER, []
+    length = get_text_length(text)
+    for habit in habits:
+        line = (
+            f"\n• {habit.action} at {habit.time} in {habit.place} "
+            f"({habit.execution_time} seconds)"
+        )
+        line_length = get_text_length(line)
+        if digest_habits and length + line_length > MESSAGE_MAX_LENGTH:
+            digests.append((text, digest_habits))
+            text, digest_habits = DIGEST_HEADER, []
+            length = get_text_length(text)
+        text += line
+        length += line_length
+        digest_habits.append(habit)
+
+    if digest_habits:
+        digests.append((text, digest_habits))
+    return digests
+
+
+def get_text_length(text: str) -> int:
+    """Returns length of the text as telegram counts it, in UTF-16 code units."""
+
+    return len(text.encode("utf-16-le")) // 2
+
+
+def get_due_habits(now):
+    """
+    Returns a queryset of habits whose next reminder is due by now
+    and whose owners have a telegram chat id which isn't undeliverable.
+    Reminders overdue since an earlier day (e.g. the chat was linked later
+    or the scheduler was down) are due at the habit's time of day.
+    """
+
+    return Habit.objects.filter(
+        next_reminder_at__lte=now,
+        time__lte=now.time(),
+        owner__telegram_chat_id__isnull=False,
+        owner__telegram_undeliverable_at__isnull=True,
+    ).select_related("owner")
+
+
+def get_due_chunks(now):
+    """
+    Yields ids of habits due by now in chunks of about REMINDER_CHUNK_SIZE.
+    Habits are streamed from the database, so only a single chunk is kept
+    in memory. Habits of the same owner are never split between chunks,
+    so they can be sent in a single digest message.
+    """
+
+    due_habits = (
+        get_due_habits(now)
+        .order_by("owner_id", "id")
+        .values_list("id", "owner_id")
+        .iterator(chunk_size=settings.REMINDER_CHUNK_SIZE)
+    )
+
+    chunk = []
+    for _, owner_habits in groupby(due_habits, key=itemgetter(1)):
+        if len(chunk) >= settings.REMINDER_CHUNK_SIZE:
+            yield chunk
+            chunk = []
+        chunk.extend(habit_id for habit_id, _ in owner_habits)
+
+    if chunk:
+        yield chunk
+
 
 @shared_task
+@single_flight("check_habits", ttl=settings.CHECK_HABITS_LEASE_TTL)
 def check_habits() -> None:
     """
-    Checks which habits are scheduled for now or earlier today,
-    sends reminders to their owners if not already sent.
+    Checks which habits have a reminder due by now and dispatches them
+    in chunks to `queue_reminders` tasks on the reminders queue,
+    REMINDER_GROUP_SIZE chunks per celery group.
+    Skipped if the previous run hasn't finished yet.
+    """
+
+    habits_count = chunks_count = 0
+    with reminder_tick_duration.time():
+        for chunks in batched(
+            get_due_chunks(timezone.now()), settings.REMINDER_GROUP_SIZE
+        ):
+            group([queue_reminders.s(chunk) for chunk in chunks]).apply_async()
+            habits_count += sum(map(len, chunks))
+            chunks_count += len(chunks)
+    reminder_tick_due_habits.set(habits_count)
+
+    if chunks_count:
+        logger.info("Dispatched %s due habits in %s chunks", habits_count, chunks_count)
+
+
+@shared_task
+def queue_reminders(habit_ids: list[int]) -> None:
+    """
+    Claims today's notifications for given habits that are still due,
+    renders reminders for claimed ones into the outbox and schedules
+    the next reminders, all in one transaction.
+    Claimed notifications make overlapping runs skip the same habits.
+    Starts an outbox dispatcher afterwards.
     """
 
     now = timezone.now()
-    habits = (
-        Habit.objects.filter(time__lte=now.time())
-        .select_related("owner")
-        .prefetch_related("notifications")
-    )
+    claim_id = uuid.uuid4()
 
-    for habit in habits:
-        last_notification = habit.notifications.order_by("-date").first()
+    with transaction.atomic():
+        habits = claim_reminders(
+            get_due_habits(now)
+            .filter(id__in=habit_ids)
+            .order_by("owner_id", "id")
+            .only(
+                "place",
+                "time",
+                "action",
+                "frequency",
+                "execution_time",
+                "owner__telegram_chat_id",
+                "owner__reminder_digest",
+                "owner__bot_shard",
+            ),
+            now.date(),
+            claim_id,
+        )
+        if not habits:
+            return
+
+        # each message reminds of a group of habits: a digest or a single habit
+        messages = []
+        for owner, owner_habits in groupby(habits, key=attrgetter("owner")):
+            owner_habits = list(owner_habits)
+            if owner.reminder_digest and len(owner_habits) > 1:
+                for text, digest_habits in get_digests(owner_habits):
+                    messages.append(
+                        NotificationOutbox(
+                            chat_id=owner.telegram_chat_id,
+                            bot_shard=owner.bot_shard or 0,
+                            text=text,
+                            habit_ids=[habit.id for habit in digest_habits],
+                            claim_id=claim_id,
+                        )
+                    )
+                continue
+
+            for habit in owner_habits:
+                messages.append(
+                    NotificationOutbox(
+                        chat_id=owner.telegram_chat_id,
+                        bot_shard=owner.bot_shard or 0,
+                        text=get_reminder_text(habit),
+                        habit_ids=[habit.id],
+                        claim_id=claim_id,
+                    )
+                )
 
-        if last_notification:
-            days_since_last = (now.date() - last_notification.date).days
-            if days_since_last < habit.frequency:
+        for habit in habits:
+            habit.next_reminder_at = habit.get_next_reminder_at(now.date())
+            logger.debug(
+                "Queued reminder for habit %s",
+                habit.id,
+                extra={"habit_id": habit.id, "user_id": habit.owner_id},
+            )
+
+        NotificationOutbox.objects.bulk_create(messages)
+        Habit.objects.bulk_update(habits, ["next_reminder_at"])
+
+    logger.info("Queued %s reminders for %s habits", len(messages), len(habits))
+    dispatch_outbox.delay()
+
+
+@shared_task
+def dispatch_outbox() -> None:
+    """
+    Sends messages from the outbox in batches until it's empty.
+    Each batch is leased for OUTBOX_LEASE_TTL seconds in a short transaction
+    with SELECT ... FOR UPDATE SKIP LOCKED, so any amount of dispatchers can
+    drain the outbox in parallel, and sent without holding any locks.
+    Messages of a dispatcher which didn't finish in time are sent again.
+    Sent messages and ones the chat refused for good are removed from the
+    outbox. Failed ones stay leased until their retry with exponential
+    backoff and jitter, after REMINDER_MAX_RETRIES retries they are moved
+    to dead letters, as well as messages of a bot without a token.
+    Messages which couldn't be sent before the lease is over because of
+    rate limits stay leased for REMINDER_RETRY_BACKOFF seconds without
+    counting an attempt, and the run stops, as limits are used up.
+    """
+
+    while True:
+        lease_id = uuid.uuid4()
+        messages = lease_outbox_batch(lease_id)
+        if not messages:
+            return
+
+        results = run_async(
+            send_telegram_messages(
+                [
+                    (message.chat_id, message.text, message.bot_shard)
+                    for message in messages
+                ],
+                # a retry has to be over before the lease is,
+                # so another dispatcher doesn't send the message again
+                max_wait=max(
+                    0,
+                    settings.OUTBOX_LEASE_TTL
+                    - settings.TELEGRAM_CONNECT_TIMEOUT
+                    - settings.TELEGRAM_READ_TIMEOUT,
+                ),
+            )
+        )
+
+        now = timezone.now()
+        delivered_chat_ids, refused_chat_ids = set(), set()
+        done_ids, failed, dead_letters = [], [], []
+        deferred = False
+        for message, result in zip(messages, results):
+            extra = {"chat_id": message.chat_id, "habit_ids": message.habit_ids}
+            if result.ok:
+                # a line per message, sent ones are counted by metrics
                 logger.debug(
-                    "Skipping habit %s (frequency %s): last notification %s days ago",
-                    habit,
-                    habit.frequency,
-                    days_since_last,
+                    "Sent reminder to chat %s for habits %s",
+                    message.chat_id,
+                    message.habit_ids,
+                    extra=extra,
                 )
+                delivered_chat_ids.add(message.chat_id)
+                done_ids.append(message.id)
                 continue
 
-        chat_id = habit.owner.telegram_chat_id
-        if not chat_id:
-            logger.debug("Skipping user %s: doesn't have telegram chat id", habit.owner)
-            continue
+            if result.deferred:
+                message.leased_until = now + timedelta(
+                    seconds=settings.REMINDER_RETRY_BACKOFF
+                )
+                failed.append(message)
+                deferred = True
+                continue
 
-        message = (
-            "🔔 Habit Reminder!\n"
-            f"Hey, it’s time to: {habit.action} at {habit.time} in {habit.place}.\n"
-            f"⏳ You have {habit.execution_time} seconds to make it."
-        )
+            if result.is_permanent_error:
+                logger.warning(
+                    "Chat %s refused reminder for habits %s: %s",
+                    message.chat_id,
+                    message.habit_ids,
+                    result.error,
+                    extra=extra,
+                )
+                refused_chat_ids.add(message.chat_id)
+                done_ids.append(message.id)
+                continue
+
+            message.attempts += 1
+            # retrying won't set a missing token
+            if (
+                message.attempts > settings.REMINDER_MAX_RETRIES
+                or get_bot_token(message.bot_shard) is None
+            ):
+                logger.error(
+                    "Giving up reminder to chat %s after %s attempts: %s",
+                    message.chat_id,
+                    message.attempts,
+                    result.error,
+                    extra=extra,
+                )
+                dead_letters.append(
+                    DeadLetter(
+                        chat_id=message.chat_id,
+                        bot_shard=message.bot_shard,
+                        text=message.text,
+                        habit_ids=message.habit_ids,
+                        claim_id=message.claim_id,
+                        attempts=message.attempts,
+                        error=result.error,
+                    )
+                )
+                done_ids.append(message.id)
+                continue
 
-        try:
-            send_telegram_message(chat_id, message)
-        except HTTPError as e:
             logger.error(
-                "Failed to send Telegram message to user %s: %s", habit.owner, e
+                "Failed to send Telegram message to chat %s: %s (retry after %s)",
+                message.chat_id,
+                result.error,
+                result.retry_after,
+                extra=extra,
             )
-        else:
-            logger.info(
-                "Sent reminder to user %s for habit %s at %s",
-                habit.owner,
-                habit.action,
-                now,
+            # at least a backoff, so this run doesn't lease it again
+            countdown = settings.REMINDER_RETRY_BACKOFF + get_retry_countdown(
+                message.attempts - 1
             )
-            HabitNotification.objects.create(habit=habit, date=now.date())
+            message.leased_until = now + timedelta(
+                seconds=max(countdown, result.retry_after or 0)
+            )
+            failed.append(message)
+
+        # messages are removed only along with their outcome
+        with transaction.atomic():
+            record_deliveries(delivered_chat_ids, refused_chat_ids)
+            DeadLetter.objects.bulk_create(dead_letters)
+            leased = NotificationOutbox.objects.filter(lease_id=lease_id)
+            if failed:
+                leased.bulk_update(failed, ["attempts", "leased_until"])
+            if done_ids:
+                leased.filter(id__in=done_ids).delete()
+
+        if deferred:
+            logger.info("Rate limits are used up, deferring the rest of the outbox")
+            return
+
+
+def lease_outbox_batch(lease_id: uuid.UUID) -> list[NotificationOutbox]:
+    """
+    Leases up to OUTBOX_BATCH_SIZE outbox messages which aren't leased
+    by another dispatcher, or whose lease is over, and returns them.
+    """
+
+    now = timezone.now()
+
+    with transaction.atomic():
+        messages = list(
+            NotificationOutbox.objects.select_for_update(skip_locked=True).filter(
+                Q(leased_until__isnull=True) | Q(leased_until__lte=now)
+            )[: settings.OUTBOX_BATCH_SIZE]
+        )
+        if not messages:
+            return []
+
+        leased_until = now + timedelta(seconds=settings.OUTBOX_LEASE_TTL)
+        NotificationOutbox.objects.filter(
+            id__in=[message.id for message in messages]
+        ).update(lease_id=lease_id, leased_until=leased_until)
+
+    return messages
+
+
+def record_deliveries(delivered_chat_ids=(), refused_chat_ids=()) -> None:
+    """
+    Resets count of refused messages for chats messages were delivered to,
+    adds one for chats which refused a message for good. Chats refusing
+    TELEGRAM_UNDELIVERABLE_AFTER messages in a row are flagged undeliverable.
+    """
+
+    if delivered_chat_ids:
+        User.objects.filter(
+            telegram_chat_id__in=delivered_chat_ids, telegram_failures__gt=0
+        ).update(telegram_failures=0)
+
+    if refused_chat_ids:
+        User.objects.filter(telegram_chat_id__in=refused_chat_ids).update(
+            telegram_failures=F("telegram_failures") + 1,
+            # conditions see values from before the update
+            telegram_undeliverable_at=Case(
+                When(
+                    telegram_undeliverable_at__isnull=True,
+                    telegram_failures__gte=settings.TELEGRAM_UNDELIVERABLE_AFTER - 1,
+                    then=Value(timezone.now()),
+                ),
+                default=F("telegram_undeliverable_at"),
+            ),
+        )
+
+
+def get_retry_countdown(retries: int) -> int:
+    """Returns exponential backoff with full jitter for given amount of retries."""
+
+    return get_exponential_backoff_interval(
+        settings.REMINDER_RETRY_BACKOFF,
+        retries,
+        settings.REMINDER_RETRY_BACKOFF_MAX,
+        full_jitter=True,
+    )
+
+
+def claim_reminders(habits, date, claim_id: uuid.UUID) -> list[Habit]:
+    """
+    Inserts notifications for given habits and date, skipping existing ones.
+    Returns only habits whose notifications were inserted by this call.
+    """
+
+    habits = list(habits)
+    if not habits:
+        return []
+
+    HabitNotification.objects.bulk_create(
+        [
+            HabitNotification(habit=habit, date=date, claim_id=claim_id)
+            for habit in habits
+        ],
+        ignore_conflicts=True,
+    )
+    claimed_ids = set(
+        HabitNotification.objects.filter(
+            habit__in=habits, date=date, claim_id=claim_id
+        ).values_list("habit_id", flat=True)
+    )
+
+    return [habit for habit in habits if habit.id in claimed_ids]
@@ -1,24 +1,118 @@
-from datetime import timedelta
+import asyncio
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import shutil
+import tempfile
+import time as time_module
+import tracemalloc
+import uuid
+from decimal import Decimal
+from io import StringIO
+from datetime import UTC, datetime, time, timedelta
 from unittest.mock import Mock, patch
 
+import httpx
+import redis
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import TestCase, override_settings
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import Max
+from django.test import (
+    LiveServerTestCase,
+    SimpleTestCase,
+    TestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from prometheus_client import REGISTRY
+from prometheus_client.mmap_dict import MmapedDict, mmap_key
 from requests import HTTPError
 from rest_framework import status
+from rest_framework.exceptions import ErrorDetail
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APITestCase
+from rest_framework.views import APIView
+from rest_framework_simplejwt.tokens import RefreshToken
+
+import habits.views
+import users.views
+from config import celery_app
+from config.logs import JsonFormatter, QueueHandler, RotatingFileHandler, SamplingFilter
+from config.metrics import get_registry
+from config.query_budgets import QUERY_BUDGETS, QueryBudgetMixin
+from config.renderers import ORJSONRenderer
+from habits.cache import (
+    bump_public_feed_version,
+    get_habits_version,
+    get_public_feed_version,
+)
+from habits.fake_telegram import BLOCKED_CHAT_ID, FakeTelegramServer
+from habits.locks import get_redis, single_flight
+from habits.management.commands import load_test_api
+from habits.ratelimit import RateLimiter, get_rate_limiter
+from habits.services import (
+    CircuitBreaker,
+    MissingBotTokenError,
+    SendResult,
+    TelegramClient,
+    get_circuit_breaker,
+    get_telegram_client,
+    run_async,
+    send_telegram_message,
+    send_telegram_messages,
+)
+from habits.tasks import (
+    MESSAGE_MAX_LENGTH,
+    check_habits,
+    dispatch_outbox,
+    get_due_habits,
+    get_reminder_text,
+    get_text_length,
+    queue_reminders,
+)
+
+from .models import DeadLetter, Habit, HabitNotification, NotificationOutbox
+from .serializers import HabitSerializer, ValuesSerializer
 
-from habits.services import send_telegram_message
-from habits.tasks import check_habits
+User = get_user_model()
 
-from .models import Habit, HabitNotification
 
-User = get_user_model()
+def get_metric(name: str, **labels) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def create_habit(owner, **overrides) -> Habit:
+    data = {
+        "owner": owner,
+        "place": "home",
+        # due by any time of the day
+        "time": time(0),
+        "action": "take a bubble bath",
+        "frequency": 1,
+        "execution_time": 10,
+    }
+    data.update(overrides)
+    return Habit.objects.create(**data)
+
+
+def reset_rate_limits() -> None:
+    rate_limiter = get_rate_limiter()
+    if rate_limiter is not None:
+        rate_limiter.reset()
 
 
 class HabitAPITest(APITestCase):
     def setUp(self) -> None:
+        bump_public_feed_version()
         self.owner = User.objects.create_user(email="test@test.com", password="test")
         self.other_user = User.objects.create_user(
             email="other@other.com", password="other"
@@ -83,6 +177,75 @@ class HabitAPITest(APITestCase):
             response.data.get("count"), Habit.objects.filter(is_public=True).count()
         )
 
+    def get_pages(self, url: str, params: dict) -> list[list[int]]:
+        pages = []
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            pages.append([habit["id"] for habit in response.data["results"]])
+            url, params = response.data["next"], None
+        return pages
+
+    def test_list_public_cursor_pagination(self) -> None:
+        self.authenticate(self.owner)
+        for hour in (6, 20, 7):
+            Habit.objects.create(
+                **self.habit_data(owner=self.owner, time=f"{hour}:00", is_public=True)
+            )
+
+        pages = self.get_pages(
+            reverse("habits:habit-list-public"),
+            {"pagination": "cursor", "page_size": 2},
+        )
+
+        self.assertEqual([len(page) for page in pages], [2, 2, 2])
+        self.assertEqual(
+            sum(pages, []),
+            list(
+                Habit.objects.filter(is_public=True)
+                .order_by("time", "id")
+                .values_list("id", flat=True)
+            ),
+        )
+
+    def test_cursor_pages_do_not_shift_on_insert(self) -> None:
+        self.authenticate(self.owner)
+        url = reverse("habits:habit-list-public")
+
+        first = self.client.get(url, {"pagination": "cursor", "page_size": 2})
+        Habit.objects.create(
+            **self.habit_data(owner=self.owner, time="06:00", is_public=True)
+        )
+        second = self.client.get(first.data["next"])
+
+        self.assertNotIn("count", first.data)
+        self.assertEqual(len(second.data["results"]), 1)
+        self.assertNotIn(
+            second.data["results"][0]["id"],
+            [habit["id"] for habit in first.data["results"]],
+        )
+
+    def test_cursor_previous_link_returns_previous_page(self) -> None:
+        self.authenticate(self.owner)
+        url = reverse("habits:habit-list-public")
+
+        first = self.client.get(url, {"pagination": "cursor", "page_size": 2})
+        second = self.client.get(first.data["next"])
+        previous = self.client.get(second.data["previous"])
+
+        self.assertIsNone(first.data["previous"])
+        self.assertEqual(previous.data["results"], first.data["results"])
+        self.assertIsNone(previous.data["previous"])
+        self.assertEqual(previous.data["next"], first.data["next"])
+
+    def test_list_public_invalid_cursor_failure(self) -> None:
+        self.authenticate(self.owner)
+
+        response = self.client.get(
+            reverse("habits:habit-list-public"), {"cursor": "not-a-cursor"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
     # list
 
     def test_list_unauthenticated(self) -> None:
@@ -99,6 +262,23 @@ class HabitAPITest(APITestCase):
             response.data.get("count"), Habit.objects.filter(owner=self.owner).count()
         )
 
+    @override_settings(HABIT_PAGINATION="cursor")
+    def test_list_cursor_pagination_by_setting(self) -> None:
+        self.authenticate(self.owner)
+
+        pages = self.get_pages(reverse("habits:habit-list"), {"page_size": 4})
+
+        self.assertEqual(
+            sum(pages, []),
+            list(
+                Habit.objects.filter(owner=self.owner)
+                .order_by("time", "id")
+                .values_list("id", flat=True)
+            ),
+        )
+        response = self.client.get(reverse("habits:habit-list"), {"pagination": "page"})
+        self.assertIn("count", response.data)
+
     # create
 
     def test_create_habit_unauthenticated(self) -> None:
@@ -187,8 +367,13 @@ class HabitAPITest(APITestCase):
             reverse("habits:habit-list"), self.habit_data(is_pleasant=True)
         )
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertNotIn("next_reminder_at", response.data)
         habit = Habit.objects.get(id=response.data.get("id"))
         self.assertEqual(habit.owner, self.owner)
+        self.assertEqual(
+            habit.next_reminder_at,
+            datetime.combine(timezone.now().date(), time(20, 0), tzinfo=UTC),
+        )
 
     def test_create_habit_with_related_pleasant_success(self) -> None:
         self.authenticate(self.owner)
@@ -268,6 +453,25 @@ class HabitAPITest(APITestCase):
         self.pleasant.refresh_from_db()
         self.assertEqual(self.pleasant.action, "UPD")
 
+    def test_update_habit_time_reschedules_reminder(self) -> None:
+        self.authenticate(self.owner)
+        HabitNotification.objects.create(
+            habit=self.pleasant, date=timezone.now().date() - timedelta(days=1)
+        )
+
+        reponse = self.client.patch(
+            reverse("habits:habit-detail", args=[self.pleasant.id]),
+            {"time": "07:30", "frequency": 3},
+        )
+        self.assertEqual(reponse.status_code, status.HTTP_200_OK)
+        self.pleasant.refresh_from_db()
+        self.assertEqual(
+            self.pleasant.next_reminder_at,
+            datetime.combine(
+                timezone.now().date() + timedelta(days=2), time(7, 30), tzinfo=UTC
+            ),
+        )
+
     def test_update_habit_foreign_failure(self) -> None:
         self.authenticate(self.other_user)
 
@@ -313,78 +517,1954 @@ class HabitAPITest(APITestCase):
         self.assertTrue(Habit.objects.filter(id=self.pleasant.id).exists())
 
 
+class HabitQueryBudgetTest(QueryBudgetMixin, APITestCase):
+    def setUp(self) -> None:
+        bump_public_feed_version()
+        self.owner = User.objects.create_user(email="test@test.com", password="test")
+        self.pleasant = create_habit(self.owner, is_pleasant=True, is_public=True)
+        self.habit = create_habit(self.owner, related_habit=self.pleasant)
+        # a real token, so authentication queries count too
+        token = RefreshToken.for_user(self.owner).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+
+    def add_habits(self) -> None:
+        # invalidates cached public feed, so the budget covers a cache miss
+        with self.captureOnCommitCallbacks(execute=True):
+            for _ in range(10):
+                create_habit(self.owner, related_habit=self.pleasant, is_public=True)
+
+    def test_public_list_budget(self) -> None:
+        self.assertQueriesDoNotGrow(
+            "habits.views.PublicHabitListAPIView.get",
+            lambda: self.client.get(reverse("habits:habit-list-public")),
+            self.add_habits,
+        )
+
+    def test_list_budget(self) -> None:
+        self.assertQueriesDoNotGrow(
+            "habits.views.HabitListCreateAPIView.get",
+            lambda: self.client.get(reverse("habits:habit-list"), {"page_size": 10}),
+            self.add_habits,
+        )
+
+    def test_public_list_cursor_budget(self) -> None:
+        self.add_habits()
+        url = reverse("habits:habit-list-public")
+        next_page = self.client.get(url, {"pagination": "cursor"}).data["next"]
+
+        self.assertQueriesDoNotGrow(
+            "habits.views.PublicHabitListAPIView.get",
+            lambda: self.client.get(next_page),
+            self.add_habits,
+        )
+
+    def test_create_budget(self) -> None:
+        with self.assertQueryBudget("habits.views.HabitListCreateAPIView.post"):
+            response = self.client.post(
+                reverse("habits:habit-list"),
+                {
+                    "place": "park",
+                    "time": "08:00",
+                    "action": "walk",
+                    "frequency": 1,
+                    "execution_time": 60,
+                    "related_habit": self.pleasant.id,
+                },
+            )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_retrieve_budget(self) -> None:
+        with self.assertQueryBudget(
+            "habits.views.HabitRetrieveUpdateDestroyAPIView.get"
+        ):
+            response = self.client.get(
+                reverse("habits:habit-detail", args=[self.habit.id])
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_update_budget(self) -> None:
+        with self.assertQueryBudget(
+            "habits.views.HabitRetrieveUpdateDestroyAPIView.put"
+        ):
+            response = self.client.put(
+                reverse("habits:habit-detail", args=[self.habit.id]),
+                {
+                    "place": "park",
+                    "time": "08:00",
+                    "action": "walk",
+                    "frequency": 2,
+                    "execution_time": 60,
+                    "related_habit": self.pleasant.id,
+                },
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_partial_update_budget(self) -> None:
+        with self.assertQueryBudget(
+            "habits.views.HabitRetrieveUpdateDestroyAPIView.patch"
+        ):
+            response = self.client.patch(
+                reverse("habits:habit-detail", args=[self.habit.id]), {"time": "09:00"}
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_destroy_budget(self) -> None:
+        with self.assertQueryBudget(
+            "habits.views.HabitRetrieveUpdateDestroyAPIView.delete"
+        ):
+            response = self.client.delete(
+                reverse("habits:habit-detail", args=[self.pleasant.id])
+            )
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+    def test_batch_budget(self) -> None:
+        def post_batch(count: int) -> list[int]:
+            habits = [
+                create_habit(self.owner, is_public=True) for _ in range(count * 2)
+            ]
+            operations = [
+                {"op": "update", "id": habit.id, "data": {"time": "09:00"}}
+                for habit in habits[:count]
+            ]
+            operations += [{"op": "delete", "id": habit.id} for habit in habits[count:]]
+            operations += [
+                {
+                    "op": "create",
+                    "data": {
+                        "place": "park",
+                        "time": "08:00",
+                        "action": "walk",
+                        "execution_time": 60,
+                        "related_habit": self.pleasant.id,
+                    },
+                }
+            ] * count
+
+            with self.assertQueryBudget(
+                "habits.views.HabitBatchAPIView.post"
+            ) as queries:
+                response = self.client.post(
+                    reverse("habits:habit-batch"),
+                    {"operations": operations},
+                    format="json",
+                )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return len(queries)
+
+        self.assertEqual(post_batch(10), post_batch(1))
+
+
+class HabitBatchTest(APITestCase):
+    def setUp(self) -> None:
+        self.owner = User.objects.create_user(email="test@test.com", password="test")
+        self.other_user = User.objects.create_user(
+            email="other@other.com", password="other"
+        )
+        self.pleasant = create_habit(self.owner, is_pleasant=True)
+        self.habit = create_habit(self.owner)
+        self.client.force_authenticate(self.owner)
+
+    def post_batch(self, *operations):
+        return self.client.post(
+            reverse("habits:habit-batch"), {"operations": operations}, format="json"
+        )
+
+    def test_applies_all_operations(self) -> None:
+        deleted_habit = create_habit(self.owner)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.post_batch(
+                {
+                    "op": "create",
+                    "data": {
+                        "place": "park",
+                        "time": "08:00",
+                        "action": "walk",
+                        "execution_time": 60,
+                        "related_habit": self.pleasant.id,
+                    },
+                },
+                {"op": "update", "id": self.habit.id, "data": {"time": "09:00"}},
+                {"op": "delete", "id": deleted_habit.id},
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        created, updated, deleted = response.data["results"]
+        self.assertEqual(created["op"], "create")
+        self.assertEqual(created["habit"]["action"], "walk")
+        self.assertEqual(updated["habit"]["time"], "09:00:00")
+        self.assertEqual(
+            deleted, {"op": "delete", "id": deleted_habit.id, "habit": None}
+        )
+
+        habit = Habit.objects.get(id=created["id"])
+        self.assertEqual(habit.owner, self.owner)
+        self.assertIsNotNone(habit.next_reminder_at)
+        self.habit.refresh_from_db()
+        self.assertEqual(self.habit.time, time(9))
+        self.assertEqual(self.habit.next_reminder_at.time(), time(9))
+        self.assertFalse(Habit.objects.filter(id=deleted_habit.id).exists())
+
+    def test_invalid_operation_applies_nothing(self) -> None:
+        response = self.post_batch(
+            {"op": "update", "id": self.habit.id, "data": {"place": "park"}},
+            {"op": "create", "data": {"place": "park", "frequency": 9}},
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        errors = response.data["operations"]
+        self.assertEqual(list(errors), [1])
+        self.assertIn("frequency", errors[1]["data"])
+        self.assertIn("execution_time", errors[1]["data"])
+        self.habit.refresh_from_db()
+        self.assertEqual(self.habit.place, "home")
+
+    def test_operation_without_id_failure(self) -> None:
+        response = self.post_batch(
+            {"op": "update", "data": {"place": "park"}}, {"op": "delete"}
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("id", response.data["operations"][0])
+        self.assertIn("id", response.data["operations"][1])
+
+    def test_foreign_habit_not_found(self) -> None:
+        habit = create_habit(self.other_user)
+
+        response = self.post_batch({"op": "delete", "id": habit.id})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data["operations"][0]["id"], ["Habit not found."])
+        self.assertTrue(Habit.objects.filter(id=habit.id).exists())
+
+    def test_habit_changed_twice_failure(self) -> None:
+        response = self.post_batch(
+            {"op": "update", "id": self.habit.id, "data": {"place": "park"}},
+            {"op": "delete", "id": self.habit.id},
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("id", response.data["operations"][1])
+
+    def test_related_habit_validation(self) -> None:
+        response = self.post_batch(
+            {
+                "op": "update",
+                "id": self.habit.id,
+                "data": {"related_habit": self.pleasant.id},
+            },
+            {"op": "delete", "id": self.pleasant.id},
+            {
+                "op": "create",
+                "data": {
+                    "place": "park",
+                    "time": "08:00",
+                    "action": "walk",
+                    "execution_time": 60,
+                    "related_habit": self.habit.id,
+                },
+            },
+            {
+                "op": "create",
+                "data": {
+                    "place": "park",
+                    "time": "08:00",
+                    "action": "walk",
+                    "execution_time": 60,
+                    "related_habit": 0,
+                },
+            },
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        errors = response.data["operations"]
+        self.assertEqual(list(errors), [0, 2, 3])
+        self.assertIn("related_habit", errors[0]["data"])
+        self.assertIn("non_field_errors", errors[2]["data"])
+        self.assertIn("related_habit", errors[3]["data"])
+
+    def test_related_habit_made_unpleasant_by_batch_failure(self) -> None:
+        habit_data = {
+            "place": "park",
+            "time": "08:00",
+            "action": "walk",
+            "execution_time": 60,
+            "related_habit": self.pleasant.id,
+        }
+
+        response = self.post_batch(
+            {"op": "update", "id": self.pleasant.id, "data": {"is_pleasant": False}},
+            {"op": "create", "data": habit_data},
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(list(response.data["operations"]), [1])
+        self.pleasant.refresh_from_db()
+        self.assertTrue(self.pleasant.is_pleasant)
+
+        response = self.post_batch(
+            {"op": "update", "id": self.habit.id, "data": {"is_pleasant": True}},
+            {"op": "create", "data": {**habit_data, "related_habit": self.habit.id}},
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_update_writes_only_changed_fields(self) -> None:
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post_batch(
+                {"op": "update", "id": self.habit.id, "data": {"place": "park"}},
+                {"op": "update", "id": self.pleasant.id, "data": {"time": "09:00"}},
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        updates = [
+            query["sql"]
+            for query in queries.captured_queries
+            if query["sql"].startswith('UPDATE "habits_habit"')
+        ]
+        self.assertEqual(len(updates), 2)
+        # next_reminder_at of the other habit may be advanced by the scheduler
+        self.assertEqual(
+            sorted(
+                ('"place"' in update, '"time"' in update, "next_reminder_at" in update)
+                for update in updates
+            ),
+            [(False, True, True), (True, False, False)],
+        )
+        self.pleasant.refresh_from_db()
+        self.assertEqual(self.pleasant.next_reminder_at.time(), time(9))
+
+    def test_update_without_changes(self) -> None:
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post_batch(
+                {"op": "update", "id": self.habit.id, "data": {}},
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["results"][0]["habit"]["place"], "home")
+        self.assertFalse(
+            any(
+                query["sql"].startswith('UPDATE "habits_habit"')
+                for query in queries.captured_queries
+            )
+        )
+
+    def test_batch_unauthenticated(self) -> None:
+        self.client.force_authenticate(None)
+
+        response = self.post_batch({"op": "delete", "id": self.habit.id})
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_batch_invalidates_etags(self) -> None:
+        url = reverse("habits:habit-list")
+        etag = self.client.get(url)["ETag"]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post_batch({"op": "delete", "id": self.habit.id})
+
+        response = self.client.get(url, headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class PublicFeedCacheTest(APITestCase):
+    def setUp(self) -> None:
+        bump_public_feed_version()
+        self.owner = User.objects.create_user(email="test@test.com", password="test")
+        self.habit = create_habit(self.owner, is_public=True)
+        self.client.force_authenticate(self.owner)
+
+    def get_feed(self, **headers):
+        return self.client.get(reverse("habits:habit-list-public"), headers=headers)
+
+    def test_serves_cached_page_without_queries(self) -> None:
+        response = self.get_feed()
+
+        with self.assertNumQueries(0):
+            cached = self.get_feed()
+        self.assertEqual(cached.status_code, status.HTTP_200_OK)
+        self.assertEqual(cached.content, response.content)
+        self.assertEqual(cached["ETag"], response["ETag"])
+        self.assertEqual(cached["Cache-Control"], "private, no-cache")
+
+    def test_caches_pages_separately(self) -> None:
+        create_habit(self.owner, is_public=True)
+
+        self.get_feed()
+        response = self.client.get(
+            reverse("habits:habit-list-public"), {"page_size": 1}
+        )
+
+        self.assertEqual(len(response.data["results"]), 1)
+
+    def test_returns_not_modified_for_current_etag(self) -> None:
+        etag = self.get_feed()["ETag"]
+
+        with self.assertNumQueries(0):
+            response = self.get_feed(if_none_match=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response["ETag"], etag)
+
+    def test_public_habit_change_invalidates_cache(self) -> None:
+        response = self.get_feed()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            create_habit(self.owner, is_public=True)
+
+        changed = self.get_feed(if_none_match=response["ETag"])
+        self.assertEqual(changed.status_code, status.HTTP_200_OK)
+        self.assertEqual(changed.data["count"], 2)
+        self.assertNotEqual(changed["ETag"], response["ETag"])
+
+    def test_habit_made_private_invalidates_cache(self) -> None:
+        self.get_feed()
+
+        habit = Habit.objects.get(id=self.habit.id)
+        habit.is_public = False
+        with self.captureOnCommitCallbacks(execute=True):
+            habit.save()
+
+        self.assertEqual(self.get_feed().data["count"], 0)
+
+    def test_public_habit_deletion_invalidates_cache(self) -> None:
+        self.get_feed()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.habit.delete()
+
+        self.assertEqual(self.get_feed().data["count"], 0)
+
+    def test_related_habit_deletion_invalidates_cache(self) -> None:
+        pleasant = create_habit(self.owner, is_pleasant=True)
+        Habit.objects.filter(id=self.habit.id).update(related_habit=pleasant)
+        self.get_feed()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            pleasant.delete()
+
+        self.assertIsNone(self.get_feed().data["results"][0]["related_habit"])
+
+    def test_related_habit_deletion_by_owner_deletion_invalidates_cache(
+        self,
+    ) -> None:
+        other_owner = User.objects.create_user(email="other@test.com", password="test")
+        pleasant = create_habit(other_owner, is_pleasant=True)
+        Habit.objects.filter(id=self.habit.id).update(related_habit=pleasant)
+        self.get_feed()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            other_owner.delete()
+
+        self.assertIsNone(self.get_feed().data["results"][0]["related_habit"])
+
+    def test_private_habit_change_keeps_cache(self) -> None:
+        version = get_public_feed_version()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            create_habit(self.owner)
+
+        self.assertEqual(get_public_feed_version(), version)
+
+    @patch("habits.cache.get_redis", side_effect=redis.ConnectionError)
+    def test_serves_feed_if_redis_is_unavailable(self, mock_redis: Mock) -> None:
+        response = self.get_feed()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["count"], 1)
+        self.assertNotIn("ETag", response)
+
+
+class ConditionalHabitsTest(APITestCase):
+    def setUp(self) -> None:
+        self.owner = User.objects.create_user(email="test@test.com", password="test")
+        self.other_user = User.objects.create_user(
+            email="other@other.com", password="other"
+        )
+        self.habit = create_habit(self.owner)
+        self.client.force_authenticate(self.owner)
+
+    def test_list_returns_not_modified_without_queries(self) -> None:
+        url = reverse("habits:habit-list")
+        etag = self.client.get(url)["ETag"]
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url, headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response["Cache-Control"], "private, no-cache")
+
+    def test_detail_returns_not_modified_checking_only_owner(self) -> None:
+        url = reverse("habits:habit-detail", args=[self.habit.id])
+        etag = self.client.get(url)["ETag"]
+
+        with self.assertNumQueries(1):
+            response = self.client.get(url, headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_detail_of_other_user_ignores_etag(self) -> None:
+        url = reverse("habits:habit-detail", args=[self.habit.id])
+        url_hash = hashlib.sha1(f"http://testserver{url}".encode()).hexdigest()
+        # the etag the other user would get for the url
+        etag = f'W/"{get_habits_version(self.other_user.id)}-{url_hash}"'
+
+        self.client.force_authenticate(self.other_user)
+        response = self.client.get(url, headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_pages_have_different_etags(self) -> None:
+        url = reverse("habits:habit-list")
+
+        self.assertNotEqual(
+            self.client.get(url)["ETag"],
+            self.client.get(url, {"page_size": 1})["ETag"],
+        )
+
+    def test_create_invalidates_etag(self) -> None:
+        url = reverse("habits:habit-list")
+        etag = self.client.get(url)["ETag"]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                url,
+                {
+                    "place": "park",
+                    "time": "08:00",
+                    "action": "walk",
+                    "frequency": 1,
+                    "execution_time": 60,
+                },
+            )
+
+        response = self.client.get(url, headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["count"], 2)
+
+    def test_update_invalidates_etag(self) -> None:
+        url = reverse("habits:habit-detail", args=[self.habit.id])
+        etag = self.client.get(url)["ETag"]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(url, {"place": "park"})
+
+        response = self.client.get(url, headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["place"], "park")
+
+    def test_delete_invalidates_etag(self) -> None:
+        url = reverse("habits:habit-list")
+        etag = self.client.get(url)["ETag"]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(reverse("habits:habit-detail", args=[self.habit.id]))
+
+        response = self.client.get(url, headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["count"], 0)
+
+    def test_related_habit_deletion_invalidates_etag(self) -> None:
+        pleasant = create_habit(self.other_user, is_pleasant=True)
+        Habit.objects.filter(id=self.habit.id).update(related_habit=pleasant)
+        url = reverse("habits:habit-detail", args=[self.habit.id])
+        etag = self.client.get(url)["ETag"]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other_user.delete()
+
+        response = self.client.get(url, headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNone(response.data["related_habit"])
+
+    def test_other_user_change_keeps_etag(self) -> None:
+        url = reverse("habits:habit-list")
+        etag = self.client.get(url)["ETag"]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            create_habit(self.other_user)
+
+        response = self.client.get(url, headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_foreign_habit_has_no_etag(self) -> None:
+        habit = create_habit(self.other_user)
+
+        response = self.client.get(reverse("habits:habit-detail", args=[habit.id]))
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertNotIn("ETag", response)
+
+
+class QueryBudgetsTest(SimpleTestCase):
+    def test_every_view_and_task_has_budget(self) -> None:
+        names = set()
+        for module in (habits.views, users.views):
+            for view in vars(module).values():
+                if (
+                    isinstance(view, type)
+                    and issubclass(view, APIView)
+                    and view.__module__ == module.__name__
+                ):
+                    names.update(
+                        f"{module.__name__}.{view.__name__}.{method}"
+                        for method in view.http_method_names
+                        if method not in ("head", "options") and hasattr(view, method)
+                    )
+        names.update(name for name in celery_app.tasks if name.startswith("habits."))
+
+        self.assertEqual(names, set(QUERY_BUDGETS))
+
+
+class MetricsTest(APITestCase):
+    def test_records_requests_by_route(self) -> None:
+        labels = {"route": "habits:habit-list", "method": "GET"}
+        requests_count = get_metric(
+            "http_request_duration_seconds_count", status="401", **labels
+        )
+        queries_count = get_metric("http_request_db_queries_count", **labels)
+
+        self.client.get(reverse("habits:habit-list"))
+
+        self.assertEqual(
+            get_metric("http_request_duration_seconds_count", status="401", **labels),
+            requests_count + 1,
+        )
+        self.assertEqual(
+            get_metric("http_request_db_queries_count", **labels), queries_count + 1
+        )
+
+    def test_unmatched_paths_share_route(self) -> None:
+        labels = {"route": "unmatched", "method": "GET", "status": "404"}
+        count = get_metric("http_request_duration_seconds_count", **labels)
+
+        self.client.get("/no/such/path/")
+        self.client.get("/other/path/")
+
+        self.assertEqual(
+            get_metric("http_request_duration_seconds_count", **labels), count + 2
+        )
+
+    def test_aggregates_metrics_of_all_directories(self) -> None:
+        paths = []
+        for _ in range(2):
+            path = tempfile.mkdtemp()
+            self.addCleanup(shutil.rmtree, path)
+            # processes of different containers with the same pid
+            values = MmapedDict(os.path.join(path, "counter_1.db"))
+            key = mmap_key("test_sends", "test_sends_total", [], [], "Test sends")
+            values.write_value(key, 1, 0)
+            values.close()
+            paths.append(path)
+
+        with (
+            patch.dict(os.environ, {"PROMETHEUS_MULTIPROC_DIR": paths[0]}),
+            override_settings(METRICS_DIRS=paths),
+        ):
+            registry = get_registry()
+
+        self.assertEqual(registry.get_sample_value("test_sends_total"), 2)
+
+    def test_exposes_metrics(self) -> None:
+        response = self.client.get(reverse("metrics"))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(b"http_request_duration_seconds", response.content)
+        self.assertIn(b"reminder_tick_duration_seconds", response.content)
+        self.assertIn(b"telegram_sends_total", response.content)
+
+
 class SendTelegramMessageTest(TestCase):
+    def setUp(self) -> None:
+        reset_rate_limits()
+        self.addCleanup(reset_rate_limits)
+        get_circuit_breaker.cache_clear()
+        self.addCleanup(get_circuit_breaker.cache_clear)
+
     @override_settings(TELEGRAM_BOT_TOKEN="dummy_token")
-    @patch("habits.services.requests.post")
+    @patch("habits.services.httpx.AsyncClient.post")
     def test_send_message_successfully(self, mock_post: Mock) -> None:
-        mock_response = Mock()
-        mock_response.raise_for_status.return_value = None
-        mock_post.return_value = mock_response
+        mock_post.return_value = httpx.Response(200)
 
         send_telegram_message(123456, "test message")
 
-        mock_post.assert_called_once_with(
+        mock_post.assert_awaited_once_with(
             "https://api.telegram.org/botdummy_token/sendMessage",
-            {"chat_id": 123456, "text": "test message"},
+            data={"chat_id": 123456, "text": "test message"},
+        )
+
+    @override_settings(TELEGRAM_BOT_TOKENS=["first", "second"])
+    @patch("habits.services.httpx.AsyncClient.post")
+    def test_sends_from_bot_of_given_shard(self, mock_post: Mock) -> None:
+        mock_post.return_value = httpx.Response(200)
+
+        send_telegram_message(123456, "test message", bot_shard=1)
+
+        self.assertEqual(
+            mock_post.call_args.args[0],
+            "https://api.telegram.org/botsecond/sendMessage",
         )
-        mock_response.raise_for_status.assert_called_once()
 
     @override_settings(TELEGRAM_BOT_TOKEN=None)
-    @patch("habits.services.requests.post")
-    def test_does_nothing_with_missing_token(self, mock_post: Mock) -> None:
-        send_telegram_message(123456, "test message")
+    @patch("habits.services.httpx.AsyncClient.post")
+    def test_raises_with_missing_token(self, mock_post: Mock) -> None:
+        with self.assertRaises(MissingBotTokenError):
+            send_telegram_message(123456, "test message")
 
         mock_post.assert_not_called()
 
     @override_settings(TELEGRAM_BOT_TOKEN="dummy_token")
-    @patch("habits.services.requests.post")
+    @patch("habits.services.httpx.AsyncClient.post")
     def test_raises_on_bad_status(self, mock_post: Mock) -> None:
-        mock_response = Mock()
-        mock_response.raise_for_status.side_effect = HTTPError("Bad Request")
-        mock_post.return_value = mock_response
+        mock_post.return_value = httpx.Response(
+            400, json={"description": "Bad Request: message is too long"}
+        )
 
         with self.assertRaises(HTTPError):
             send_telegram_message(123456, "test message")
 
 
-class CheckHabitsTest(TestCase):
-    def setUp(self):
-        self.user = User.objects.create(email="test@test.com", telegram_chat_id=123456)
-        self.habit = Habit.objects.create(
-            owner=self.user,
-            action="Drink water",
-            place="Kitchen",
-            time=(timezone.now() - timedelta(minutes=1)).time(),  # time before now
-            frequency=1,
-            execution_time=30,
+@patch("habits.services.asyncio.sleep")
+class TelegramClientTest(SimpleTestCase):
+    def setUp(self) -> None:
+        self.client = TelegramClient(
+            "dummy_token",
+            max_retries=2,
+            circuit_breaker=CircuitBreaker(failure_threshold=2, recovery_time=30),
+        )
+        self.client.client = httpx.AsyncClient(
+            transport=httpx.MockTransport(self.handle)
         )
+        self.responses = []
+        self.requests = []
 
-    @patch("habits.tasks.send_telegram_message")
-    def test_sends_reminder_and_creates_notification(self, mock_send: Mock) -> None:
-        check_habits()
-        mock_send.assert_called_once()
-        self.assertEqual(HabitNotification.objects.count(), 1)
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        # the last response is repeated
+        response = self.responses[0]
+        if len(self.responses) > 1:
+            self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
 
-    @patch("habits.tasks.send_telegram_message")
-    def test_skips_if_recent_notification_exists(self, mock_send: Mock) -> None:
-        HabitNotification.objects.create(habit=self.habit, date=timezone.now().date())
-        check_habits()
+    def send(self, deadline: float | None = None) -> SendResult:
+        return run_async(self.client.send_message(123456, "test message", deadline))
 
-        mock_send.assert_not_called()
-        self.assertEqual(HabitNotification.objects.count(), 1)
+    def test_sends_message(self, mock_sleep: Mock) -> None:
+        self.responses = [httpx.Response(200, json={"ok": True})]
 
-    @patch("habits.tasks.send_telegram_message")
-    def test_skips_if_user_has_no_telegram_chat_id(self, mock_send: Mock) -> None:
-        self.user.telegram_chat_id = None
-        self.user.save()
-        check_habits()
+        result = self.send()
 
-        mock_send.assert_not_called()
-        self.assertEqual(HabitNotification.objects.count(), 0)
+        self.assertEqual(result, SendResult(123456, ok=True, status_code=200))
+        (request,) = self.requests
+        self.assertEqual(
+            str(request.url), "https://api.telegram.org/botdummy_token/sendMessage"
+        )
+        self.assertEqual(request.content, b"chat_id=123456&text=test+message")
+
+    def test_retries_throttled_request_after_retry_after(
+        self, mock_sleep: Mock
+    ) -> None:
+        self.responses = [
+            httpx.Response(429, json={"parameters": {"retry_after": 7}}),
+            httpx.Response(200),
+        ]
+
+        self.assertTrue(self.send().ok)
+
+        self.assertEqual(len(self.requests), 2)
+        mock_sleep.assert_awaited_once_with(7)
+
+    def test_records_send_metrics(self, mock_sleep: Mock) -> None:
+        self.responses = [
+            httpx.Response(429, json={"parameters": {"retry_after": 1}}),
+            httpx.ConnectError("Connection refused"),
+            httpx.Response(200),
+        ]
+        sends = {
+            result: get_metric("telegram_sends_total", result=result)
+            for result in ("sent", "throttled", "failed")
+        }
 
-    @patch("habits.tasks.send_telegram_message", side_effect=HTTPError("Bad request"))
-    def test_does_not_create_notification_of_exception(self, mock_send: Mock) -> None:
-        check_habits()
+        self.send()
 
-        mock_send.assert_called_once()
+        for result in ("sent", "throttled", "failed"):
+            self.assertEqual(
+                get_metric("telegram_sends_total", result=result), sends[result] + 1
+            )
+
+    def test_retries_server_errors_with_exponential_backoff(
+        self, mock_sleep: Mock
+    ) -> None:
+        self.responses = [
+            httpx.Response(502),
+            httpx.ConnectError("reset"),
+            httpx.Response(200),
+        ]
+
+        self.assertTrue(self.send().ok)
+
+        self.assertEqual(
+            [call.args[0] for call in mock_sleep.await_args_list], [0.5, 1.0]
+        )
+
+    def test_does_not_retry_client_errors(self, mock_sleep: Mock) -> None:
+        self.responses = [
+            httpx.Response(403, json={"description": "Forbidden: bot was kicked"})
+        ]
+
+        result = self.send()
+
+        self.assertTrue(result.is_permanent_error)
+        self.assertEqual(len(self.requests), 1)
+        mock_sleep.assert_not_awaited()
+
+    def test_returns_last_failure_after_retries(self, mock_sleep: Mock) -> None:
+        self.responses = [httpx.Response(503)]
+
+        result = self.send()
+
+        self.assertEqual(result.status_code, 503)
+        self.assertEqual(len(self.requests), 3)
+
+    def test_does_not_retry_past_deadline(self, mock_sleep: Mock) -> None:
+        self.responses = [httpx.Response(429, json={"parameters": {"retry_after": 7}})]
+
+        result = self.send(deadline=0)
+
+        self.assertEqual(result.retry_after, 7)
+        self.assertEqual(len(self.requests), 1)
+        mock_sleep.assert_not_awaited()
+
+    @patch("habits.services.time.monotonic", return_value=100)
+    def test_circuit_opens_after_failures_and_recovers(
+        self, mock_monotonic: Mock, mock_sleep: Mock
+    ) -> None:
+        self.responses = [httpx.Response(503)]
+        for _ in range(2):
+            self.assertEqual(self.send().status_code, 503)
+
+        self.requests.clear()
+        result = self.send()
+        self.assertEqual(result.error, "Telegram api is unavailable, request skipped")
+        self.assertEqual(self.requests, [])
+
+        mock_monotonic.return_value = 131
+        self.responses = [httpx.Response(200)]
+        self.assertTrue(self.send().ok)
+        self.assertTrue(self.send().ok)
+        self.assertEqual(len(self.requests), 2)
+
+
+# results of single requests
+@override_settings(TELEGRAM_BOT_TOKEN="dummy_token", TELEGRAM_MAX_RETRIES=0)
+class SendTelegramMessagesTest(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        cls.server = FakeTelegramServer(latency=0.05)
+        cls.server.start()
+        cls.addClassCleanup(cls.server.stop)
+        cls.enterClassContext(override_settings(TELEGRAM_API_URL=cls.server.url))
+
+    def setUp(self) -> None:
+        self.server.reset_stats()
+        reset_rate_limits()
+        self.addCleanup(reset_rate_limits)
+        get_circuit_breaker.cache_clear()
+        self.addCleanup(get_circuit_breaker.cache_clear)
+
+    def test_returns_result_per_message_in_order(self) -> None:
+        results = run_async(
+            send_telegram_messages(
+                [(1, "first", 0), (429, "second", 0), (400, "third", 0)]
+            )
+        )
+
+        self.assertEqual(
+            results,
+            [
+                SendResult(1, ok=True, status_code=200),
+                SendResult(
+                    429,
+                    ok=False,
+                    status_code=429,
+                    retry_after=5,
+                    error="Too Many Requests: retry after 5",
+                ),
+                SendResult(
+                    400, ok=False, status_code=400, error="Bad Request: chat not found"
+                ),
+            ],
+        )
+
+    def test_only_chat_refusals_are_permanent_errors(self) -> None:
+        refusals = [
+            (400, "Bad Request: chat not found"),
+            (403, "Forbidden: bot was blocked by the user"),
+            (403, "Forbidden: user is deactivated"),
+        ]
+        errors = [
+            (400, "Bad Request: message is too long"),
+            (403, "Forbidden"),
+            (502, "Bad Gateway"),
+        ]
+
+        for status_code, error in refusals:
+            result = SendResult(1, ok=False, status_code=status_code, error=error)
+            self.assertTrue(result.is_permanent_error, error)
+        for status_code, error in errors:
+            result = SendResult(1, ok=False, status_code=status_code, error=error)
+            self.assertFalse(result.is_permanent_error, error)
+
+    def test_records_send_metrics(self) -> None:
+        sends = {
+            result: get_metric("telegram_sends_total", result=result)
+            for result in ("sent", "throttled", "failed")
+        }
+        duration_count = get_metric("telegram_send_duration_seconds_count")
+
+        run_async(
+            send_telegram_messages([(1, "text", 0), (2, "text", 0), (429, "text", 0)])
+        )
+
+        self.assertEqual(
+            get_metric("telegram_sends_total", result="sent"), sends["sent"] + 2
+        )
+        self.assertEqual(
+            get_metric("telegram_sends_total", result="throttled"),
+            sends["throttled"] + 1,
+        )
+        self.assertEqual(
+            get_metric("telegram_sends_total", result="failed"), sends["failed"]
+        )
+        self.assertEqual(
+            get_metric("telegram_send_duration_seconds_count"), duration_count + 3
+        )
+
+    def test_limits_concurrent_requests(self) -> None:
+        messages = [(chat_id, "text", 0) for chat_id in range(1, 11)]
+        results = run_async(send_telegram_messages(messages, concurrency=3))
+
+        self.assertTrue(all(result.ok for result in results))
+        self.assertGreater(self.server.max_in_flight, 1)
+        self.assertLessEqual(self.server.max_in_flight, 3)
+
+    @override_settings(TELEGRAM_BOT_TOKENS=["first", "second"])
+    def test_sends_each_message_from_its_bot(self) -> None:
+        results = run_async(
+            send_telegram_messages([(1, "text", 1), (2, "text", 0), (3, "text", 2)])
+        )
+
+        self.assertEqual([result.ok for result in results], [True, True, False])
+        self.assertEqual(results[2].error, "Token of bot 2 isn't set")
+        self.assertEqual(
+            sorted(bot for bot, _, _ in self.server.messages), ["botfirst", "botsecond"]
+        )
+
+    @override_settings(TELEGRAM_RATE_LIMIT=30, TELEGRAM_CHAT_RATE_LIMIT=1)
+    def test_spreads_messages_to_same_chat_over_time(self) -> None:
+        get_rate_limiter.cache_clear()
+        self.addCleanup(get_rate_limiter.cache_clear)
+
+        started_at = time_module.monotonic()
+        results = run_async(
+            send_telegram_messages([(1, "first", 0), (1, "second", 0)])
+        )
+
+        self.assertTrue(all(result.ok for result in results))
+        self.assertGreaterEqual(time_module.monotonic() - started_at, 0.9)
+
+    @override_settings(TELEGRAM_RATE_LIMIT=30, TELEGRAM_CHAT_RATE_LIMIT=1)
+    def test_defers_messages_waiting_past_max_wait(self) -> None:
+        get_rate_limiter.cache_clear()
+        self.addCleanup(get_rate_limiter.cache_clear)
+
+        results = run_async(
+            send_telegram_messages([(1, "first", 0), (1, "second", 0)], max_wait=0.5)
+        )
+
+        self.assertTrue(results[0].ok)
+        self.assertTrue(results[1].deferred)
+        self.assertEqual([text for _, _, text in self.server.messages], ["first"])
+
+    def test_returns_error_if_api_is_unreachable(self) -> None:
+        with override_settings(TELEGRAM_API_URL="http://127.0.0.1:1"):
+            results = run_async(send_telegram_messages([(1, "text", 0)]))
+
+        self.assertFalse(results[0].ok)
+        self.assertIsNone(results[0].status_code)
+        self.assertTrue(results[0].error)
+
+    def test_reuses_client_between_runs(self) -> None:
+        async def get_client() -> TelegramClient:
+            return get_telegram_client("dummy_token", self.server.url)
+
+        self.assertIs(run_async(get_client()), run_async(get_client()))
+
+    @override_settings(TELEGRAM_BOT_TOKEN=None)
+    def test_fails_all_messages_with_missing_token(self) -> None:
+        results = run_async(send_telegram_messages([(1, "text", 0), (2, "text", 0)]))
+
+        self.assertEqual(self.server.max_in_flight, 0)
+        self.assertFalse(any(result.ok for result in results))
+
+
+@override_settings(TELEGRAM_BOT_TOKEN="dummy_token")
+class FakeTelegramDeliveryTest(TestCase):
+    def setUp(self) -> None:
+        reset_rate_limits()
+        self.addCleanup(reset_rate_limits)
+
+    def start_server(self, **options) -> FakeTelegramServer:
+        server = FakeTelegramServer(seed=1, **options)
+        server.start()
+        self.addCleanup(server.stop)
+        return server
+
+    def test_client_retries_errors_and_reset_connections(self) -> None:
+        server = self.start_server(error_rate=0.2, reset_rate=0.2)
+        client = TelegramClient(
+            "dummy_token", server.url, max_retries=10, backoff_factor=0
+        )
+
+        for chat_id in range(1, 21):
+            self.assertTrue(run_async(client.send_message(chat_id, "text")).ok)
+
+        self.assertEqual(len(server.messages), 20)
+        self.assertGreater(server.statuses[502], 0)
+        self.assertGreater(server.statuses["reset"], 0)
+
+    def test_client_waits_out_throttling(self) -> None:
+        server = self.start_server(chat_rate_limit=1)
+        client = TelegramClient("dummy_token", server.url)
+
+        run_async(client.send_message(1, "first"))
+        run_async(client.send_message(1, "second"))
+
+        self.assertEqual(server.statuses[429], 1)
+        self.assertEqual([text for _, _, text in server.messages], ["first", "second"])
+
+    @override_settings(
+        TELEGRAM_RATE_LIMIT=30,
+        TELEGRAM_CHAT_RATE_LIMIT=1,
+        # leaves less than a second to send after the timeouts
+        OUTBOX_LEASE_TTL=14,
+    )
+    def test_dispatch_outbox_defers_messages_waiting_past_lease(self) -> None:
+        get_rate_limiter.cache_clear()
+        self.addCleanup(get_rate_limiter.cache_clear)
+        server = self.start_server()
+        NotificationOutbox.objects.bulk_create(
+            NotificationOutbox(
+                chat_id=1, text=text, habit_ids=[], claim_id=uuid.uuid4()
+            )
+            for text in ["first", "second"]
+        )
+
+        with override_settings(TELEGRAM_API_URL=server.url):
+            dispatch_outbox()
+
+        self.assertEqual([text for _, _, text in server.messages], ["first"])
+        # left for a later run without counting an attempt
+        message = NotificationOutbox.objects.get()
+        self.assertEqual((message.text, message.attempts), ("second", 0))
+        self.assertGreater(
+            message.leased_until,
+            timezone.now() + timedelta(seconds=settings.OUTBOX_LEASE_TTL),
+        )
+
+    def test_dispatch_outbox_delivers_through_api(self) -> None:
+        server = self.start_server(latency=0.01, error_rate=0.3)
+        user = User.objects.create(email="blocked@test.com", telegram_chat_id=403)
+        NotificationOutbox.objects.bulk_create(
+            NotificationOutbox(
+                chat_id=chat_id, text="text", habit_ids=[], claim_id=uuid.uuid4()
+            )
+            for chat_id in [BLOCKED_CHAT_ID, *range(1, 51)]
+        )
+
+        # each failed message is counted by a single failed request
+        with override_settings(
+            TELEGRAM_API_URL=server.url,
+            TELEGRAM_MAX_RETRIES=0,
+            TELEGRAM_FAILURE_THRESHOLD=100,
+        ):
+            get_circuit_breaker.cache_clear()
+            self.addCleanup(get_circuit_breaker.cache_clear)
+            dispatch_outbox()
+
+        # failed messages stay in the outbox until their retry
+        failed_count = NotificationOutbox.objects.filter(attempts=1).count()
+        self.assertEqual(NotificationOutbox.objects.count(), failed_count)
+        self.assertEqual(len(server.messages) + failed_count, 50)
+        self.assertEqual(failed_count, server.statuses[502])
+        user.refresh_from_db()
+        self.assertEqual(user.telegram_failures, 1)
+
+
+class RateLimiterTest(SimpleTestCase):
+    def setUp(self) -> None:
+        self.rate_limiter = RateLimiter(
+            get_redis(), rate=10, chat_rate=1, prefix=f"test-ratelimit:{self.id()}"
+        )
+        self.addCleanup(self.rate_limiter.reset)
+
+    def assertWaits(self, waits: list[float], expected: list[float]) -> None:
+        self.assertEqual(len(waits), len(expected))
+        for wait, expected_wait in zip(waits, expected):
+            self.assertAlmostEqual(wait, expected_wait, delta=0.05)
+
+    def test_spreads_burst_over_global_rate(self) -> None:
+        waits = self.rate_limiter.reserve(list(range(1, 14)))
+
+        self.assertWaits(waits, [0] * 10 + [0.1, 0.2, 0.3])
+
+    def test_spreads_messages_to_same_chat_over_chat_rate(self) -> None:
+        waits = self.rate_limiter.reserve([1, 1, 2, 1])
+
+        self.assertWaits(waits, [0, 1, 0, 2])
+
+    def test_refuses_messages_waiting_longer_than_max_wait(self) -> None:
+        waits = self.rate_limiter.reserve([1, 1, 2, 1], max_wait=1.5)
+
+        self.assertIsNone(waits[3])
+        self.assertWaits(waits[:3], [0, 1, 0])
+        # no tokens are taken for refused messages
+        self.assertWaits(self.rate_limiter.reserve([1]), [2])
+
+    def test_buckets_are_shared_between_limiters(self) -> None:
+        self.rate_limiter.reserve([1])
+        other = RateLimiter(get_redis(), 10, 1, prefix=self.rate_limiter.prefix)
+
+        self.assertWaits(other.reserve([1]), [1])
+
+    def test_does_not_limit_if_redis_is_unavailable(self) -> None:
+        rate_limiter = RateLimiter(redis.Redis(port=1), rate=10, chat_rate=1)
+
+        self.assertEqual(rate_limiter.reserve([1, 1]), [0, 0])
+
+
+class SingleFlightTest(SimpleTestCase):
+    def setUp(self) -> None:
+        self.name = f"test-{self.id()}"
+        self.addCleanup(get_redis().delete, f"lease:{self.name}")
+
+    def test_runs_function_and_releases_lease(self) -> None:
+        func = Mock(return_value="result")
+
+        result = single_flight(self.name, ttl=10)(func)("arg")
+
+        self.assertEqual(result, "result")
+        func.assert_called_once_with("arg")
+        self.assertFalse(get_redis().exists(f"lease:{self.name}"))
+
+    def test_skips_while_lease_is_held(self) -> None:
+        func = Mock()
+        get_redis().lock(f"lease:{self.name}", timeout=10).acquire()
+
+        with self.assertLogs("habits.locks", "WARNING"):
+            result = single_flight(self.name, ttl=10)(func)()
+
+        self.assertIsNone(result)
+        func.assert_not_called()
+
+    def test_extends_lease_during_long_run(self) -> None:
+        def long_run() -> bool:
+            time_module.sleep(1.5)
+            return bool(get_redis().exists(f"lease:{self.name}"))
+
+        self.assertTrue(single_flight(self.name, ttl=1)(long_run)())
+
+
+def deliver_all(messages: list[tuple[int, str, int]], **options) -> list[SendResult]:
+    return [SendResult(chat_id, ok=True, status_code=200) for chat_id, *_ in messages]
+
+
+def fail_all(messages: list[tuple[int, str, int]], **options) -> list[SendResult]:
+    return [
+        SendResult(chat_id, ok=False, status_code=502, error="Bad Gateway")
+        for chat_id, *_ in messages
+    ]
+
+
+def refuse_all(messages: list[tuple[int, str, int]], **options) -> list[SendResult]:
+    return [
+        SendResult(
+            chat_id,
+            ok=False,
+            status_code=403,
+            error="Forbidden: bot was blocked by the user",
+        )
+        for chat_id, *_ in messages
+    ]
+
+
+class CheckHabitsTest(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        # run dispatched queue_reminders chunks inline
+        celery_app.conf.update(task_always_eager=True)
+        self.addCleanup(celery_app.conf.update, task_always_eager=False)
+
+        self.user = User.objects.create(email="test@test.com", telegram_chat_id=123456)
+        self.habit = create_habit(self.user)
+
+    def notify(self, habit, days_ago=0) -> None:
+        HabitNotification.objects.create(
+            habit=habit, date=timezone.now().date() - timedelta(days=days_ago)
+        )
+        habit.next_reminder_at = None  # reschedule from the last notification
+        habit.save()
+
+    @patch("habits.tasks.send_telegram_messages", side_effect=deliver_all)
+    def test_sends_reminder_and_creates_notification(self, mock_send: Mock) -> None:
+        check_habits()
+        mock_send.assert_called_once()
+        self.assertEqual(HabitNotification.objects.count(), 1)
+
+    @patch("habits.tasks.send_telegram_messages", side_effect=deliver_all)
+    def test_skips_if_recent_notification_exists(self, mock_send: Mock) -> None:
+        self.notify(self.habit)
+        check_habits()
+
+        mock_send.assert_not_called()
+        self.assertEqual(HabitNotification.objects.count(), 1)
+
+    @patch("habits.tasks.send_telegram_messages", side_effect=deliver_all)
+    def test_skips_if_user_has_no_telegram_chat_id(self, mock_send: Mock) -> None:
+        self.user.telegram_chat_id = None
+        self.user.save()
+        check_habits()
+
+        mock_send.assert_not_called()
         self.assertEqual(HabitNotification.objects.count(), 0)
+
+    @patch("habits.tasks.send_telegram_messages", side_effect=fail_all)
+    def test_keeps_failed_reminder_in_outbox_until_retry(self, mock_send: Mock) -> None:
+        check_habits()
+        check_habits()
+
+        mock_send.assert_called_once()
+        message = NotificationOutbox.objects.get()
+        self.assertEqual(message.text, get_reminder_text(self.habit))
+        self.assertEqual(message.attempts, 1)
+        self.assertGreater(
+            message.leased_until,
+            timezone.now() + timedelta(seconds=settings.REMINDER_RETRY_BACKOFF - 1),
+        )
+        # stays claimed, so the scheduler doesn't send it again
+        self.assertEqual(HabitNotification.objects.count(), 1)
+
+        NotificationOutbox.objects.update(leased_until=timezone.now())
+        mock_send.side_effect = deliver_all
+        dispatch_outbox()
+
+        self.assertEqual(mock_send.call_count, 2)
+        self.assertFalse(NotificationOutbox.objects.exists())
+        self.assertFalse(DeadLetter.objects.exists())
+
+    @patch("habits.tasks.send_telegram_messages", side_effect=deliver_all)
+    def test_sends_reminder_from_owner_bot(self, mock_send: Mock) -> None:
+        User.objects.filter(id=self.user.id).update(bot_shard=2)
+
+        check_habits()
+
+        ((chat_id, _, bot_shard),) = mock_send.call_args.args[0]
+        self.assertEqual((chat_id, bot_shard), (self.user.telegram_chat_id, 2))
+
+    @override_settings(OUTBOX_LEASE_TTL=5)
+    @patch("habits.tasks.send_telegram_messages", side_effect=deliver_all)
+    def test_lease_shorter_than_timeouts_leaves_no_wait(self, mock_send: Mock) -> None:
+        check_habits()
+
+        self.assertEqual(mock_send.call_args.kwargs["max_wait"], 0)
+
+    @patch("habits.tasks.send_telegram_messages", side_effect=refuse_all)
+    def test_does_not_retry_reminder_refused_by_chat(self, mock_send: Mock) -> None:
+        check_habits()
+
+        mock_send.assert_called_once()
+        self.assertFalse(NotificationOutbox.objects.exists())
+        self.assertFalse(DeadLetter.objects.exists())
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.telegram_failures, 1)
+        self.assertIsNone(self.user.telegram_undeliverable_at)
+
+    @override_settings(TELEGRAM_UNDELIVERABLE_AFTER=2)
+    @patch("habits.tasks.send_telegram_messages", side_effect=refuse_all)
+    def test_skips_chat_undeliverable_after_refused_reminders(
+        self, mock_send: Mock
+    ) -> None:
+        User.objects.filter(id=self.user.id).update(telegram_failures=1)
+
+        check_habits()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.telegram_failures, 2)
+        self.assertIsNotNone(self.user.telegram_undeliverable_at)
+
+        mock_send.reset_mock()
+        Habit.objects.update(next_reminder_at=timezone.now() - timedelta(minutes=1))
+        check_habits()
+        mock_send.assert_not_called()
+
+    @patch("habits.tasks.send_telegram_messages", side_effect=deliver_all)
+    def test_delivered_reminder_resets_refused_count(self, mock_send: Mock) -> None:
+        User.objects.filter(id=self.user.id).update(telegram_failures=2)
+
+        check_habits()
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.telegram_failures, 0)
+
+    @patch("habits.tasks.send_telegram_messages", side_effect=deliver_all)
+    def test_overdue_reminder_waits_for_habit_time(self, mock_send: Mock) -> None:
+        self.habit.time = time(9)
+        self.habit.next_reminder_at = datetime(2026, 1, 2, 9, tzinfo=UTC)
+        self.habit.save()
+
+        with patch("django.utils.timezone.now") as mock_now:
+            mock_now.return_value = datetime(2026, 1, 5, 8, tzinfo=UTC)
+            check_habits()
+            mock_send.assert_not_called()
+
+            mock_now.return_value = datetime(2026, 1, 5, 9, tzinfo=UTC)
+            check_habits()
+            mock_send.assert_called_once()
+
+        self.habit.refresh_from_db()
+        self.assertEqual(
+            self.habit.next_reminder_at, datetime(2026, 1, 6, 9, tzinfo=UTC)
+        )
+
+    @patch("habits.tasks.send_telegram_messages", side_effect=deliver_all)
+    def test_skips_if_notified_within_frequency(self, mock_send: Mock) -> None:
+        self.habit.frequency = 3
+        self.notify(self.habit, days_ago=2)
+        check_habits()
+
+        mock_send.assert_not_called()
+        self.assertEqual(HabitNotification.objects.count(), 1)
+
+    @patch("habits.tasks.send_telegram_messages", side_effect=deliver_all)
+    def test_sends_if_frequency_elapsed(self, mock_send: Mock) -> None:
+        self.habit.frequency = 3
+        self.notify(self.habit, days_ago=3)
+        check_habits()
+
+        mock_send.assert_called_once()
+        self.assertEqual(HabitNotification.objects.count(), 2)
+
+    @patch("habits.tasks.send_telegram_messages", side_effect=deliver_all)
+    def test_schedules_next_reminder_after_send(self, mock_send: Mock) -> None:
+        self.habit.frequency = 2
+        self.habit.save()
+        check_habits()
+        check_habits()
+
+        mock_send.assert_called_once()
+        self.habit.refresh_from_db()
+        self.assertEqual(
+            self.habit.next_reminder_at.date(),
+            timezone.now().date() + timedelta(days=2),
+        )
+
+    @patch("habits.tasks.send_telegram_messages", side_effect=deliver_all)
+    def test_rescheduled_habits_keep_caches(self, mock_send: Mock) -> None:
+        self.habit.is_public = True
+        self.habit.save()
+        habits_version = get_habits_version(self.user.id)
+        public_feed_version = get_public_feed_version()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            check_habits()
+
+        mock_send.assert_called_once()
+        self.assertEqual(get_habits_version(self.user.id), habits_version)
+        self.assertEqual(get_public_feed_version(), public_feed_version)
+
+    @patch("habits.tasks.send_telegram_messages", side_effect=deliver_all)
+    def test_query_count_does_not_grow_with_habits(self, mock_send: Mock) -> None:
+        self.assertQueriesDoNotGrow(
+            "habits.tasks.check_habits", check_habits, self.add_due_habits
+        )
+        self.assertEqual(
+            sum(len(call.args[0]) for call in mock_send.call_args_list), 11
+        )
+
+    @patch("habits.tasks.dispatch_outbox.delay")
+    def test_queue_reminders_query_budget(self, mock_dispatch: Mock) -> None:
+        def queue_due_reminders():
+            queue_reminders(
+                list(get_due_habits(timezone.now()).values_list("id", flat=True))
+            )
+
+        self.assertQueriesDoNotGrow(
+            "habits.tasks.queue_reminders", queue_due_reminders, self.add_due_habits
+        )
+        self.assertEqual(NotificationOutbox.objects.count(), 11)
+
+    @patch("habits.tasks.send_telegram_messages", side_effect=fail_all)
+    def test_dispatch_outbox_query_budget(self, mock_send: Mock) -> None:
+        def fill_outbox(count=1):
+            NotificationOutbox.objects.bulk_create(
+                NotificationOutbox(
+                    chat_id=i, text="text", habit_ids=[], claim_id=uuid.uuid4()
+                )
+                for i in range(count)
+            )
+
+        fill_outbox()
+        self.assertQueriesDoNotGrow(
+            "habits.tasks.dispatch_outbox",
+            dispatch_outbox,
+            lambda: fill_outbox(10),
+        )
+        self.assertEqual(NotificationOutbox.objects.filter(attempts=1).count(), 11)
+
+    def add_due_habits(self) -> None:
+        for i in range(10):
+            user = User.objects.create(
+                email=f"user{i}@test.com", telegram_chat_id=1000 + i
+            )
+            self.notify(create_habit(user), days_ago=1)
+
+    @patch("habits.tasks.send_telegram_messages", side_effect=deliver_all)
+    def test_records_tick_metrics(self, mock_send: Mock) -> None:
+        create_habit(self.user, action="Stretch")
+        ticks_count = get_metric("reminder_tick_duration_seconds_count")
+
+        check_habits()
+
+        self.assertEqual(get_metric("reminder_tick_due_habits"), 2)
+        self.assertEqual(
+            get_metric("reminder_tick_duration_seconds_count"), ticks_count + 1
+        )
+
+    @override_settings(REMINDER_CHUNK_SIZE=2)
+    @patch("habits.tasks.queue_reminders.s")
+    def test_dispatches_due_habits_in_chunks(self, mock_signature: Mock) -> None:
+        habits = [self.habit] + [
+            create_habit(
+                User.objects.create(email=f"user{i}@test.com", telegram_chat_id=i)
+            )
+            for i in range(4)
+        ]
+        create_habit(self.user, next_reminder_at=timezone.now() + timedelta(1))
+
+        with patch("habits.tasks.group") as mock_group:
+            check_habits()
+
+        mock_group.return_value.apply_async.assert_called_once()
+        self.assertEqual(
+            [call.args[0] for call in mock_signature.call_args_list],
+            [
+                [habits[0].id, habits[1].id],
+                [habits[2].id, habits[3].id],
+                [habits[4].id],
+            ],
+        )
+
+    @override_settings(REMINDER_CHUNK_SIZE=2)
+    @patch("habits.tasks.queue_reminders.s")
+    def test_does_not_split_owner_habits_between_chunks(
+        self, mock_signature: Mock
+    ) -> None:
+        other_user = User.objects.create(email="other@test.com", telegram_chat_id=1)
+        habits = [
+            self.habit,
+            create_habit(self.user),
+            create_habit(self.user),
+            create_habit(other_user),
+        ]
+
+        with patch("habits.tasks.group"):
+            check_habits()
+
+        self.assertEqual(
+            [call.args[0] for call in mock_signature.call_args_list],
+            [[habit.id for habit in habits[:3]], [habits[3].id]],
+        )
+
+    @override_settings(REMINDER_CHUNK_SIZE=50, REMINDER_GROUP_SIZE=2)
+    def test_peak_memory_does_not_grow_with_due_habits(self) -> None:
+        class DiscardedGroup:
+            def __init__(self, tasks) -> None:
+                pass
+
+            def apply_async(self) -> None:
+                pass
+
+        def measure_peak_memory(habits_count: int) -> int:
+            Habit.objects.all().delete()
+            User.objects.exclude(id=self.user.id).delete()
+            users = User.objects.bulk_create(
+                User(email=f"user{i}@test.com", telegram_chat_id=i)
+                for i in range(habits_count)
+            )
+            habit = self.habit
+            Habit.objects.bulk_create(
+                Habit(
+                    owner=user,
+                    place=habit.place,
+                    time=habit.time,
+                    action=habit.action,
+                    execution_time=habit.execution_time,
+                    next_reminder_at=habit.next_reminder_at,
+                )
+                for user in users
+            )
+
+            tracemalloc.start()
+            with patch("habits.tasks.group", DiscardedGroup):
+                check_habits()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            return peak
+
+        measure_peak_memory(100)  # warm up caches
+        self.assertLess(measure_peak_memory(5000), measure_peak_memory(500) * 1.5)
+
+    @patch("habits.tasks.send_telegram_messages", side_effect=deliver_all)
+    def test_sends_single_digest_for_owner_habits(self, mock_send: Mock) -> None:
+        self.user.reminder_digest = True
+        self.user.save()
+        other_habit = create_habit(self.user, action="Stretch")
+
+        check_habits()
+
+        mock_send.assert_called_once()
+        messages = mock_send.call_args.args[0]
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(messages[0][0], self.user.telegram_chat_id)
+        self.assertIn("take a bubble bath", messages[0][1])
+        self.assertIn("Stretch", messages[0][1])
+        self.assertEqual(
+            set(HabitNotification.objects.values_list("habit_id", flat=True)),
+            {self.habit.id, other_habit.id},
+        )
+
+    @patch("habits.tasks.dispatch_outbox.delay")
+    def test_splits_long_digest_between_messages(self, mock_dispatch: Mock) -> None:
+        self.user.reminder_digest = True
+        self.user.save()
+        habits = [self.habit] + [
+            create_habit(self.user, action="🏃" * 200) for _ in range(20)
+        ]
+
+        queue_reminders([habit.id for habit in habits])
+
+        messages = NotificationOutbox.objects.order_by("id")
+        self.assertGreater(len(messages), 1)
+        for message in messages:
+            self.assertLessEqual(get_text_length(message.text), MESSAGE_MAX_LENGTH)
+            self.assertEqual(message.text.count("•"), len(message.habit_ids))
+        self.assertEqual(
+            [habit_id for message in messages for habit_id in message.habit_ids],
+            [habit.id for habit in habits],
+        )
+
+    @patch("habits.tasks.send_telegram_messages", side_effect=deliver_all)
+    def test_sends_message_per_habit_without_digest(self, mock_send: Mock) -> None:
+        create_habit(self.user, action="Stretch")
+
+        check_habits()
+
+        self.assertEqual(len(mock_send.call_args.args[0]), 2)
+
+    @patch("habits.tasks.send_telegram_messages", side_effect=deliver_all)
+    def test_does_not_send_already_claimed_reminder(self, mock_send: Mock) -> None:
+        # claimed by an overlapping run which hasn't finished yet
+        HabitNotification.objects.create(habit=self.habit, date=timezone.now().date())
+        other_habit = create_habit(self.user, action="Stretch")
+
+        queue_reminders([self.habit.id, other_habit.id])
+
+        mock_send.assert_called_once()
+        self.assertEqual(
+            mock_send.call_args.args[0],
+            [(self.user.telegram_chat_id, get_reminder_text(other_habit), 0)],
+        )
+        self.assertEqual(HabitNotification.objects.count(), 2)
+
+    @override_settings(REMINDER_MAX_RETRIES=2)
+    @patch("habits.tasks.send_telegram_messages", side_effect=fail_all)
+    def test_stores_dead_letter_after_last_retry(self, mock_send: Mock) -> None:
+        claim_id = uuid.uuid4()
+        NotificationOutbox.objects.create(
+            chat_id=123456,
+            bot_shard=1,
+            text="text",
+            habit_ids=[self.habit.id],
+            claim_id=claim_id,
+            attempts=2,
+        )
+
+        with override_settings(TELEGRAM_BOT_TOKENS=["first", "second"]):
+            dispatch_outbox()
+
+        mock_send.assert_called_once_with([(123456, "text", 1)])
+        self.assertFalse(NotificationOutbox.objects.exists())
+        dead_letter = DeadLetter.objects.get()
+        self.assertEqual(dead_letter.chat_id, 123456)
+        self.assertEqual(dead_letter.bot_shard, 1)
+        self.assertEqual(dead_letter.habit_ids, [self.habit.id])
+        self.assertEqual(dead_letter.claim_id, claim_id)
+        self.assertEqual(dead_letter.attempts, 3)
+        self.assertEqual(dead_letter.error, "Bad Gateway")
+
+    @override_settings(TELEGRAM_BOT_TOKENS=["first"])
+    @patch("habits.services._post_message")
+    def test_stores_dead_letter_of_bot_without_token(self, mock_post: Mock) -> None:
+        User.objects.filter(id=self.user.id).update(telegram_failures=2)
+        NotificationOutbox.objects.create(
+            chat_id=self.user.telegram_chat_id,
+            bot_shard=1,
+            text="text",
+            habit_ids=[self.habit.id],
+            claim_id=uuid.uuid4(),
+        )
+
+        dispatch_outbox()
+
+        mock_post.assert_not_called()
+        dead_letter = DeadLetter.objects.get()
+        self.assertEqual(dead_letter.attempts, 1)
+        self.assertEqual(dead_letter.error, "Token of bot 1 isn't set")
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.telegram_failures, 2)
+
+    @patch("habits.tasks.send_telegram_messages", side_effect=deliver_all)
+    def test_replay_dead_letters_sends_them_again(self, mock_send: Mock) -> None:
+        dead_letters = [
+            DeadLetter.objects.create(
+                chat_id=chat_id,
+                text="text",
+                habit_ids=[],
+                claim_id=uuid.uuid4(),
+                attempts=6,
+                error="Bad Gateway",
+            )
+            for chat_id in (1, 2, 3)
+        ]
+
+        call_command(
+            "replay_dead_letters", dead_letters[0].id, dead_letters[1].id, stdout=Mock()
+        )
+
+        self.assertEqual(mock_send.call_args.args[0], [(1, "text", 0), (2, "text", 0)])
+        self.assertEqual(list(DeadLetter.objects.all()), dead_letters[2:])
+        self.assertFalse(NotificationOutbox.objects.exists())
+
+    @patch("habits.tasks.dispatch_outbox.delay")
+    @patch("habits.tasks.send_telegram_messages", side_effect=deliver_all)
+    def test_queue_reminders_only_fills_outbox(
+        self, mock_send: Mock, mock_dispatch: Mock
+    ) -> None:
+        queue_reminders([self.habit.id])
+
+        mock_send.assert_not_called()
+        mock_dispatch.assert_called_once()
+        message = NotificationOutbox.objects.get()
+        self.assertEqual(message.chat_id, self.user.telegram_chat_id)
+        self.assertEqual(message.text, get_reminder_text(self.habit))
+        self.assertEqual(message.habit_ids, [self.habit.id])
+        self.assertEqual(HabitNotification.objects.count(), 1)
+
+    @override_settings(OUTBOX_BATCH_SIZE=2)
+    @patch("habits.tasks.send_telegram_messages", side_effect=deliver_all)
+    def test_dispatch_outbox_drains_all_batches(self, mock_send: Mock) -> None:
+        NotificationOutbox.objects.bulk_create(
+            NotificationOutbox(
+                chat_id=i, text="text", habit_ids=[], claim_id=uuid.uuid4()
+            )
+            for i in range(5)
+        )
+
+        dispatch_outbox()
+
+        self.assertEqual(mock_send.call_count, 3)
+        self.assertFalse(NotificationOutbox.objects.exists())
+
+    @patch("habits.tasks.send_telegram_messages", side_effect=deliver_all)
+    def test_dispatch_outbox_skips_messages_leased_by_others(
+        self, mock_send: Mock
+    ) -> None:
+        now = timezone.now()
+        leased, *_ = NotificationOutbox.objects.bulk_create(
+            NotificationOutbox(
+                chat_id=chat_id,
+                text="text",
+                habit_ids=[],
+                claim_id=uuid.uuid4(),
+                lease_id=uuid.uuid4() if leased_until else None,
+                leased_until=leased_until,
+            )
+            # leased by a running dispatcher, by a dead one, not leased
+            for chat_id, leased_until in [
+                (1, now + timedelta(minutes=1)),
+                (2, now - timedelta(seconds=1)),
+                (3, None),
+            ]
+        )
+
+        dispatch_outbox()
+
+        mock_send.assert_called_once()
+        self.assertEqual(
+            [chat_id for chat_id, *_ in mock_send.call_args.args[0]], [2, 3]
+        )
+        self.assertEqual(list(NotificationOutbox.objects.all()), [leased])
+
+    @patch("habits.tasks.send_telegram_messages", side_effect=deliver_all)
+    def test_queue_reminders_skips_not_due_habits(self, mock_send: Mock) -> None:
+        self.notify(self.habit)
+        queue_reminders([self.habit.id])
+
+        mock_send.assert_not_called()
+
+
+class HabitReadPathTest(APITestCase):
+    def setUp(self) -> None:
+        bump_public_feed_version()
+        self.owner = User.objects.create_user(email="test@test.com", password="test")
+        pleasant = create_habit(self.owner, is_pleasant=True, is_public=True)
+        create_habit(
+            self.owner,
+            related_habit=pleasant,
+            time="07:30",
+            place="парк\u2028",
+        )
+        create_habit(self.owner, reward="coffee", is_public=True, frequency=7)
+        self.client.force_authenticate(self.owner)
+
+    def assertSameContent(self, url: str, queryset) -> None:
+        response = self.client.get(url)
+
+        expected = {
+            "count": queryset.count(),
+            "next": None,
+            "previous": None,
+            "results": HabitSerializer(queryset, many=True).data,
+        }
+        self.assertEqual(
+            response.content, JSONRenderer().render(expected, "application/json")
+        )
+
+    def test_values_serializer_matches_habit_serializer(self) -> None:
+        habits = Habit.objects.all()
+        values_serializer = ValuesSerializer(HabitSerializer)
+
+        with timezone.override("Asia/Tokyo"):
+            self.assertEqual(
+                values_serializer.to_representation(
+                    habits.values(*values_serializer.sources)
+                ),
+                HabitSerializer(habits, many=True).data,
+            )
+
+    def test_list_content_matches_habit_serializer(self) -> None:
+        self.assertSameContent(
+            reverse("habits:habit-list"), Habit.objects.filter(owner=self.owner)
+        )
+
+    def test_public_list_content_matches_habit_serializer(self) -> None:
+        self.assertSameContent(
+            reverse("habits:habit-list-public"), Habit.objects.filter(is_public=True)
+        )
+
+    def test_orjson_renderer_matches_json_renderer(self) -> None:
+        data = {
+            "text": 'habit \u2028\u2029 \x1f \x7f ✓ "quoted" \\',
+            "lazy": gettext_lazy("This field is required."),
+            "error": ErrorDetail("Habit not found.", code="invalid"),
+            "datetime": datetime(2026, 1, 1, 7, 30, 0, 123456, tzinfo=UTC),
+            "date": datetime(2026, 1, 1).date(),
+            "time": time(7, 30, 15, 500000),
+            "timedelta": timedelta(minutes=2),
+            "uuid": uuid.UUID(int=1),
+            "decimal": Decimal("1.5"),
+            "errors": {0: {"id": ["Habit not found."]}, 2: {}},
+            "values": [1, -1, 2**63, 0.1, True, False, None, [], {}],
+        }
+
+        for accepted_media_type in ("application/json", "application/json; indent=4"):
+            self.assertEqual(
+                ORJSONRenderer().render(data, accepted_media_type),
+                JSONRenderer().render(data, accepted_media_type),
+            )
+        # too big for orjson
+        self.assertEqual(
+            ORJSONRenderer().render([2**70]), JSONRenderer().render([2**70])
+        )
+        self.assertEqual(ORJSONRenderer().render(None), b"")
+
+
+class LoggingTest(SimpleTestCase):
+    def record(self, level=logging.INFO, **extra) -> logging.LogRecord:
+        record = logging.makeLogRecord(
+            {"name": "habits.tasks", "levelno": level, "msg": "Sent %s", "args": (1,)}
+        )
+        record.__dict__.update(extra)
+        return record
+
+    def test_tests_log_to_temporary_file(self) -> None:
+        self.assertTrue(settings.LOG_FILE.startswith(tempfile.gettempdir()))
+
+    def test_json_formatter_includes_extra_fields(self) -> None:
+        data = json.loads(JsonFormatter().format(self.record(habit_id=1, user_id=2)))
+
+        self.assertEqual(data["logger"], "habits.tasks")
+        self.assertEqual(data["message"], "Sent 1")
+        self.assertEqual(data["habit_id"], 1)
+        self.assertEqual(data["user_id"], 2)
+        self.assertNotIn("args", data)
+
+    def test_sampling_filter_samples_debug_records_only(self) -> None:
+        sampling_filter = SamplingFilter(rate=0.25)
+
+        with patch("config.logs.random.random", side_effect=[0.1, 0.5]):
+            self.assertTrue(sampling_filter.filter(self.record(logging.DEBUG)))
+            self.assertFalse(sampling_filter.filter(self.record(logging.DEBUG)))
+        self.assertTrue(sampling_filter.filter(self.record(logging.INFO)))
+
+    def test_queue_handler_restarts_listener_in_forked_process(self) -> None:
+        target = logging.handlers.BufferingHandler(capacity=10)
+        handler = QueueHandler(queue.Queue())
+        handler.listener = logging.handlers.QueueListener(handler.queue, target)
+        self.addCleanup(handler.listener.stop)
+
+        handler.handle(self.record())
+        # the listener thread of the parent process isn't there after fork
+        handler.listener.stop()
+        with patch("config.logs.os.getpid", return_value=-1):
+            handler.handle(self.record())
+        handler.listener.stop()
+
+        self.assertEqual(len(target.buffer), 2)
+
+    def test_rotated_file_is_reopened_by_other_processes(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = f"{directory.name}/habits.log"
+        handlers = [
+            RotatingFileHandler(path, maxBytes=100, backupCount=3) for _ in range(2)
+        ]
+        for handler in handlers:
+            self.addCleanup(handler.close)
+
+        for handler in handlers:
+            handler.handle(self.record(msg="x" * 90, args=()))
+        # rotated by the first handler, the second one writes to the new file
+        handlers[0].handle(self.record(msg="x" * 90, args=()))
+        handlers[1].handle(self.record(msg="y" * 90, args=()))
+
+        with open(path) as file:
+            self.assertEqual(file.read(), "y" * 90 + "\n")
+        with open(f"{path}.1") as file:
+            self.assertEqual(file.read(), "x" * 90 + "\n")
+        self.assertFalse(os.path.exists(f"{path}.3"))
+
+
+class ReminderBenchmarkTest(TestCase):
+    def load(self, habits_count: int, *args: str) -> None:
+        call_command(
+            "load_synthetic_habits", habits_count, "--seed", "1", *args, stdout=Mock()
+        )
+
+    def test_loads_synthetic_habits_with_history(self) -> None:
+        self.load(200, "--history-days", "7", "--batch-size", "20")
+        self.load(50, "--clear")
+
+        habits = Habit.objects.annotate(last_date=Max("notifications__date"))
+        self.assertEqual(habits.count(), 50)
+        for habit in habits:
+            self.assertIn(habit.frequency, range(1, 8))
+            self.assertIsNotNone(habit.last_date)
+            self.assertEqual(
+                habit.next_reminder_at,
+                datetime.combine(
+                    habit.last_date + timedelta(days=habit.frequency),
+                    habit.time,
+                    tzinfo=UTC,
+                ),
+            )
+
+    def test_benchmark_reports_tick_as_json(self) -> None:
+        self.load(100)
+        notifications_count = HabitNotification.objects.count()
+        due_count = get_due_habits(
+            datetime.combine(timezone.now().date(), time.max, tzinfo=UTC)
+        ).count()
+
+        with tempfile.NamedTemporaryFile("r", suffix=".json") as output:
+            call_command(
+                "benchmark_reminders", "--label", "test", "--output", output.name
+            )
+            results = json.load(output)
+
+        self.assertEqual(results["label"], "test")
+        self.assertEqual(results["habits"], 100)
+        self.assertEqual(results["due"], due_count)
+        self.assertGreater(results["sent"], 0)
+        self.assertLessEqual(results["sent"], due_count)
+        self.assertGreater(results["queries"], 0)
+        self.assertGreater(results["peak_memory"], 0)
+        self.assertGreater(results["wall_time"], 0)
+        # the tick is rolled back
+        self.assertEqual(HabitNotification.objects.count(), notifications_count)
+
+
+class LoadTestAPITest(LiveServerTestCase):
+    def test_reports_latency_per_endpoint(self) -> None:
+        stdout = StringIO()
+        with tempfile.NamedTemporaryFile("r", suffix=".json") as output:
+            call_command(
+                "load_test_api",
+                "--url",
+                self.live_server_url,
+                "--duration",
+                "1",
+                "--concurrency",
+                "2",
+                "--users",
+                "2",
+                "--mix",
+                "list=1,public=1,detail=1,create=1,update=1,delete=1",
+                "--seed",
+                "1",
+                "--output",
+                output.name,
+                stdout=stdout,
+            )
+            report = json.load(output)
+
+        self.assertEqual(
+            set(report["endpoints"]),
+            {"list", "public", "detail", "create", "update", "delete"},
+        )
+        self.assertEqual(report["total"]["errors"], 0)
+        self.assertGreater(report["total"]["rps"], 0)
+        for stats in report["endpoints"].values():
+            self.assertLessEqual(stats["p50_ms"], stats["p95_ms"])
+            self.assertLessEqual(stats["p95_ms"], stats["p99_ms"])
+        self.assertIn("p99_ms", stdout.getvalue())
+        # created users are removed afterwards
+        self.assertFalse(User.objects.exists())
+
+    def test_rejects_unknown_endpoint_in_mix(self) -> None:
+        with self.assertRaises(CommandError):
+            call_command("load_test_api", "--mix", "list=1,unknown=1")
+
+    def test_sends_requests_as_every_user(self) -> None:
+        emails = set()
+
+        async def record_user(client, user, rng) -> httpx.Response:
+            emails.add(user.email)
+            await asyncio.sleep(0.001)
+            return httpx.Response(200)
+
+        users = [Mock(email=f"user{i}@test.com") for i in range(5)]
+        with patch.dict(load_test_api.REQUESTS, {"list": record_user}):
+            run_async(
+                load_test_api.run_load(
+                    self.live_server_url, users, {"list": 1}, 0.2, 2, random.Random(1)
+                )
+            )
+
+        self.assertEqual(emails, {user.email for user in users})
@@ -2,6 +2,7 @@ from django.urls import path
 
 from .apps import HabitsConfig
 from .views import (
+    HabitBatchAPIView,
     HabitListCreateAPIView,
     HabitRetrieveUpdateDestroyAPIView,
     PublicHabitListAPIView,
@@ -12,5 +13,6 @@ app_name = HabitsConfig.name
 urlpatterns = [
     path("public/", PublicHabitListAPIView.as_view(), name="habit-list-public"),
     path("", HabitListCreateAPIView.as_view(), name="habit-list"),
+    path("batch/", HabitBatchAPIView.as_view(), name="habit-batch"),
     path("<int:pk>/", HabitRetrieveUpdateDestroyAPIView.as_view(), name="habit-detail"),
 ]
@@ -1,21 +1,54 @@
-from rest_framework import generics
+from drf_spectacular.utils import extend_schema, inline_serializer
+from rest_framework import generics, serializers
+from rest_framework.response import Response
 
 from users.permissions import IsOwner
 
+from .cache import cached_public_feed, conditional_habits_response
 from .models import Habit
 from .paginators import HabitPaginator
-from .serializers import HabitSerializer
+from .serializers import HabitBatchSerializer, HabitSerializer, ValuesSerializer
 
 
-class PublicHabitListAPIView(generics.ListAPIView):
-    """List endpoint for public habits."""
+class HabitValuesListMixin:
+    """
+    Lists habits from `.values()` rows converted by ValuesSerializer,
+    which is much faster than HabitSerializer and gives the same data.
+    """
+
+    values_serializer = ValuesSerializer(HabitSerializer)
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset()).values(
+            *self.values_serializer.sources
+        )
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(
+                self.values_serializer.to_representation(page)
+            )
+        return Response(self.values_serializer.to_representation(queryset))
+
+
+class PublicHabitListAPIView(HabitValuesListMixin, generics.ListAPIView):
+    """
+    List endpoint for public habits.
+    Pages are served from cache until a public habit changes.
+    """
 
     serializer_class = HabitSerializer
     pagination_class = HabitPaginator
     queryset = Habit.objects.filter(is_public=True)
 
+    def list(self, request, *args, **kwargs):
+        list_habits = super().list
+        return cached_public_feed(
+            request, lambda: list_habits(request, *args, **kwargs)
+        )
+
 
-class HabitListCreateAPIView(generics.ListCreateAPIView):
+class HabitListCreateAPIView(HabitValuesListMixin, generics.ListCreateAPIView):
     """
     List/Create endpoint for habits.
     Returns only habits that belong to curent user.
@@ -27,6 +60,12 @@ class HabitListCreateAPIView(generics.ListCreateAPIView):
     def get_queryset(self):
         return Habit.objects.filter(owner=self.request.user)
 
+    def list(self, request, *args, **kwargs):
+        list_habits = super().list
+        return conditional_habits_response(
+            request, lambda: list_habits(request, *args, **kwargs)
+        )
+
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
 
@@ -41,3 +80,60 @@ class HabitRetrieveUpdateDestroyAPIView(generics.RetrieveUpdateDestroyAPIView):
 
     queryset = Habit.objects.all()
     permission_classes = (IsOwner,)
+
+    def retrieve(self, request, *args, **kwargs):
+        retrieve_habit = super().retrieve
+        return conditional_habits_response(
+            request,
+            lambda: retrieve_habit(request, *args, **kwargs),
+            # the etag is of the user's habits, 304 is only for an own habit
+            lambda: Habit.objects.filter(
+                pk=kwargs[self.lookup_field], owner_id=request.user.pk
+            ).exists(),
+        )
+
+
+class HabitBatchAPIView(generics.GenericAPIView):
+    """
+    Batch endpoint applying a list of create/update/delete operations
+    to user's habits at once, all of them or none if any is invalid.
+    Returns the habit of each operation, in order.
+    """
+
+    serializer_class = HabitBatchSerializer
+
+    def get_serializer_context(self):
+        return {**super().get_serializer_context(), "owner": self.request.user}
+
+    @extend_schema(
+        responses=inline_serializer(
+            "HabitBatchResult",
+            {
+                "results": inline_serializer(
+                    "HabitOperationResult",
+                    {
+                        "op": serializers.CharField(),
+                        "id": serializers.IntegerField(),
+                        "habit": HabitSerializer(allow_null=True),
+                    },
+                    many=True,
+                )
+            },
+        )
+    )
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        operations = serializer.save()
+
+        results = []
+        for operation in operations:
+            habit = operation.get("habit")
+            results.append(
+                {
+                    "op": operation["op"],
+                    "id": habit.id if habit else operation["id"],
+                    "habit": HabitSerializer(habit).data if habit else None,
+                }
+            )
+        return Response({"results": results})
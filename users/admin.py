@@ -5,5 +5,13 @@ from .models import User
 
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
-    list_display = ("email", "first_name", "last_name", "is_active", "telegram_chat_id")
-    list_filter = ("is_active",)
+    list_display = (
+        "email",
+        "first_name",
+        "last_name",
+        "is_active",
+        "telegram_chat_id",
+        "bot_shard",
+        "telegram_undeliverable_at",
+    )
+    list_filter = ("is_active", "bot_shard", "telegram_undeliverable_at")
@@ -0,0 +1,50 @@
+from itertools import batched
+
+from django.core.management.base import BaseCommand
+
+from users.models import User
+from users.services import get_bot_shard
+
+
+class Command(BaseCommand):
+    help = (
+        "Spreads users between bots from TELEGRAM_BOT_TOKENS, run after adding "
+        "a bot. Moved users should have started the bot they are moved to"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only count users which would be moved",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=1000, help="Users updated per query"
+        )
+
+    def handle(self, *args, **options):
+        users = (
+            User.objects.filter(telegram_chat_id__isnull=False)
+            .only("telegram_chat_id", "bot_shard")
+            .order_by("id")
+            .iterator(chunk_size=options["batch_size"])
+        )
+        moved_users = (
+            user
+            for user in users
+            if user.bot_shard != get_bot_shard(user.telegram_chat_id)
+        )
+
+        moved_count = 0
+        for batch in batched(moved_users, options["batch_size"]):
+            moved_count += len(batch)
+            if options["dry_run"]:
+                continue
+            for user in batch:
+                user.bot_shard = get_bot_shard(user.telegram_chat_id)
+            User.objects.bulk_update(batch, ["bot_shard"])
+
+        action = "Would move" if options["dry_run"] else "Moved"
+        self.stdout.write(
+            self.style.SUCCESS(f"{action} {moved_count} users to other bots")
+        )
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.3 on 2026-10-18 11:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0002_alter_user_options"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="reminder_digest",
+            field=models.BooleanField(
+                default=False,
+                help_text="Habits due at the same time are reminded in a single message",
+            ),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.3 on 2026-10-18 11:26
+
+from django.db import migrations, models
+
+
+def assign_first_bot(apps, schema_editor):
+    # chats were started with the only bot there was
+    User = apps.get_model("users", "User")
+    User.objects.filter(telegram_chat_id__isnull=False).update(bot_shard=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0003_user_reminder_digest"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="bot_shard",
+            field=models.PositiveSmallIntegerField(
+                blank=True,
+                editable=False,
+                help_text="Bot sending messages to the user's telegram chat",
+                null=True,
+            ),
+        ),
+        migrations.RunPython(assign_first_bot, reverse_code=migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.3 on 2026-10-18 11:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0004_user_bot_shard"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="telegram_failures",
+            field=models.PositiveSmallIntegerField(
+                default=0,
+                editable=False,
+                help_text="Messages in a row telegram refused to deliver to the chat",
+            ),
+        ),
+        migrations.AddField(
+            model_name="user",
+            name="telegram_undeliverable_at",
+            field=models.DateTimeField(
+                blank=True,
+                editable=False,
+                help_text="When the chat was found undeliverable, reminders aren't sent since",
+                null=True,
+            ),
+        ),
+    ]
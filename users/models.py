@@ -2,12 +2,34 @@ from django.contrib.auth.models import AbstractUser
 from django.db import models
 
 from .managers import UserManager
+from .services import get_bot_shard
 
 
 class User(AbstractUser):
     username = None
     email = models.EmailField(unique=True)
     telegram_chat_id = models.BigIntegerField(unique=True, blank=True, null=True)
+    reminder_digest = models.BooleanField(
+        default=False,
+        help_text="Habits due at the same time are reminded in a single message",
+    )
+    bot_shard = models.PositiveSmallIntegerField(
+        blank=True,
+        null=True,
+        editable=False,
+        help_text="Bot sending messages to the user's telegram chat",
+    )
+    telegram_failures = models.PositiveSmallIntegerField(
+        default=0,
+        editable=False,
+        help_text="Messages in a row telegram refused to deliver to the chat",
+    )
+    telegram_undeliverable_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        editable=False,
+        help_text="When the chat was found undeliverable, reminders aren't sent since",
+    )
 
     USERNAME_FIELD = "email"
     REQUIRED_FIELDS = []
@@ -19,3 +41,10 @@ class User(AbstractUser):
 
     def __str__(self) -> str:
         return self.email
+
+    def save(self, *args, **kwargs) -> None:
+        if self.telegram_chat_id is None:
+            self.bot_shard = None
+        elif self.bot_shard is None:
+            self.bot_shard = get_bot_shard(self.telegram_chat_id)
+        super().save(*args, **kwargs)
@@ -5,4 +5,5 @@ class IsOwner(BasePermission):
     """Validates if user in request is owner of the object."""
 
     def has_object_permission(self, request, view, obj):
-        return obj.owner == request.user
+        # compares ids, so the owner isn't fetched
+        return obj.owner_id == request.user.pk
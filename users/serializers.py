@@ -1,6 +1,8 @@
 from django.contrib.auth import get_user_model
 from rest_framework import serializers
 
+from .services import get_bot_username
+
 User = get_user_model()
 
 
@@ -15,6 +17,33 @@ class RegisterSerializer(serializers.ModelSerializer):
 
 
 class MeSerializer(serializers.ModelSerializer):
+    telegram_bot = serializers.SerializerMethodField(
+        help_text="Username of the bot sending reminders, start it in telegram"
+    )
+
     class Meta:
         model = User
-        fields = ("email", "telegram_chat_id", "first_name", "last_name")
+        fields = (
+            "email",
+            "telegram_chat_id",
+            "telegram_bot",
+            "telegram_undeliverable_at",
+            "reminder_digest",
+            "first_name",
+            "last_name",
+        )
+        read_only_fields = ("telegram_undeliverable_at",)
+
+    def get_telegram_bot(self, user) -> str | None:
+        return get_bot_username(user.bot_shard)
+
+    def update(self, instance, validated_data):
+        if "telegram_chat_id" in validated_data:
+            # submitting the chat again, e.g. after unblocking the bot,
+            # resumes reminders
+            instance.telegram_failures = 0
+            instance.telegram_undeliverable_at = None
+            if validated_data["telegram_chat_id"] != instance.telegram_chat_id:
+                # bot for the new chat is picked on save
+                instance.bot_shard = None
+        return super().update(instance, validated_data)
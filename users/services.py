@@ -0,0 +1,41 @@
+from django.conf import settings
+
+
+def get_bot_tokens() -> list[str]:
+    """
+    Returns tokens of all bots sending messages, a bot shard is an index
+    in this list. TELEGRAM_BOT_TOKENS, or TELEGRAM_BOT_TOKEN if it's empty.
+    """
+
+    if settings.TELEGRAM_BOT_TOKENS:
+        return list(settings.TELEGRAM_BOT_TOKENS)
+    return [settings.TELEGRAM_BOT_TOKEN] if settings.TELEGRAM_BOT_TOKEN else []
+
+
+def get_bot_shard(chat_id: int) -> int:
+    """
+    Returns a bot shard for given chat, spreading chats evenly between bots.
+    Uses jump consistent hashing, so when a bot is added only the chats
+    moving to the new bot get a different shard.
+    """
+
+    bots_count = max(1, len(get_bot_tokens()))
+    key = chat_id % 2**64
+    shard, candidate = -1, 0
+    while candidate < bots_count:
+        shard = candidate
+        key = (key * 2862933555777941757 + 1) % 2**64
+        candidate = int((shard + 1) * (2**31 / ((key >> 33) + 1)))
+    return shard
+
+
+def get_bot_username(bot_shard: int | None) -> str | None:
+    """
+    Returns username of the bot with given shard from TELEGRAM_BOT_USERNAMES,
+    None if it isn't set.
+    """
+
+    usernames = settings.TELEGRAM_BOT_USERNAMES
+    if bot_shard is None or bot_shard >= len(usernames):
+        return None
+    return usernames[bot_shard] or None
@@ -1,9 +1,18 @@
-from django.test import TestCase
+from unittest.mock import Mock
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from config.query_budgets import QueryBudgetMixin
+from habits.models import Habit, HabitNotification
 
 from .models import User
+from .services import get_bot_shard
 
 
 class UserManagerTest(TestCase):
@@ -39,6 +48,76 @@ class UserManagerTest(TestCase):
             )
 
 
+@override_settings(TELEGRAM_BOT_TOKENS=["first", "second", "third"])
+class BotShardTest(TestCase):
+    def test_assigns_bot_shard_with_telegram_chat_id(self):
+        user = User.objects.create_user(email="test@example.com", password="test")
+        self.assertIsNone(user.bot_shard)
+
+        user.telegram_chat_id = 123456
+        user.save()
+        self.assertEqual(user.bot_shard, get_bot_shard(123456))
+
+        user.telegram_chat_id = None
+        user.save()
+        self.assertIsNone(user.bot_shard)
+
+    def test_bot_shard_sticks_when_bots_are_added(self):
+        user = User.objects.create_user(email="test@example.com", telegram_chat_id=1)
+        user.bot_shard = 0
+        user.save()
+
+        with override_settings(TELEGRAM_BOT_TOKENS=["first", "second", "third", "4"]):
+            user.save()
+
+        self.assertEqual(user.bot_shard, 0)
+
+    def test_rebalance_bot_shards_moves_users_to_their_bots(self):
+        users = [
+            User.objects.create_user(
+                email=f"{chat_id}@test.com", telegram_chat_id=chat_id
+            )
+            for chat_id in range(1, 31)
+        ]
+        User.objects.update(bot_shard=0)
+
+        call_command("rebalance_bot_shards", "--dry-run", stdout=Mock())
+        self.assertEqual(User.objects.exclude(bot_shard=0).count(), 0)
+
+        call_command("rebalance_bot_shards", "--batch-size", "7", stdout=Mock())
+        for user in users:
+            user.refresh_from_db()
+            self.assertEqual(user.bot_shard, get_bot_shard(user.telegram_chat_id))
+        self.assertEqual(
+            set(User.objects.values_list("bot_shard", flat=True)), {0, 1, 2}
+        )
+
+    def get_shards(self, bots_count: int) -> list[int]:
+        tokens = [f"token{i}" for i in range(bots_count)]
+        with override_settings(TELEGRAM_BOT_TOKENS=tokens):
+            return [get_bot_shard(chat_id) for chat_id in range(1, 1001)]
+
+    def test_spreads_chats_evenly_between_bots(self) -> None:
+        shards = self.get_shards(4)
+
+        for shard in range(4):
+            self.assertAlmostEqual(shards.count(shard), 250, delta=50)
+
+    def test_added_bot_only_takes_chats_from_others(self) -> None:
+        moved_to = [
+            new
+            for old, new in zip(self.get_shards(4), self.get_shards(5))
+            if old != new
+        ]
+
+        self.assertEqual(set(moved_to), {4})
+        self.assertAlmostEqual(len(moved_to), 200, delta=50)
+
+    @override_settings(TELEGRAM_BOT_TOKENS=[], TELEGRAM_BOT_TOKEN="token")
+    def test_single_bot_gets_all_chats(self) -> None:
+        self.assertEqual({get_bot_shard(chat_id) for chat_id in range(100)}, {0})
+
+
 class UserAPITest(APITestCase):
     def setUp(self) -> None:
         self.user = User.objects.create_user(email="test@test.com", password="test")
@@ -138,6 +217,64 @@ class UserAPITest(APITestCase):
         self.user.refresh_from_db()
         self.assertEqual(self.user.email, "new@email.com")
 
+    def test_update_me_reminder_digest(self) -> None:
+        self.authenticate(self.user)
+        response = self.client.patch(reverse("users:me"), {"reminder_digest": True})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.reminder_digest)
+
+    @override_settings(TELEGRAM_BOT_TOKENS=["first", "second", "third"])
+    def test_update_me_telegram_chat_id_reassigns_bot_shard(self) -> None:
+        self.user.telegram_chat_id = 1
+        self.user.bot_shard = 2
+        self.user.save()
+
+        self.authenticate(self.user)
+        response = self.client.patch(reverse("users:me"), {"reminder_digest": True})
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.bot_shard, 2)
+
+        response = self.client.patch(reverse("users:me"), {"telegram_chat_id": 5})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.bot_shard, get_bot_shard(5))
+
+    @override_settings(
+        TELEGRAM_BOT_TOKENS=["first", "second"],
+        TELEGRAM_BOT_USERNAMES=["first_bot", "second_bot"],
+    )
+    def test_retrieve_me_shows_telegram_bot(self) -> None:
+        self.authenticate(self.user)
+        response = self.client.get(reverse("users:me"))
+        self.assertIsNone(response.data["telegram_bot"])
+
+        response = self.client.patch(reverse("users:me"), {"telegram_chat_id": 5})
+        self.assertEqual(
+            response.data["telegram_bot"],
+            ["first_bot", "second_bot"][get_bot_shard(5)],
+        )
+
+    def test_update_me_telegram_chat_id_makes_chat_deliverable(self) -> None:
+        self.user.telegram_chat_id = 1
+        self.user.telegram_failures = 3
+        self.user.telegram_undeliverable_at = timezone.now()
+        self.user.save()
+
+        self.authenticate(self.user)
+        response = self.client.get(reverse("users:me"))
+        self.assertIsNotNone(response.data["telegram_undeliverable_at"])
+
+        response = self.client.patch(reverse("users:me"), {"reminder_digest": True})
+        self.assertIsNotNone(response.data["telegram_undeliverable_at"])
+
+        # the same chat, e.g. after the bot was unblocked there
+        response = self.client.patch(reverse("users:me"), {"telegram_chat_id": 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNone(response.data["telegram_undeliverable_at"])
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.telegram_failures, 0)
+
     # me/ delete
 
     def test_delete_me_unauthenticated(self) -> None:
@@ -149,3 +286,68 @@ class UserAPITest(APITestCase):
         response = self.client.delete(reverse("users:me"))
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
         self.assertFalse(User.objects.filter(id=self.user.id).exists())
+
+
+class UserQueryBudgetTest(QueryBudgetMixin, APITestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(
+            email="test@test.com", password="test", telegram_chat_id=1
+        )
+        # a real token, so authentication queries count too
+        token = RefreshToken.for_user(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+
+    def test_register_budget(self) -> None:
+        self.client.credentials()
+        with self.assertQueryBudget("users.views.RegisterView.post"):
+            response = self.client.post(
+                reverse("users:register"), {"email": "new@user.com", "password": "test"}
+            )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_retrieve_me_budget(self) -> None:
+        with self.assertQueryBudget("users.views.MeView.get"):
+            response = self.client.get(reverse("users:me"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_update_me_budget(self) -> None:
+        with self.assertQueryBudget("users.views.MeView.put"):
+            response = self.client.put(
+                reverse("users:me"), {"email": "new@email.com", "telegram_chat_id": 2}
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_partial_update_me_budget(self) -> None:
+        with self.assertQueryBudget("users.views.MeView.patch"):
+            response = self.client.patch(reverse("users:me"), {"reminder_digest": True})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_delete_me_budget(self) -> None:
+        def delete_me():
+            response = self.client.delete(reverse("users:me"))
+            self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        def add_user(habits_count=10):
+            # the user is gone after the first request, a new one has more habits
+            self.user = User.objects.create_user(
+                email=f"user{habits_count}@test.com", password="test"
+            )
+            habits = Habit.objects.bulk_create(
+                Habit(
+                    owner=self.user,
+                    place="home",
+                    time="20:00",
+                    action="read",
+                    execution_time=10,
+                )
+                for _ in range(habits_count)
+            )
+            HabitNotification.objects.bulk_create(
+                HabitNotification(habit=habit, date=timezone.now().date())
+                for habit in habits
+            )
+            token = RefreshToken.for_user(self.user).access_token
+            self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+
+        add_user(habits_count=1)
+        self.assertQueriesDoNotGrow("users.views.MeView.delete", delete_me, add_user)